@@ -0,0 +1,205 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+
+import asyncio
+import subprocess
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from voxalign.jobs import AlignmentJob, DiceJob, MNILookupJob
+from voxalign.perf import current_tool, record_stage
+from voxalign.scheduler import command_stage, scheduler, tool_env, tool_runner
+
+# asyncio front end to the pipelines. Each job's pipeline code runs in a worker thread, but every
+# external tool it starts is handed back to the event loop and run with asyncio.create_subprocess_exec,
+# so one process can keep dozens of jobs in flight while it mostly waits on child processes.
+
+async def acquire(stage, cost=None):
+    """Wait (without blocking the event loop) until `stage` fits in the scheduler budget and take its share."""
+    loop = asyncio.get_running_loop()
+    while True:
+        released = loop.create_future()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(lambda: released.done() or released.set_result(None))
+            except RuntimeError: # the loop has closed
+                pass
+
+        # registered before trying, so that a release in between still wakes this task
+        scheduler.notify_on_release(wake)
+        taken = scheduler.try_acquire(stage, cost)
+        if taken is not None:
+            return taken
+        await released
+
+async def run_tool_async(command, stage=None, cost=None, check=False, cwd=None, timeout=None, on_output=None):
+    """Run an external tool without blocking the event loop, within the shared scheduler budget.
+
+    `command` is an argument list, or a string run by /bin/sh like run_tool's. Each line the tool
+    writes is passed to `on_output(stage, stream, line)` as it arrives ('stdout' or 'stderr').
+    The tool is killed if it runs longer than `timeout` seconds (raising subprocess.TimeoutExpired)
+    or if the calling task is cancelled. Returns a CompletedProcess with the output as text.
+    """
+    stage = stage or command_stage(command)
+    args = ["/bin/sh", "-c", command] if isinstance(command, str) else [str(a) for a in command]
+    requested = time.perf_counter()
+    taken = await acquire(stage, cost)
+
+    started = time.perf_counter()
+    returncode = -1
+    try:
+        process = await asyncio.create_subprocess_exec(*args, cwd=cwd, env=tool_env(taken[0]),
+                                                       stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        output = {"stdout": [], "stderr": []}
+
+        async def read(stream, name):
+            async for line in stream:
+                text = line.decode(errors='replace')
+                output[name].append(text)
+                if on_output:
+                    on_output(stage, name, text.rstrip('\n'))
+
+        try:
+            await asyncio.wait_for(asyncio.gather(read(process.stdout, "stdout"), read(process.stderr, "stderr"), process.wait()), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise subprocess.TimeoutExpired(command, timeout, ''.join(output["stdout"]), ''.join(output["stderr"]))
+        except BaseException:
+            # cancelled: don't leave the tool running
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+
+        returncode = process.returncode
+        result = subprocess.CompletedProcess(command, returncode, ''.join(output["stdout"]), ''.join(output["stderr"]))
+        if check:
+            result.check_returncode()
+        return result
+    finally:
+        scheduler.release(*taken)
+        record_stage(stage, time.perf_counter() - started, started - requested, returncode)
+
+
+class JobBridge:
+    """Runs jobs from voxalign.jobs on an event loop, with their pipeline code on the bridge's own threads.
+
+    The threads are kept apart from the loop's default executor (which asyncio also uses for
+    getaddrinfo and to_thread), so long jobs never starve the host application. There are as many
+    as the scheduler has cores by default, since each job's tools need at least one of them. Use
+    as `async with JobBridge() as bridge: await bridge.run_job(job)`, or call shutdown() when done.
+    """
+
+    def __init__(self, max_workers=None):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers or scheduler.max_cpus, thread_name_prefix="voxalign-job")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.shutdown(wait=False)
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait, cancel_futures=True)
+
+    async def run_job(self, job, log=print, timeout=None, tool_timeout=None, on_output=None):
+        """Run a job on the running event loop and return its result.
+
+        `log` and `on_output` are called on the event loop thread. `timeout` limits the whole job and
+        `tool_timeout` each external tool run. Cancelling the job (or hitting its timeout) kills the
+        tool it is waiting on, and the pipeline stops at that point.
+        """
+        loop = asyncio.get_running_loop()
+        pending = set()
+        tool_tasks = set()
+        cancelled = False
+
+        def run_on_loop(command, stage, cost, check, cwd):
+            # called from the job's threads in place of run_tool; blocks that thread, not the loop
+            if cancelled:
+                raise asyncio.CancelledError()
+            tool = current_tool.get()
+
+            async def run():
+                current_tool.set(tool)
+                tool_tasks.add(asyncio.current_task())
+                return await run_tool_async(command, stage, cost, check, cwd, tool_timeout, on_output)
+
+            future = asyncio.run_coroutine_threadsafe(run(), loop)
+            pending.add(future)
+            if cancelled:
+                future.cancel()
+            try:
+                return future.result()
+            finally:
+                pending.discard(future)
+
+        def job_log(*args):
+            loop.call_soon_threadsafe(log, *args)
+
+        def run_in_thread():
+            tool_runner.set(run_on_loop)
+            return job.run(log=job_log)
+
+        worker = loop.run_in_executor(self.pool, copy_context().run, run_in_thread)
+        try:
+            return await asyncio.wait_for(asyncio.shield(worker), timeout)
+        except BaseException:
+            cancelled = True
+            for future in list(pending):
+                future.cancel()
+            # let the pipeline unwind and its tools be killed and released before reporting the cancellation
+            await asyncio.gather(worker, *tool_tasks, return_exceptions=True)
+            raise
+
+# the bridge used by the functions below, one per event loop, shut down once its loop is gone
+default_bridges = weakref.WeakKeyDictionary()
+
+def default_bridge():
+    loop = asyncio.get_running_loop()
+    if loop not in default_bridges:
+        bridge = default_bridges[loop] = JobBridge()
+        weakref.finalize(loop, bridge.shutdown, False)
+    return default_bridges[loop]
+
+async def run_job(job, log=print, timeout=None, tool_timeout=None, on_output=None, bridge=None):
+    """Run a job from voxalign.jobs on the running event loop (see JobBridge.run_job), by default on the loop's shared bridge."""
+    return await (bridge or default_bridge()).run_job(job, log, timeout, tool_timeout, on_output)
+
+
+async def run_alignment(output_folder, session1_T1_dicom, session2_T1_dicom, spectroscopy_files, log=print,
+                        timeout=None, tool_timeout=None, on_output=None, **options):
+    """Async run_alignment; `options` are AlignmentJob's (tissue, progressive, registration)."""
+    job = AlignmentJob(output_folder, session1_T1_dicom, session2_T1_dicom, tuple(spectroscopy_files), **options)
+    return await run_job(job, log, timeout, tool_timeout, on_output)
+
+async def run_mni_lookup(output_folder, T1_dicom, MNI_coords, log=print, timeout=None, tool_timeout=None, on_output=None, **options):
+    """Async run_mni_lookup; `options` are MNILookupJob's (nonlin_path, fast_registration)."""
+    job = MNILookupJob(output_folder, T1_dicom, tuple(map(tuple, MNI_coords)), **options)
+    return await run_job(job, log, timeout, tool_timeout, on_output)
+
+async def run_dice(outdir, sess1T1, sess2T1, sess1svs, sess2svs, log=print, timeout=None, tool_timeout=None, on_output=None):
+    """Async run_dice."""
+    return await run_job(DiceJob(outdir, sess1T1, sess2T1, sess1svs, sess2svs), log, timeout, tool_timeout, on_output)
@@ -0,0 +1,286 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import os
+import resource
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import nibabel as nib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from voxalign.jobs import AlignmentJob, DiceJob, MNILookupJob
+from voxalign.registration import get_backend
+from voxalign.scheduler import scheduler
+from voxalign.standin import install_fsldir, install_standins
+from voxalign.utils import rotation_matrix
+
+def synthetic_head(shape=(96, 112, 96), voxel_size=2.0, seed=0):
+    """A T1-like skull stripped head: a brain ellipsoid with darker blobs so that every rotation is visible."""
+    rng = np.random.default_rng(seed)
+    affine = np.diag([voxel_size] * 3 + [1.0])
+    affine[:3, 3] = -(np.asarray(shape) - 1) / 2 * voxel_size
+    coords = nib.affines.apply_affine(affine, np.indices(shape).reshape(3, -1).T).reshape(shape + (3,))
+    data = np.zeros(shape, dtype=np.float32)
+    data[np.sum((coords / [65, 80, 60]) ** 2, axis=-1) < 1] = 100
+    for _ in range(12):
+        centre = rng.uniform([-45, -55, -40], [45, 55, 40])
+        radii = rng.uniform(5, 15, size=3)
+        data[np.sum(((coords - centre) / radii) ** 2, axis=-1) < 1] = rng.uniform(20, 70)
+    # smooth intensity variation, as from the receive coils
+    data *= (1 + 0.1 * np.sin(coords[..., 0] / 20) * np.cos(coords[..., 1] / 25)).astype(np.float32)
+    return nib.Nifti1Image(data, affine)
+
+def random_rigid_transform(rng, max_rotation=10.0, max_translation=10.0):
+    transform = np.eye(4)
+    transform[:3, :3] = rotation_matrix(rng.uniform(-max_rotation, max_rotation, size=3))
+    transform[:3, 3] = rng.uniform(-max_translation, max_translation, size=3)
+    return transform
+
+def synthetic_cases(folder, n_cases=5, seed=0):
+    """Write a reference head and `n_cases` moved copies of it, returning (in_file, ref_file, true transform).
+
+    Each moved copy has the same voxels as the reference and only its header affine changes, so the
+    transform that maps it back onto the reference is known exactly.
+    """
+    rng = np.random.default_rng(seed)
+    ref = synthetic_head(seed=seed)
+    ref_file = os.path.join(folder, 'ref.nii.gz')
+    nib.save(ref, ref_file)
+    cases = []
+    for i in range(n_cases):
+        transform = random_rigid_transform(rng)
+        in_file = os.path.join(folder, f'moved_{i}.nii.gz')
+        nib.save(nib.Nifti1Image(np.asanyarray(ref.dataobj), np.linalg.inv(transform) @ ref.affine), in_file)
+        cases.append((in_file, ref_file, transform))
+    return cases
+
+def transform_error(estimate, truth, radius=70.0, n_points=2000, seed=0):
+    """RMS distance (mm) between where two transforms put points spread through a brain-sized sphere."""
+    rng = np.random.default_rng(seed)
+    points = rng.normal(size=(n_points, 3))
+    points *= (radius * rng.uniform(size=(n_points, 1)) ** (1 / 3)) / np.linalg.norm(points, axis=1, keepdims=True)
+    difference = nib.affines.apply_affine(estimate, points) - nib.affines.apply_affine(truth, points)
+    return float(np.sqrt(np.mean(np.sum(difference ** 2, axis=1))))
+
+def benchmark_registration(backends=("fsl", "numpy"), n_cases=5, seed=0, log=print):
+    """Run each backend's rigid registration on the same synthetic cases.
+
+    Returns one dict per backend with the mean and worst runtime (s), the peak memory (MB, of the
+    Python process for in-process backends or of the largest tool run for external ones) and
+    the mean and worst error (mm).
+    """
+    summaries = []
+    with tempfile.TemporaryDirectory(prefix='voxalign_benchmark_') as folder:
+        cases = synthetic_cases(folder, n_cases, seed)
+        for name in backends:
+            backend = get_backend(name)
+            if not backend.available():
+                log(f"{name}: not available, skipped")
+                continue
+            times, errors, memory = [], [], []
+            for i, (in_file, ref_file, truth) in enumerate(cases):
+                tracemalloc.start()
+                start = time.perf_counter()
+                estimate = backend.rigid(in_file, ref_file, omat=os.path.join(folder, f'{name}_{i}.mat'))
+                times.append(time.perf_counter() - start)
+                peak = tracemalloc.get_traced_memory()[1] / 1e6
+                tracemalloc.stop()
+                # ru_maxrss is in kB on Linux
+                children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1e3
+                memory.append(max(peak, children) if name != "numpy" else peak)
+                errors.append(transform_error(estimate, truth))
+                log(f"{name} case {i}: {times[-1]:.2f} s, error {errors[-1]:.2f} mm")
+            summaries.append({"backend": name, "mean_time_s": float(np.mean(times)), "max_time_s": float(np.max(times)),
+                              "peak_memory_mb": float(np.max(memory)), "mean_error_mm": float(np.mean(errors)),
+                              "max_error_mm": float(np.max(errors))})
+    return summaries
+
+def fastest_backend(summaries, max_error_mm):
+    """The fastest backend whose worst error is within `max_error_mm`, or None."""
+    accurate = [s for s in summaries if s["max_error_mm"] <= max_error_mm]
+    return min(accurate, key=lambda s: s["mean_time_s"])["backend"] if accurate else None
+
+
+# stand-in tool latencies (s) for benchmark_pipelines, roughly in proportion to the real tools on a 1 mm T1
+DEFAULT_LATENCIES = {"fnirt": 2.0, "fast": 1.0, "bet2": 0.5, "flirt": 0.3, "dcm2niix": 0.2, "spec2nii": 0.2, "default": 0.1}
+
+MR_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.4"
+MR_SPECTROSCOPY_STORAGE = "1.2.840.10008.5.1.4.1.1.4.2"
+
+def write_dicom(path, ds, sop_class):
+    """Write a DICOM file of `sop_class` from a dataset with everything but the file meta and identifiers."""
+    import pydicom
+    from pydicom.dataset import FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = ds.SOPClassUID = sop_class
+    ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID = generate_uid()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.preamble = b"\0" * 128
+    pydicom.dcmwrite(path, ds, enforce_file_format=True)
+
+def synthetic_T1_dicom(path, head, participant, study_date, frame_uid, series_description="T1 MPRAGE"):
+    """Write a NIfTI head as a multi-frame MR DICOM of `participant`, in the geometry that standin.dcm2niix reads back."""
+    from pydicom.dataset import Dataset
+    from pydicom.uid import generate_uid
+    lps = np.diag([-1, -1, 1, 1]) @ head.affine
+    zooms = head.header.get_zooms()[:3]
+    ds = Dataset()
+    ds.PatientID, ds.PatientName, ds.StudyDate, ds.StudyDescription = participant, participant, study_date, "voxalign benchmark"
+    ds.Modality, ds.ImageType, ds.SeriesDescription = "MR", ["ORIGINAL", "PRIMARY", "M"], series_description
+    ds.StudyInstanceUID, ds.SeriesInstanceUID, ds.FrameOfReferenceUID = generate_uid(), generate_uid(), frame_uid
+    ds.ImageOrientationPatient = [float(v) for v in np.concatenate([lps[:3, 0] / zooms[0], lps[:3, 1] / zooms[1]])]
+    ds.ImagePositionPatient = [float(v) for v in lps[:3, 3]]
+    ds.PixelSpacing, ds.SliceThickness = [float(zooms[1]), float(zooms[0])], float(zooms[2])
+    data = np.clip(np.rint(np.asanyarray(head.dataobj)), 0, 65535).astype('<u2')
+    ds.Columns, ds.Rows, ds.NumberOfFrames = data.shape
+    ds.SamplesPerPixel, ds.PhotometricInterpretation = 1, "MONOCHROME2"
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 16, 15, 0
+    ds.PixelData = data.transpose(2, 1, 0).tobytes()
+    write_dicom(path, ds, MR_IMAGE_STORAGE)
+
+def synthetic_svs_dicom(path, participant, study_date, centre, size=20.0):
+    """Write a single voxel spectroscopy DICOM header of `participant`: a `size` mm cube at `centre` (RAS mm)."""
+    from pydicom.dataset import Dataset
+    from pydicom.uid import generate_uid
+    ds = Dataset()
+    ds.PatientID, ds.PatientName, ds.StudyDate, ds.StudyDescription = participant, participant, study_date, "voxalign benchmark"
+    ds.Modality, ds.SeriesDescription, ds.DataPointColumns = "MR", "svs_press", 1024
+    ds.StudyInstanceUID, ds.SeriesInstanceUID = generate_uid(), generate_uid()
+    ds.ImageOrientationPatient = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
+    ds.ImagePositionPatient = [-float(centre[0]), -float(centre[1]), float(centre[2])]
+    ds.PixelSpacing, ds.SliceThickness = [size, size], size
+    write_dicom(path, ds, MR_SPECTROSCOPY_STORAGE)
+
+def synthetic_study(folder, n_participants, seed=0):
+    """Two sessions of DICOMs for each of `n_participants` in `folder`, returning {participant: {name: path}}.
+
+    Both sessions are the same head in the same place, but in different frames of reference,
+    so that the pipelines register them as they would after a repositioning.
+    """
+    from pydicom.uid import generate_uid
+    participants = {}
+    for i in range(n_participants):
+        participant = f"sub-{i + 1:02d}"
+        head = synthetic_head(seed=seed + i)
+        paths = {}
+        for session, date in ((1, "20250101"), (2, "20250201")):
+            paths[f"T1_{session}"] = str(Path(folder) / participant / f"ses-{session}_T1.dcm")
+            paths[f"svs_{session}"] = str(Path(folder) / participant / f"ses-{session}_acc.dcm")
+            Path(paths[f"T1_{session}"]).parent.mkdir(parents=True, exist_ok=True)
+            synthetic_T1_dicom(paths[f"T1_{session}"], head, participant, date, generate_uid())
+            synthetic_svs_dicom(paths[f"svs_{session}"], participant, date, centre=(2.0 * session, 20.0, 25.0))
+        participants[participant] = paths
+    return participants
+
+def pipeline_job(pipeline, output_folder, paths):
+    if pipeline == "align":
+        return AlignmentJob(output_folder, paths["T1_1"], paths["T1_2"], (paths["svs_1"],))
+    if pipeline == "mni-lookup":
+        return MNILookupJob(output_folder, paths["T1_2"], ((-4.0, 44.0, 20.0), (40.0, -20.0, 10.0)))
+    if pipeline == "dice":
+        return DiceJob(output_folder, paths["T1_1"], paths["T1_2"], paths["svs_1"], paths["svs_2"])
+    raise Exception(f"No benchmark for pipeline {pipeline}")
+
+@contextmanager
+def environment(**variables):
+    """Set environment variables for the duration of a block (tools inherit them), restoring the old values after."""
+    previous = {name: os.environ.get(name) for name in variables}
+    os.environ.update(variables)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+def tool_timings(db_path, start, end):
+    """(stage, start, duration) of the tool runs recorded between two wall clock times."""
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute("SELECT stage, recorded_at - duration_s, duration_s FROM timings WHERE stage != 'total' AND recorded_at BETWEEN ? AND ?",
+                            (start, end)).fetchall()
+    return rows
+
+def busy_time(runs):
+    """Wall time during which at least one tool was running: the length of the union of the runs' intervals."""
+    total, busy_until = 0.0, float('-inf')
+    for _, begin, duration in sorted(runs, key=lambda run: run[1]):
+        end = begin + duration
+        if end > busy_until:
+            total += end - max(begin, busy_until)
+            busy_until = end
+    return total
+
+def run_round(jobs, workers, db_path):
+    """Run jobs on `workers` threads, returning the wall time (s) and the tool runs recorded meanwhile."""
+    start, started = time.time(), time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(job.run, log=lambda text: None) for job in jobs]:
+            future.result()
+    wall = time.perf_counter() - started
+    return wall, tool_timings(db_path, start, time.time())
+
+def benchmark_pipelines(pipelines=("align", "mni-lookup", "dice"), n_jobs=4, latencies=None, seed=0, log=print):
+    """Run whole pipelines on synthetic DICOMs with stand-in external tools (see standin.py).
+
+    Each pipeline runs `n_jobs` jobs (one per synthetic participant) one after another, then all at
+    once on threads of this process. The overhead is the wall time during which no tool was running
+    (the pipeline's own file handling, header reads, image loads, checks and process spawning), as
+    opposed to the time in the tools themselves, which the stand-in latencies stand for. Returns
+    one dict per pipeline with the per job wall, tool and overhead times (s) of the serial runs, the
+    concurrent wall time and the speedup. The concurrent runs share the scheduler's budget (see
+    scheduler.py, VOXALIGN_MAX_CPUS), as the jobs of a voxalign server do.
+    """
+    latencies = dict(DEFAULT_LATENCIES if latencies is None else latencies)
+    summaries = []
+    with tempfile.TemporaryDirectory(prefix='voxalign_pipeline_benchmark_') as folder:
+        folder = Path(folder)
+        log(f"Writing synthetic DICOMs for {n_jobs} participants ...")
+        participants = synthetic_study(folder / 'dicom', n_jobs, seed)
+        bin_dir = install_standins(folder / 'bin')
+        fsl_dir = install_fsldir(folder / 'fsl', synthetic_head(shape=(91, 109, 91), seed=seed + 1000))
+        db_path = folder / 'perf_history.sqlite'
+        log(f"Stand-in tool latencies (s): {', '.join(f'{tool} {seconds}' for tool, seconds in latencies.items())}")
+        log(f"Scheduler budget: {scheduler.max_cpus} cpus, {scheduler.max_memory_gb:.1f} GB")
+        with environment(PATH=f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}", FSLDIR=str(fsl_dir), FSLOUTPUTTYPE="NIFTI_GZ",
+                         VOXALIGN_STANDIN_LATENCY=','.join(f"{tool}={seconds}" for tool, seconds in latencies.items()),
+                         VOXALIGN_PERF="1", VOXALIGN_PERF_DB=str(db_path), VOXALIGN_EXECUTOR="local"):
+            for pipeline in pipelines:
+                rounds = {}
+                for mode, workers in (("serial", 1), ("concurrent", n_jobs)):
+                    jobs = [pipeline_job(pipeline, str(folder / mode / pipeline / participant), paths) for participant, paths in participants.items()]
+                    for job in jobs:
+                        os.makedirs(getattr(job, "output_folder", None) or job.outdir, exist_ok=True)
+                    rounds[mode] = run_round(jobs, workers, db_path)
+                    log(f"{pipeline} {mode}: {rounds[mode][0]:.2f} s for {n_jobs} jobs")
+                serial_wall, runs = rounds["serial"]
+                tool_s = busy_time(runs)
+                summaries.append({"pipeline": pipeline, "jobs": n_jobs, "tool_runs": len(runs) / n_jobs,
+                                  "wall_s": serial_wall / n_jobs, "tool_s": tool_s / n_jobs, "overhead_s": (serial_wall - tool_s) / n_jobs,
+                                  "overhead_fraction": (serial_wall - tool_s) / serial_wall, "concurrent_wall_s": rounds["concurrent"][0],
+                                  "speedup": serial_wall / rounds["concurrent"][0]})
+    return summaries
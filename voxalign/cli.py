@@ -0,0 +1,232 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import argparse
+import os
+import sys
+from voxalign.benchmark import DEFAULT_LATENCIES, benchmark_pipelines, benchmark_registration, fastest_backend
+from voxalign.executors import EXECUTORS
+from voxalign.materialise import DERIVED_IMAGES, materialise
+from voxalign.perf import perf_db_path, stage_report
+from voxalign.pipelines import run_mni_lookup_batch
+from voxalign.registration import BACKENDS, RIGID_INITS
+from voxalign.resources import ATLASES
+from voxalign.results import export_parquet, query_results
+from voxalign.server import serve, submit_or_run
+from voxalign.transform_graph import TransformGraph, propagate_voxel
+from voxalign.utils import check_external_tools, format_prescription
+
+def abspath(path):
+    # jobs may run in a voxalign server with another working directory, so every path handed to them must be absolute
+    return os.path.abspath(path) if path else path
+
+def parse_coord(text):
+    return [float(c) for c in text.split(',')]
+
+def parse_latency(text):
+    tool, seconds = text.split('=')
+    return tool, float(seconds)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="voxalign", description="Command line interface to the voxalign tools. Jobs are sent to a running voxalign server if there is one.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("serve", help="start a voxalign server that keeps libraries and atlases loaded between jobs")
+
+    align = subparsers.add_parser("align", help="align session 1 spectroscopy voxel(s) to a session 2 T1 (same as run-voxalign)")
+    align.add_argument("--output-folder", required=True)
+    align.add_argument("--sess1-t1", required=True, help="session 1 T1 DICOM")
+    align.add_argument("--sess2-t1", required=True, help="session 2 T1 DICOM")
+    align.add_argument("--sess1-spec", required=True, nargs="+", help="session 1 spectroscopy DICOM(s)")
+    align.add_argument("--no-tissue", action="store_true", help="skip the GM/WM/CSF fractions of the voxels")
+    align.add_argument("--no-provisional", action="store_true", help="skip the provisional prescription from a coarse registration")
+    align.add_argument("--registration", default="fsl", choices=list(BACKENDS), help="registration backend for session 1 to session 2 (default fsl)")
+    align.add_argument("--rigid-init", default="header", choices=RIGID_INITS,
+                       help="start the registration from the scanner coordinates (header), also aligning centres of mass (com), or run the full search (default header)")
+
+    lookup = subparsers.add_parser("mni-lookup", help="find the native space position of MNI coordinates (same as mni-lookup)")
+    lookup.add_argument("--output-folder", required=True)
+    lookup.add_argument("--t1", required=True, help="T1 DICOM")
+    lookup.add_argument("--coord", required=True, action="append", type=parse_coord, help="MNI coordinate as x,y,z (can be repeated)")
+    lookup.add_argument("--nonlin-path", default=None, help="output folder of a previous mni-lookup run for this participant")
+    lookup.add_argument("--warm-start", default=None, help="output folder of a previous mni-lookup run for this participant to start a new (faster) registration from")
+    lookup.add_argument("--fast", action="store_true", help="use fast (less accurate) registration to MNI space")
+    lookup.add_argument("--executor", default=None, choices=EXECUTORS, help="where the nonlinear registration runs (default $VOXALIGN_EXECUTOR or local)")
+
+    batch = subparsers.add_parser("mni-lookup-batch", help="MNI lookups for a whole study from a CSV table, several participants at a time")
+    batch.add_argument("table", help="CSV with participant,T1_dicom,x,y,z columns (one row per coordinate) and optionally nonlin_path")
+    batch.add_argument("--output-root", required=True, help="each participant's outputs go in <output root>/<participant>")
+    batch.add_argument("--fast", action="store_true", help="use fast (less accurate) registration to MNI space")
+    batch.add_argument("--executor", default=None, choices=EXECUTORS, help="where the nonlinear registration runs (default $VOXALIGN_EXECUTOR or local)")
+    batch.add_argument("--workers", type=int, default=None, help="participants to run at once (default: as many as fit in the cores and memory)")
+    batch.add_argument("--results", default=None, help="table of native positions to write (default <output root>/mni_lookup_results.csv)")
+
+    dice = subparsers.add_parser("dice", help="calculate the Dice coefficient between voxels from two sessions (same as dice-coef)")
+    dice.add_argument("--output-folder", required=True)
+    dice.add_argument("--sess1-t1", required=True, help="session 1 T1 DICOM/NIFTI")
+    dice.add_argument("--sess2-t1", required=True, help="session 2 T1 DICOM/NIFTI")
+    dice.add_argument("--sess1-spec", required=True, help="session 1 spectroscopy DICOM/NIFTI")
+    dice.add_argument("--sess2-spec", required=True, help="session 2 spectroscopy DICOM/NIFTI")
+
+    place = subparsers.add_parser("place", help="place a voxel to cover an atlas region, maximising grey matter and staying inside the brain")
+    place.add_argument("--output-folder", required=True)
+    place.add_argument("--t1", required=True, help="T1 DICOM")
+    place.add_argument("--region", required=True, help="atlas label, e.g. 'Middle Frontal Gyrus'")
+    place.add_argument("--atlas", default="Harvard-Oxford Cortical Structural Atlas", choices=list(ATLASES))
+    place.add_argument("--hemisphere", choices=["left", "right"], default=None)
+    place.add_argument("--dims", type=parse_coord, default=[20.0, 20.0, 20.0], help="voxel dimensions in mm as x,y,z (default 20,20,20)")
+    place.add_argument("--max-angle", type=float, default=20, help="largest rotation about each axis to try, in degrees (default 20)")
+    place.add_argument("--min-brain", type=float, default=0.98, help="smallest fraction of the voxel that must be inside the brain mask (default 0.98)")
+    place.add_argument("--nonlin-path", default=None, help="output folder of a previous mni-lookup run for this participant")
+    place.add_argument("--warm-start", default=None, help="output folder of a previous mni-lookup run for this participant to start a new (faster) registration from")
+    place.add_argument("--fast", action="store_true", help="use fast (less accurate) registration to MNI space")
+    place.add_argument("--executor", default=None, choices=EXECUTORS, help="where the nonlinear registration runs (default $VOXALIGN_EXECUTOR or local)")
+
+    bench = subparsers.add_parser("benchmark-registration", help="compare registration backends on synthetic T1s with known transforms")
+    bench.add_argument("--backend", action="append", choices=list(BACKENDS), help="backend to run (can be repeated, default all)")
+    bench.add_argument("--cases", type=int, default=5, help="number of synthetic cases (default 5)")
+    bench.add_argument("--max-error", type=float, default=1.0, help="accuracy requirement in mm, for picking the fastest backend (default 1.0)")
+
+    bench_pipelines = subparsers.add_parser("benchmark-pipelines", help="time the pipelines' own overhead and concurrency on synthetic DICOMs with stand-in external tools")
+    bench_pipelines.add_argument("--pipeline", action="append", choices=["align", "mni-lookup", "dice"], help="pipeline to run (can be repeated, default all)")
+    bench_pipelines.add_argument("--jobs", type=int, default=4, help="number of synthetic participants, run one after another and then all at once (default 4)")
+    bench_pipelines.add_argument("--latency", type=parse_latency, action="append",
+                                 help=f"stand-in tool latency as tool=seconds, or default=seconds (can be repeated, default {','.join(f'{t}={s}' for t, s in DEFAULT_LATENCIES.items())})")
+
+    derived = subparsers.add_parser("materialise", help="make an image that the pipelines skip because only viewers need it")
+    derived.add_argument("output_folder")
+    derived.add_argument("name", choices=list(DERIVED_IMAGES))
+
+    perf = subparsers.add_parser("perf", help="latency percentiles per host and stage from the timing history, flagging regressions")
+    perf.add_argument("--db", default=None, help="timing history (default ~/.voxalign/perf_history.sqlite or $VOXALIGN_PERF_DB)")
+    perf.add_argument("--host", default=None)
+    perf.add_argument("--stage", default=None, help="e.g. fnirt, or total for whole runs")
+    perf.add_argument("--recent", type=int, default=5, help="number of latest runs compared with the history before them (default 5)")
+    perf.add_argument("--threshold", type=float, default=1.5, help="flag stages whose recent median is this many times slower (default 1.5)")
+
+    results = subparsers.add_parser("results", help="list records from a study's results store")
+    results.add_argument("db", help=f"results store, e.g. <study folder>/voxalign_results.sqlite")
+    results.add_argument("--tool", choices=["align", "mni-lookup", "dice", "place"])
+    results.add_argument("--participant")
+    results.add_argument("--session")
+    results.add_argument("--roi")
+    results.add_argument("--parquet", help="write the records to this Parquet file instead of printing them")
+
+    propagate = subparsers.add_parser("propagate", help="carry a voxel between any two of a participant's sessions using cached registrations")
+    propagate.add_argument("graph", help="participant transform graph, e.g. <study folder>/transform_graphs/<participant>.json")
+    propagate.add_argument("--list", action="store_true", help="list the T1 series in the graph")
+    propagate.add_argument("--from-series", help="SeriesInstanceUID of the T1 the voxel was prescribed on")
+    propagate.add_argument("--to-series", help="SeriesInstanceUID of the T1 to prescribe on")
+    propagate.add_argument("--spec", help="spectroscopy NIFTI from the earlier session")
+    propagate.add_argument("--out", help="where to write the transformed spectroscopy NIFTI")
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    try:
+        if args.command == "serve":
+            serve()
+        elif args.command == "align":
+            check_external_tools()
+            submit_or_run("align", output_folder=abspath(args.output_folder), session1_T1_dicom=abspath(args.sess1_t1),
+                          session2_T1_dicom=abspath(args.sess2_t1), spectroscopy_files=[abspath(f) for f in args.sess1_spec],
+                          tissue=not args.no_tissue, progressive=not args.no_provisional, registration=args.registration,
+                          rigid_init=args.rigid_init)
+        elif args.command == "mni-lookup":
+            check_external_tools()
+            submit_or_run("mni-lookup", output_folder=abspath(args.output_folder), T1_dicom=abspath(args.t1), MNI_coords=args.coord,
+                          nonlin_path=abspath(args.nonlin_path), fast_registration=args.fast, executor=args.executor,
+                          warm_start_path=abspath(args.warm_start))
+        elif args.command == "mni-lookup-batch":
+            check_external_tools()
+            os.makedirs(args.output_root, exist_ok=True)
+            rows = run_mni_lookup_batch(abspath(args.table), abspath(args.output_root), fast_registration=args.fast,
+                                        workers=args.workers, results_file=abspath(args.results), executor=args.executor)
+            if any(row["error"] for row in rows):
+                sys.exit(1)
+        elif args.command == "dice":
+            submit_or_run("dice", outdir=abspath(args.output_folder), sess1T1=abspath(args.sess1_t1), sess2T1=abspath(args.sess2_t1),
+                          sess1svs=abspath(args.sess1_spec), sess2svs=abspath(args.sess2_spec))
+        elif args.command == "place":
+            check_external_tools()
+            submit_or_run("place", output_folder=abspath(args.output_folder), T1_dicom=abspath(args.t1), region=args.region,
+                          dims=args.dims, atlas=args.atlas, hemisphere=args.hemisphere, nonlin_path=abspath(args.nonlin_path),
+                          fast_registration=args.fast, max_angle=args.max_angle, min_brain=args.min_brain, executor=args.executor,
+                          warm_start_path=abspath(args.warm_start))
+        elif args.command == "benchmark-registration":
+            summaries = benchmark_registration(args.backend or list(BACKENDS), n_cases=args.cases)
+            print("\nbackend\tmean time (s)\tmax time (s)\tpeak memory (MB)\tmean error (mm)\tmax error (mm)")
+            for s in summaries:
+                print(f"{s['backend']}\t{s['mean_time_s']:.2f}\t{s['max_time_s']:.2f}\t{s['peak_memory_mb']:.0f}\t{s['mean_error_mm']:.2f}\t{s['max_error_mm']:.2f}")
+            best = fastest_backend(summaries, args.max_error)
+            print(f"\nFastest backend within {args.max_error} mm: {best or 'none'}")
+        elif args.command == "benchmark-pipelines":
+            latencies = dict(DEFAULT_LATENCIES, **dict(args.latency)) if args.latency else None
+            summaries = benchmark_pipelines(args.pipeline or ["align", "mni-lookup", "dice"], n_jobs=args.jobs, latencies=latencies)
+            print("\npipeline\ttool runs/job\twall/job (s)\ttools/job (s)\toverhead/job (s)\toverhead (%)\tconcurrent wall (s)\tspeedup")
+            for s in summaries:
+                print(f"{s['pipeline']}\t{s['tool_runs']:.0f}\t{s['wall_s']:.2f}\t{s['tool_s']:.2f}\t{s['overhead_s']:.2f}\t{100 * s['overhead_fraction']:.0f}\t{s['concurrent_wall_s']:.2f}\t{s['speedup']:.2f}")
+        elif args.command == "materialise":
+            outputs = materialise(abspath(args.output_folder), args.name)
+            for output in (outputs if isinstance(outputs, list) else [outputs]):
+                print(output)
+        elif args.command == "perf":
+            report = stage_report(args.db or perf_db_path(), host=args.host, stage=args.stage, recent=args.recent, threshold=args.threshold)
+            print("host\tstage\truns\tp50 (s)\tp90 (s)\tp99 (s)\trecent/history\tversion")
+            for entry in report:
+                ratio = f"{entry['ratio']:.2f}" if entry['ratio'] is not None else "-"
+                version = entry['version'] or ''
+                if entry['previous_version'] and entry['previous_version'] != entry['version']:
+                    version += f" (was {entry['previous_version']})"
+                flag = "\tREGRESSED" if entry['regressed'] else ""
+                print(f"{entry['host']}\t{entry['stage']}\t{entry['runs']}\t{entry['p50_s']:.2f}\t{entry['p90_s']:.2f}\t{entry['p99_s']:.2f}\t{ratio}\t{version}{flag}")
+            if any(entry['regressed'] for entry in report):
+                sys.exit(1)
+        elif args.command == "results":
+            filters = {key: getattr(args, key) for key in ["tool", "participant", "session", "roi"] if getattr(args, key)}
+            if args.parquet:
+                n = export_parquet(args.db, args.parquet, **filters)
+                print(f"Wrote {n} records to {args.parquet}")
+            else:
+                columns = ["tool", "participant", "session", "roi", "position", "orientation", "rotation", "dice"]
+                print('\t'.join(columns))
+                for record in query_results(args.db, **filters):
+                    print('\t'.join('' if record[c] is None else str(record[c]) for c in columns))
+        elif args.command == "propagate":
+            graph = TransformGraph(args.graph)
+            if args.list:
+                for series, info in graph.sessions.items():
+                    print(f"{series}\t{info.get('date', '')}\t{info.get('description', '')}")
+                return
+            if not (args.from_series and args.to_series and args.spec and args.out):
+                raise Exception("--from-series, --to-series, --spec and --out are required")
+            aligned_spec = propagate_voxel(graph, args.from_series, args.to_series, args.spec, args.out)
+            # the same lines as the pipelines' prescriptions, with the centre of the voxel (or of a CSI slab)
+            for line in format_prescription(aligned_spec):
+                print(line)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
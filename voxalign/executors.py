@@ -0,0 +1,192 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from voxalign.perf import record_stage
+from voxalign.scheduler import STAGE_COSTS, DEFAULT_COST, run_tool, scheduler
+
+# Heavy stages (the nonlinear registration to MNI space) are handed to an executor instead of being
+# run directly, so they can go to a process pool or a cluster queue while the pipeline waits.
+# Every executor takes a shell command with paths relative to `cwd`, plus the input files it reads and
+# the output files it writes (also relative to `cwd`), and leaves the outputs in `cwd`.
+
+class LocalExecutor:
+    """Run the command here, through the shared scheduler (the default)."""
+    name = "local"
+
+    def run(self, command, inputs, outputs, cwd, stage=None, cost=None):
+        return run_tool(command, stage=stage, cost=cost, check=True, cwd=cwd)
+
+
+def _set_worker_budget(max_cpus, max_memory_gb):
+    scheduler.max_cpus, scheduler.max_memory_gb = max_cpus, max_memory_gb
+
+def _run_in_worker(command, stage, cost, cwd):
+    return run_tool(command, stage=stage, cost=cost, check=True, cwd=cwd)
+
+@lru_cache(maxsize=None)
+def shared_pool(workers=None):
+    # each worker process has its own scheduler, so this process's budget is split between them
+    workers = workers or os.cpu_count() or 1
+    return ProcessPoolExecutor(max_workers=workers, initializer=_set_worker_budget,
+                               initargs=(max(1, scheduler.max_cpus // workers), scheduler.max_memory_gb / workers))
+
+class PoolExecutor:
+    """Run the command from a pool of worker processes, each with an equal share of the scheduler budget."""
+    name = "pool"
+
+    def __init__(self, workers=None):
+        self.pool = shared_pool(workers)
+
+    def run(self, command, inputs, outputs, cwd, stage=None, cost=None):
+        return self.pool.submit(_run_in_worker, command, stage, cost, cwd).result()
+
+
+def read_exitcode(path):
+    """The exit code a batch job script wrote, or None if it isn't there (or visible here) yet."""
+    try:
+        # listing the folder makes NFS clients revalidate their cached view of it
+        os.listdir(os.path.dirname(path))
+        with open(path) as file:
+            return int(file.read().strip())
+    except (OSError, ValueError):
+        return None
+
+class BatchQueueExecutor:
+    """Submit the command as a batch job (e.g. SLURM's sbatch) and wait for it.
+
+    The inputs are copied to a fresh folder in `staging_dir`, which must be visible from the compute
+    nodes; the job script runs the command there and writes its exit code, and the outputs are
+    copied back once it has. `status_command` is only used to notice jobs that ended without
+    getting that far (killed, out of time, ...); the exit code gets `exitcode_grace` seconds after
+    the queue reports the job finished to show up, since shared filesystems (NFS) may cache the
+    folder listing. Commands are formatted with {job_id}, {cpus},
+    {memory_mb}, {name} and {script}.
+    """
+    name = "batch"
+    FINISHED_STATES = {"", "COMPLETED", "FAILED", "CANCELLED", "TIMEOUT", "NODE_FAIL", "OUT_OF_MEMORY", "BOOT_FAIL", "PREEMPTED"}
+
+    def __init__(self, staging_dir, submit_command="sbatch --parsable --job-name={name} --cpus-per-task={cpus} --mem={memory_mb}M {script}",
+                 status_command="squeue --noheader --format=%T --jobs={job_id}", cancel_command="scancel {job_id}", poll_interval=10.0,
+                 exitcode_grace=60.0):
+        self.staging_dir = staging_dir
+        self.submit_command = submit_command
+        self.status_command = status_command
+        self.cancel_command = cancel_command
+        self.poll_interval = poll_interval
+        self.exitcode_grace = exitcode_grace
+
+    def queue_command(self, template, **fields):
+        result = subprocess.run(template.format(**fields), shell=True, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise Exception(f"Batch queue command failed: {template.format(**fields)}\n{result.stderr.strip()}")
+        return result.stdout.strip()
+
+    def run(self, command, inputs, outputs, cwd, stage=None, cost=None):
+        stage = stage or command.split()[0]
+        cpus, memory_gb = cost or STAGE_COSTS.get(stage, DEFAULT_COST)
+        os.makedirs(self.staging_dir, exist_ok=True)
+        workspace = tempfile.mkdtemp(prefix=f'{stage}_', dir=self.staging_dir)
+        try:
+            for name in inputs:
+                os.makedirs(os.path.dirname(os.path.join(workspace, name)), exist_ok=True)
+                shutil.copy2(os.path.join(cwd, name), os.path.join(workspace, name))
+            script = os.path.join(workspace, 'job.sh')
+            with open(script, 'w') as file:
+                file.write("#!/bin/sh\n")
+                file.write(f"cd {shlex.quote(workspace)}\n")
+                file.write(f"( {command} ) > job.out 2> job.err\n")
+                # written in full before it appears under its name, so a poller never reads it half written
+                file.write("echo $? > job.exitcode.tmp && mv job.exitcode.tmp job.exitcode\n")
+            os.chmod(script, 0o755)
+
+            fields = {"name": f"voxalign_{stage}", "cpus": cpus, "memory_mb": int(memory_gb * 1024), "script": script}
+            submitted = time.perf_counter()
+            # sbatch --parsable prints "<job id>[;<cluster>]"
+            job_id = self.queue_command(self.submit_command, **fields).split(';')[0].strip()
+            exitcode_file = os.path.join(workspace, 'job.exitcode')
+            started = None
+            finished = None
+            try:
+                while True:
+                    returncode = read_exitcode(exitcode_file)
+                    if returncode is not None:
+                        break
+                    if finished is not None and time.perf_counter() - finished > self.exitcode_grace:
+                        raise Exception(f"Batch job {job_id} ({stage}) ended without finishing its command (state: {state or 'gone from queue'})")
+                    time.sleep(self.poll_interval if finished is None else min(self.poll_interval, 1.0))
+                    state = self.queue_command(self.status_command, job_id=job_id, **fields).split('\n')[0].strip().upper()
+                    if state == "RUNNING" and started is None:
+                        started = time.perf_counter()
+                    if state in self.FINISHED_STATES and finished is None:
+                        finished = time.perf_counter()
+            except BaseException:
+                if read_exitcode(exitcode_file) is None:
+                    subprocess.run(self.cancel_command.format(job_id=job_id, **fields), shell=True, capture_output=True)
+                raise
+
+            with open(os.path.join(workspace, 'job.out')) as out, open(os.path.join(workspace, 'job.err')) as err:
+                result = subprocess.CompletedProcess(command, returncode, out.read(), err.read())
+            started = started or submitted
+            record_stage(stage, time.perf_counter() - started, started - submitted, returncode)
+            result.check_returncode()
+            for name in outputs:
+                shutil.copy2(os.path.join(workspace, name), os.path.join(cwd, name))
+            return result
+        finally:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+
+def get_executor(name=None):
+    """The executor called `name`, or by default the one in VOXALIGN_EXECUTOR (local if unset).
+
+    - local: run here
+    - pool: a process pool (VOXALIGN_POOL_WORKERS workers)
+    - slurm: sbatch/squeue/scancel, staging in VOXALIGN_STAGING_DIR
+    - localqueue: the same batch submission against voxalign.localqueue, a stand-in queue on this machine
+    """
+    name = name or os.environ.get('VOXALIGN_EXECUTOR', 'local')
+    if name == "local":
+        return LocalExecutor()
+    if name == "pool":
+        workers = os.environ.get('VOXALIGN_POOL_WORKERS')
+        return PoolExecutor(int(workers) if workers else None)
+    if name in ("slurm", "localqueue"):
+        staging_dir = os.environ.get('VOXALIGN_STAGING_DIR')
+        if not staging_dir:
+            raise Exception(f"Set VOXALIGN_STAGING_DIR to a folder the {name} jobs can read and write to use the {name} executor")
+        if name == "slurm":
+            return BatchQueueExecutor(staging_dir)
+        queue = f"{shlex.quote(sys.executable)} -m voxalign.localqueue"
+        return BatchQueueExecutor(staging_dir, submit_command=f"{queue} submit {{script}}", status_command=f"{queue} status {{job_id}}",
+                                  cancel_command=f"{queue} cancel {{job_id}}", poll_interval=0.5, exitcode_grace=2.0)
+    raise Exception(f"Unknown executor '{name}' (choose from {', '.join(EXECUTORS)})")
+
+EXECUTORS = ["local", "pool", "slurm", "localqueue"]
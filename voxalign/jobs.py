@@ -0,0 +1,117 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+
+from dataclasses import asdict, dataclass, field
+
+# Each job holds everything a pipeline needs (inputs, the output folder it works in, options), so
+# that jobs can be built up front, queued, and run side by side in threads of one process.
+# The pipelines return the result types below rather than dicts.
+
+@dataclass
+class Prescription:
+    """A voxel (or CSI grid) prescription written by the align or place pipeline."""
+    roi: str
+    position: str
+    orientation: str
+    rotation: float
+    dimensions: list
+    prescription_file: str
+    grid: list = field(default_factory=lambda: [1, 1, 1])
+    qc_image: str = None
+    registration_similarity: dict = None
+    suspect_registration: bool = False
+    previous_tissue: dict = None
+    new_tissue: dict = None
+    coverage: dict = None
+
+@dataclass
+class NativePosition:
+    """An MNI coordinate and the matching position (scanner mm) in the participant's T1."""
+    mni: list
+    native: list
+    position: str
+
+
+@dataclass(frozen=True)
+class AlignmentJob:
+    output_folder: str
+    session1_T1_dicom: str
+    session2_T1_dicom: str
+    spectroscopy_files: tuple
+    tissue: bool = True
+    progressive: bool = True
+    registration: str = "fsl"
+    rigid_init: str = "header"
+
+    def run(self, log=print):
+        """Returns a Prescription per spectroscopy file."""
+        from voxalign.pipelines import run_alignment
+        return run_alignment(log=log, **asdict(self))
+
+@dataclass(frozen=True)
+class MNILookupJob:
+    output_folder: str
+    T1_dicom: str
+    MNI_coords: tuple
+    nonlin_path: str = None
+    fast_registration: bool = False
+    executor: str = None
+    warm_start_path: str = None
+
+    def run(self, log=print):
+        """Returns a NativePosition per MNI coordinate."""
+        from voxalign.pipelines import run_mni_lookup
+        return run_mni_lookup(log=log, **asdict(self))
+
+@dataclass(frozen=True)
+class PlacementJob:
+    output_folder: str
+    T1_dicom: str
+    region: str
+    dims: tuple = (20, 20, 20)
+    atlas: str = "Harvard-Oxford Cortical Structural Atlas"
+    hemisphere: str = None
+    nonlin_path: str = None
+    fast_registration: bool = False
+    max_angle: float = 20
+    min_brain: float = 0.98
+    gm_weight: float = 1.0
+    executor: str = None
+    warm_start_path: str = None
+
+    def run(self, log=print):
+        """Returns the placed voxel's Prescription."""
+        from voxalign.pipelines import run_placement
+        return run_placement(log=log, **asdict(self))
+
+@dataclass(frozen=True)
+class DiceJob:
+    outdir: str
+    sess1T1: str
+    sess2T1: str
+    sess1svs: str
+    sess2svs: str
+
+    def run(self, log=print):
+        """Returns the Dice coefficient of the two voxels."""
+        from voxalign.pipelines import run_dice
+        return run_dice(log=log, **asdict(self))
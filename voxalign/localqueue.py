@@ -0,0 +1,99 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+
+import os
+import signal
+import subprocess
+import sys
+from pathlib import Path
+from voxalign.resources import VOXALIGN_HOME
+
+# A stand-in batch queue on this machine with sbatch/squeue/scancel-like commands, for trying out
+# and testing the batch executor without a cluster:
+#   python -m voxalign.localqueue submit <script>   prints a job id
+#   python -m voxalign.localqueue status <job id>   prints RUNNING or COMPLETED
+#   python -m voxalign.localqueue cancel <job id>
+
+def queue_dir():
+    return Path(os.environ.get('VOXALIGN_LOCALQUEUE_DIR', VOXALIGN_HOME / 'localqueue'))
+
+def submit(script):
+    folder = queue_dir()
+    folder.mkdir(parents=True, exist_ok=True)
+    # claim the next free job id, even if several jobs are submitted at once
+    job_id = max((int(p.stem) for p in folder.glob('*.pid')), default=0) + 1
+    while True:
+        try:
+            fd = os.open(folder / f'{job_id}.pid', os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            break
+        except FileExistsError:
+            job_id += 1
+    # the job outlives this command, in its own session so that it can be cancelled as a group
+    with open(folder / f'{job_id}.log', 'w') as log:
+        process = subprocess.Popen(["/bin/sh", script], stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    with os.fdopen(fd, 'w') as file:
+        file.write(str(process.pid))
+    return job_id
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    # a finished child of a queue process that is still alive shows up as a zombie
+    try:
+        return Path(f'/proc/{pid}/stat').read_text().split(')')[-1].split()[0] != 'Z'
+    except OSError:
+        return True
+
+def status(job_id):
+    pid_file = queue_dir() / f'{job_id}.pid'
+    if not pid_file.exists():
+        return ""
+    pid = pid_file.read_text().strip()
+    return "RUNNING" if not pid or is_running(int(pid)) else "COMPLETED"
+
+def cancel(job_id):
+    pid_file = queue_dir() / f'{job_id}.pid'
+    if pid_file.exists() and pid_file.read_text().strip():
+        try:
+            os.killpg(int(pid_file.read_text()), signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2 or argv[0] not in ("submit", "status", "cancel"):
+        print("usage: python -m voxalign.localqueue submit <script> | status <job id> | cancel <job id>", file=sys.stderr)
+        return 2
+    if argv[0] == "submit":
+        print(submit(argv[1]))
+    elif argv[0] == "status":
+        print(status(argv[1]))
+    else:
+        cancel(argv[1])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
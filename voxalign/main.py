@@ -19,16 +19,16 @@
 # ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
-import numpy as np
-import nibabel as nib
-import glob
 import subprocess
+import shutil
 import os
 import pydicom
-np.set_printoptions(suppress=True)
 from pathlib import Path
 import sys
-from voxalign.utils import check_external_tools, calc_prescription_from_nifti, convert_signs_to_letters, get_unique_filename, vox_to_scaled_FSL_vox
+from voxalign.utils import check_external_tools
+from voxalign.manifest import RUN_MANIFEST_NAME
+from voxalign.materialise import materialise
+from voxalign.server import submit_or_run
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QPushButton, QTextEdit, QVBoxLayout, QFileDialog, QMessageBox, QHBoxLayout, QLabel, QGroupBox, QFrame,QTableWidget, QTableWidgetItem,QHeaderView,QSizePolicy
 )
@@ -437,141 +437,40 @@ class VoxAlignApp(QWidget):
         try:
             check_external_tools()
 
-            # check that output folder is empty except for allowed files (input DICOMs)
-            allowed_files = self.get_allowed_files()
-            print(allowed_files)
-            # Walk through the output folder and abort if extra files are found
-            for root, dirs, files in os.walk(output_folder):
-                for fname in files:
-                    if fname.startswith('.'): #allow hidden files like .DS_Store
-                            continue
-                    fpath = Path(root) / fname
-                    if str(fpath.resolve()) not in allowed_files:
-                        print(str(fpath.resolve()))
-                        msg = "The selected output folder contains unexpected files." + \
-                            "\n\nPlease select an empty folder or one that only contains your selected DICOMs."
-                        QMessageBox.critical(self, "Invalid Output Folder", msg)
-                        self.run_button.setDisabled(False)
-                        return  # exit early
-
-            print("Running VoxAlign!")
-            print("\nOutput folder:", output_folder)
-            print("\nSession 1 T1 DICOM:", session1_T1_dicom)
-            print("\nSession 2 T1 DICOM:", session2_T1_dicom)
-            print("\nSession 1 Spectroscopy DICOMs:", selected_spectroscopy_files)
-
-            os.chdir(output_folder)
-            # read T1 DICOM headers to get info about study, date, participant, etc.
-            sess2T1_dicom_header = pydicom.dcmread(session2_T1_dicom,stop_before_pixels=True)
-
-            #convert session 1 T1 DICOM to NIFTI
-            command = f"dcm2niix -f sess1_T1 -o '{output_folder}' -s y -z n {session1_T1_dicom}"
-            result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
-
-            #skull strip session 1 T1
-            print("\n...\nSkull stripping session 1 T1 ...")
-            command = f"bet2 sess1_T1.nii sess1_T1_ss.nii"
-            result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
-
-            # Convert session 2 T1 DICOM to NIFTI
-            command = f"dcm2niix -f sess2_T1 -o '{output_folder}' -s y -z n {session2_T1_dicom}"
-            result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
-            #skull strip session 2 T1
-            print("Skull stripping session 2 T1 ...")
-            command = f"bet2 sess2_T1.nii sess2_T1_ss.nii"
-            result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
-
-            # use flirt to register session 1 T1 to session 2 T1
-            print("Aligning session 1 T1 to session 2 T1 ...")
-            command = f"flirt -in sess1_T1_ss.nii.gz -ref sess2_T1_ss.nii.gz -out sess1_T1_aligned -omat sess1tosess2.mat -dof 6"
-            result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
-
-            # Convert session 1 spectroscopy DICOM(s) to NIFTI & transform
-            for dcm in selected_spectroscopy_files:
-
-                #File names can be specified with the -f option and output directories with the -o option.
-                command = f"spec2nii 'dicom' -o '{output_folder}/sess1_svs/tmp' {dcm}"
-                result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
-
-                #start by placing spec niftis in a temp folder so we can make sure not to overwrite
-                tmp_nifti = glob.glob(f'{output_folder}/sess1_svs/tmp/*')[0]
-                suffix = ''.join(Path(tmp_nifti).suffixes)
-                roi=Path(tmp_nifti.removesuffix(suffix)).stem
-                #if a file already exists, append _2, _3, etc.
-                new_filename = get_unique_filename(f'sess1_svs/{roi}',suffix)
-                roi=Path(new_filename.removesuffix(suffix)).stem
-
-                command = f"mv {tmp_nifti} {new_filename}"
-                result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
-                command = "rm -r sess1_svs/tmp"
-                result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
-
-                spec_nii = nib.load(new_filename)
-                sess1_nii = nib.load('sess1_T1.nii')
-                sess2_nii = nib.load('sess2_T1.nii')
-
-                if sess1_nii.header.get_zooms() != sess2_nii.header.get_zooms():
-                    raise(Exception("Your session 1 and session 2 T1s must have the same voxel resolution"))
-
-                sess1to2affine = np.loadtxt('sess1tosess2.mat')
-
-                # combine affine transforms to go from sess 1 T1 -> sess 2 T1 via the flirt coregistration affine
-                # flirt affine is in scaled voxel coordinates, with a sign flip in x if the determinant is positive                    
-                sess1_voxtoFSL = vox_to_scaled_FSL_vox(sess1_nii)
-                sess2_voxtoFSL = vox_to_scaled_FSL_vox(sess2_nii)
-
-                transform =  sess2_nii.affine @ np.linalg.inv(sess2_voxtoFSL) @ sess1to2affine @ sess1_voxtoFSL @ np.linalg.inv(sess1_nii.affine)
-                new_affine = transform @ spec_nii.affine
-
-                aligned_spec = nib.load(new_filename) #start with session 1 spec nifti
-                aligned_spec.set_sform(new_affine,code='unknown')
-                aligned_spec.set_qform(new_affine,code='scanner')
-                nib.save(aligned_spec,f'{roi}_aligned.nii.gz')
-
-                slice_orientation_pitch,inplane_rot,[dimX,dimY,dimZ] = calc_prescription_from_nifti(spec_nii)
-                transvec = convert_signs_to_letters(np.round(spec_nii.affine[0:3,3],1))
-                print("\n-------------")
-                print(f"ROI: {roi}")
-                print("-------------")
-                print(f"PREVIOUS")
-                print(f'Position: {transvec}')
-                print(f"Orientation: {slice_orientation_pitch}")
-                print(f"Rotation: {inplane_rot:.2f} deg")
-                print(f"Dimensions: {dimX} mm x {dimY} mm x {dimZ} mm")
-
-                slice_orientation_pitch,inplane_rot,[dimX,dimY,dimZ] = calc_prescription_from_nifti(aligned_spec)
-                transvec = convert_signs_to_letters(np.round(aligned_spec.affine[0:3,3],1))
-
-                # Define the file name based on the ROI
-                filename = f"{roi}_prescription.txt"
-                print(f"\nTODAY")
-                print(f'Position: {transvec}')
-                print(f"Orientation: {slice_orientation_pitch}")
-                print(f"Rotation: {inplane_rot:.2f} deg")
-                print(f"Dimensions: {dimX} mm x {dimY} mm x {dimZ} mm")
-
+            # check that output folder is empty except for allowed files (input DICOMs),
+            # unless it holds an earlier VoxAlign run, which is picked up where it left off
+            if (Path(output_folder) / RUN_MANIFEST_NAME).exists():
+                print(f"\nResuming the VoxAlign run in {output_folder}: stages whose inputs are unchanged will be skipped")
+            else:
+                allowed_files = self.get_allowed_files()
+                print(allowed_files)
+                # Walk through the output folder and abort if extra files are found
+                for root, dirs, files in os.walk(output_folder):
+                    for fname in files:
+                        if fname.startswith('.'): #allow hidden files like .DS_Store
+                                continue
+                        fpath = Path(root) / fname
+                        if str(fpath.resolve()) not in allowed_files:
+                            print(str(fpath.resolve()))
+                            msg = "The selected output folder contains unexpected files." + \
+                                "\n\nPlease select an empty folder, one that only contains your selected DICOMs, or the output folder of an earlier VoxAlign run."
+                            QMessageBox.critical(self, "Invalid Output Folder", msg)
+                            self.run_button.setDisabled(False)
+                            return  # exit early
+
+            submit_or_run("align", output_folder=str(output_folder), session1_T1_dicom=session1_T1_dicom,
+                          session2_T1_dicom=session2_T1_dicom, spectroscopy_files=selected_spectroscopy_files)
+
+            # QC images are always written; open fsleyes as well for a closer look if it is installed
+            if shutil.which("fsleyes"):
                 try:
-                    with open(filename, 'w') as file:
-                        file.write(f"Study: {sess2T1_dicom_header.StudyDescription}")
-                        file.write(f"\nDate: {sess2T1_dicom_header.StudyDate}")
-                        file.write(f"\nParticipant: {sess2T1_dicom_header.PatientID}")
-                        file.write(f'\nSession 1 T1 DICOM file: {Path(session1_T1_dicom).name}')
-                        file.write(f'\nSession 2 T1 DICOM file: {Path(session2_T1_dicom).name}')
-                        file.write(f'\nSession 1 Spectroscopy DICOM file: {Path(dcm).name}')
-                        file.write(f"\n\n---------------------------\n\n")
-                        file.write(f"NEW {roi} PRESCRIPTION\n")
-                        file.write(f'Position: {transvec}\n')
-                        file.write(f"Orientation: {slice_orientation_pitch}\n")
-                        file.write(f"Rotation: {inplane_rot:.2f} deg\n")
-                        file.write(f"Dimensions: {dimX} mm x {dimY} mm x {dimZ} mm")
-                    print(f"Prescription written to {filename}")
-                    print("-------------\n")
+                    materialise(output_folder, "sess1_T1_aligned")
                 except Exception as e:
-                    print(f"Error writing to file: {e}")
-
-            command = "fsleyes -ixh --displaySpace world sess1_T1.nii sess1_svs/*.nii.gz sess2_T1.nii *aligned.nii.gz"
-            process = subprocess.Popen(command, shell=True)
-            print("\nVoxAlign process completed successfully.\n")
+                    print(f"Couldn't make sess1_T1_aligned for fsleyes: {e}")
+                command = "fsleyes -ixh --displaySpace world sess1_T1.nii sess1_svs/*.nii.gz sess2_T1.nii *aligned.nii.gz"
+                process = subprocess.Popen(command, shell=True, cwd=output_folder)
+            else:
+                print(f"fsleyes not found, see the *_qc.png images in {output_folder}")
             
             # Create and display the success message box
             msg_box = QMessageBox()
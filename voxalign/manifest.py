@@ -0,0 +1,165 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import os
+import json
+import hashlib
+from pathlib import Path
+
+MANIFEST_NAME = "voxalign_manifest.json"
+
+def file_sha256(path, chunk_size=1024*1024):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def describe_file(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_sha256(path)}
+
+def write_manifest(folder, files, **info):
+    """Record the size, modification time and content hash of `files` in `folder`."""
+    manifest = dict(info)
+    manifest["files"] = {file: describe_file(Path(folder) / file) for file in files}
+    with open(Path(folder) / MANIFEST_NAME, 'w') as fp:
+        json.dump(manifest, fp, indent=2)
+    return manifest
+
+def read_manifest(folder):
+    with open(Path(folder) / MANIFEST_NAME) as fp:
+        return json.load(fp)
+
+def validate_manifest(folder, files):
+    """Check that `files` in `folder` are unchanged since the manifest was written.
+
+    Files whose size and modification time match the manifest are trusted without re-reading
+    them, so checking an untouched folder is instant. Anything else is re-hashed. Folders from
+    before manifests existed get one written if all the files are present.
+    Returns a list of problems, which is empty if the folder is valid.
+    """
+    folder = Path(folder)
+    missing = [file for file in files if not (folder / file).exists()]
+    if missing:
+        return [f"missing {file}" for file in missing]
+
+    if not (folder / MANIFEST_NAME).exists():
+        try:
+            write_manifest(folder, files)
+        except OSError:
+            pass # e.g. a read-only folder; it can still be used as is
+        return []
+
+    manifest = read_manifest(folder)
+    recorded = manifest.get("files", {})
+    problems = []
+    restamped = False
+    for file in files:
+        if file not in recorded:
+            problems.append(f"{file} is not in {MANIFEST_NAME}")
+            continue
+        stat = os.stat(folder / file)
+        if stat.st_size == recorded[file]["size"] and stat.st_mtime_ns == recorded[file]["mtime_ns"]:
+            continue
+        if stat.st_size != recorded[file]["size"] or file_sha256(folder / file) != recorded[file]["sha256"]:
+            problems.append(f"{file} has changed since the registration was run")
+        else:
+            # same content with a new timestamp (e.g. copied), so remember the new timestamp
+            recorded[file]["mtime_ns"] = stat.st_mtime_ns
+            restamped = True
+
+    if restamped and not problems:
+        try:
+            with open(folder / MANIFEST_NAME, 'w') as fp:
+                json.dump(manifest, fp, indent=2)
+        except OSError:
+            pass
+    return problems
+
+def link_files(src_folder, dest_folder, files):
+    """Make `files` from src_folder available in dest_folder without copying them.
+
+    Uses a hard link where possible and falls back to a symbolic link (e.g. across file systems).
+    """
+    for file in files:
+        src = Path(src_folder).resolve() / file
+        dest = Path(dest_folder) / file
+        if dest.exists() or dest.is_symlink():
+            dest.unlink()
+        try:
+            os.link(src, dest)
+        except OSError:
+            os.symlink(src, dest)
+
+RUN_MANIFEST_NAME = "voxalign_run.json"
+
+class RunManifest:
+    """Record of the pipeline stages completed in an output folder and the inputs they used.
+
+    A stage is current if it finished before, its input files and parameters are unchanged and
+    its outputs are still there, in which case a re-run can skip it.
+    """
+
+    def __init__(self, folder):
+        self.path = Path(folder) / RUN_MANIFEST_NAME
+        self.stages = {}
+        if self.path.exists():
+            with open(self.path) as fp:
+                self.stages = json.load(fp).get("stages", {})
+
+    def fingerprint(self, stage, path):
+        # reuse the recorded hash if the file's size and timestamp haven't changed
+        stat = os.stat(path)
+        recorded = self.stages.get(stage, {}).get("inputs", {}).get(str(path))
+        if recorded and recorded["size"] == stat.st_size and recorded["mtime_ns"] == stat.st_mtime_ns:
+            return recorded
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_sha256(path)}
+
+    def is_current(self, stage, inputs, outputs=(), params=None):
+        recorded = self.stages.get(stage)
+        if recorded is None or recorded.get("params") != params:
+            return False
+        if not all(os.path.exists(output) for output in outputs) or sorted(recorded["inputs"]) != sorted(str(p) for p in inputs):
+            return False
+        for path in inputs:
+            if not os.path.exists(path):
+                return False
+            if self.fingerprint(stage, path)["sha256"] != recorded["inputs"][str(path)]["sha256"]:
+                return False
+        return True
+
+    def record(self, stage, inputs, outputs=(), params=None):
+        self.stages[stage] = {
+            "inputs": {str(path): self.fingerprint(stage, path) for path in inputs},
+            "outputs": [str(output) for output in outputs],
+            "params": params,
+        }
+        self.save()
+
+    def save(self):
+        tmp_path = self.path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as fp:
+            json.dump({"stages": self.stages}, fp, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def outputs(self, stage):
+        return self.stages.get(stage, {}).get("outputs", [])
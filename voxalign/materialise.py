@@ -0,0 +1,93 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import numpy as np
+import nibabel as nib
+from pathlib import Path
+from voxalign.manifest import RunManifest
+from voxalign.scheduler import run_tool
+from voxalign.utils import world_to_flirt_matrix
+
+# Images that are only for looking at are not made by the pipelines, since nothing on the way to
+# a prescription needs them. materialise() makes one from the transforms when a viewer or QC step
+# asks for it, and keeps it until its inputs change.
+
+def _sess1_T1_aligned(folder):
+    inputs = [folder / 'sess1_T1_ss.nii.gz', folder / 'sess2_T1_ss.nii.gz', folder / 'sess1tosess2_world.mat']
+    if not (inputs[0].exists() and inputs[1].exists()):
+        # the same frame of reference shortcut skips the skull stripping, so the whole heads are resampled
+        inputs[:2] = [folder / 'sess1_T1.nii', folder / 'sess2_T1.nii']
+    output = folder / 'sess1_T1_aligned.nii.gz'
+    def make():
+        src, ref = nib.load(inputs[0]), nib.load(inputs[1])
+        np.savetxt(folder / 'sess1tosess2_flirt.mat', world_to_flirt_matrix(np.loadtxt(inputs[2]), src, ref))
+        command = f"flirt -in {inputs[0]} -ref {inputs[1]} -applyxfm -init {folder / 'sess1tosess2_flirt.mat'} -out {output}"
+        run_tool(command, check=True)
+    return inputs, [output], make
+
+def _T1toMNInonlin(folder):
+    inputs = [folder / 'croppedT1.nii.gz', folder / 'T1toMNI_warp.nii.gz']
+    output = folder / 'T1toMNInonlin.nii.gz'
+    def make():
+        # same image as fnirt --iout
+        command = f"applywarp -i {inputs[0]} -r $FSLDIR/data/standard/MNI152_T1_2mm.nii.gz -w {inputs[1]} -o {output} --interp=spline"
+        run_tool(command, check=True)
+    return inputs, [output], make
+
+def _dice_masks(folder):
+    inputs = [folder / 'sess1_svs_tmp.nii.gz', folder / 'sess2_svs_tmp.nii.gz', folder / 'sess1_T1.nii', folder / 'sess2_T1.nii',
+              folder / 'sess1tosess2.mat']
+    outputs = [folder / 'sess1_voxel_tosess2T1.nii.gz', folder / 'sess2_voxel_tosess2T1.nii.gz']
+    def make():
+        # both voxels as 0.25 mm masks over the session 2 T1 field of view
+        command = f"flirt -in {inputs[0]} -ref {inputs[2]} -out {folder / 'sess1_voxel_mask.nii.gz'} -omat {folder / 'sess1spectosess1T1.mat'} -applyisoxfm .25 -noresampblur -usesqform -setbackground 0 -paddingsize 1 -interp nearestneighbour"
+        run_tool(command, check=True)
+        command = f"convert_xfm -omat {folder / 'spec1tosess2T1.mat'} -concat {inputs[4]} {folder / 'sess1spectosess1T1.mat'}"
+        run_tool(command, check=True)
+        command = f"flirt -in {inputs[1]} -ref {inputs[3]} -out {outputs[1]} -usesqform -applyisoxfm .25 -setbackground 0 -paddingsize 1 -interp nearestneighbour"
+        run_tool(command, check=True)
+        command = f"flirt -in {inputs[0]} -ref {inputs[3]} -out {outputs[0]} -usesqform -applyisoxfm .25 -init {folder / 'spec1tosess2T1.mat'} -setbackground 0 -paddingsize 1 -interp nearestneighbour"
+        run_tool(command, check=True)
+    return inputs, outputs, make
+
+DERIVED_IMAGES = {
+    "sess1_T1_aligned": _sess1_T1_aligned,
+    "T1toMNInonlin": _T1toMNInonlin,
+    "dice_masks": _dice_masks,
+}
+
+def materialise(folder, name, log=print):
+    """Make a derived image in an output folder if it is missing or out of date, returning its path(s)."""
+    if name not in DERIVED_IMAGES:
+        raise Exception(f"Unknown derived image '{name}' (choose from {', '.join(DERIVED_IMAGES)})")
+    folder = Path(folder).resolve()
+    inputs, outputs, make = DERIVED_IMAGES[name](folder)
+    missing = [str(p.name) for p in inputs if not p.exists()]
+    if missing:
+        raise Exception(f"Can't make {name} in {folder}, missing {', '.join(missing)}")
+
+    manifest = RunManifest(folder)
+    stage = f"materialise {name}"
+    if not manifest.is_current(stage, inputs, outputs):
+        log(f"Making {name} ...")
+        make()
+        manifest.record(stage, inputs, outputs)
+    return outputs[0] if len(outputs) == 1 else outputs
@@ -19,19 +19,19 @@
 # ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
-import numpy as np
-import shutil
 import subprocess
-import os
-import pydicom
-np.set_printoptions(suppress=True)
+import shutil
 from pathlib import Path
 import sys
-from voxalign.utils import check_external_tools, convert_signs_to_letters
+from voxalign.utils import check_external_tools
+from voxalign.manifest import validate_manifest
+from voxalign.materialise import materialise
+from voxalign.pipelines import PRERUN_REQUIRED_FILES
+from voxalign.server import submit, submit_or_run
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QPushButton, QTextEdit, QVBoxLayout, QHBoxLayout, QFileDialog, QMessageBox, QLabel, QLineEdit, QCheckBox
 )
-from PyQt5.QtGui import QIntValidator
+from PyQt5.QtGui import QDoubleValidator
 from PyQt5.QtCore import Qt
 from functools import partial
 
@@ -41,14 +41,6 @@ output_folder = ""
 T1_dicom = ""
 MNI_coords=[]
 
-def compose_fsl_annot_text(colorlist,voxidx,coord):
-    # write out annotations file that FSL loads in to show crosshair(s) at selected coordinates
-    annotations_txt = f"X Point colour={colorlist[voxidx]} lineWidth=4 honourZLimits=True zmin={coord[0]-2} zmax={coord[0]+2} x={coord[1]} y={coord[2]} \
-                        \nY Point colour={colorlist[voxidx]} lineWidth=4 honourZLimits=True zmin={coord[1]-2} zmax={coord[1]+2} x={coord[0]} y={coord[2]} \
-                        \nZ Point colour={colorlist[voxidx]} lineWidth=4 honourZLimits=True zmin={coord[2]-2} zmax={coord[2]+2} x={coord[0]} y={coord[1]}\n"
-    
-    return annotations_txt
-    
 class HoverButton(QPushButton):
     def __init__(self, text, num1_input, num2_input, num3_input, parent=None):
         super().__init__(text, parent)
@@ -62,12 +54,18 @@ class HoverButton(QPushButton):
         num2 = self.num2_input.text() if self.num2_input.text() else "999"
         num3 = self.num3_input.text() if self.num3_input.text() else "999"
 
-        fsl_command = f'atlasquery -a "Harvard-Oxford Subcortical Structural Atlas" -c {num1},{num2},{num3}'
-        subcort_result = subprocess.run(fsl_command, shell=True, capture_output=True, text=True)
-        fsl_command = f'atlasquery -a "Harvard-Oxford Cortical Structural Atlas" -c {num1},{num2},{num3}'
-        cort_result = subprocess.run(fsl_command, shell=True, capture_output=True, text=True)
-   
-        tooltip_text = f"{subcort_result.stdout.split('<br>')[-1]}\n{cort_result.stdout.split('<br>')[-1]}"
+        try:
+            # a running voxalign server already has the atlases loaded, so ask it first
+            subcort_result = submit("atlas-query", atlas_name="Harvard-Oxford Subcortical Structural Atlas", coord=[num1, num2, num3])
+            cort_result = submit("atlas-query", atlas_name="Harvard-Oxford Cortical Structural Atlas", coord=[num1, num2, num3])
+            tooltip_text = f"{subcort_result}\n{cort_result}"
+        except Exception:
+            fsl_command = f'atlasquery -a "Harvard-Oxford Subcortical Structural Atlas" -c {num1},{num2},{num3}'
+            subcort_result = subprocess.run(fsl_command, shell=True, capture_output=True, text=True)
+            fsl_command = f'atlasquery -a "Harvard-Oxford Cortical Structural Atlas" -c {num1},{num2},{num3}'
+            cort_result = subprocess.run(fsl_command, shell=True, capture_output=True, text=True)
+
+            tooltip_text = f"{subcort_result.stdout.split('<br>')[-1]}\n{cort_result.stdout.split('<br>')[-1]}"
         self.setToolTip(tooltip_text)  # Dynamically update tooltip
 
         super().enterEvent(event)  # Call parent class method
@@ -162,23 +160,23 @@ class MNILookupApp(QWidget):
         """Adds a new row of three input boxes with a delete button."""
         row_layout = QHBoxLayout()  # Horizontal layout for the new row
 
-        # Input fields with integer validation
+        # Input fields with number validation (MNI coordinates need not be whole mm)
         num1_input = QLineEdit(self)
         num1_input.setPlaceholderText("X")
-        num1_input.setValidator(QIntValidator())  # Accepts only integers
+        num1_input.setValidator(QDoubleValidator(-200, 200, 2))  # Accepts numbers with up to 2 decimals
         num1_input.setAlignment(Qt.AlignCenter)
-        num1_input.setFixedSize(40, 25)  
+        num1_input.setFixedSize(60, 25)  
 
         num2_input = QLineEdit(self)
         num2_input.setPlaceholderText("Y")
-        num2_input.setValidator(QIntValidator())
-        num2_input.setFixedSize(40, 25)  
+        num2_input.setValidator(QDoubleValidator(-200, 200, 2))
+        num2_input.setFixedSize(60, 25)  
         num2_input.setAlignment(Qt.AlignCenter)
 
         num3_input = QLineEdit(self)
         num3_input.setPlaceholderText("Z")
-        num3_input.setValidator(QIntValidator())
-        num3_input.setFixedSize(40, 25)  
+        num3_input.setValidator(QDoubleValidator(-200, 200, 2))
+        num3_input.setFixedSize(60, 25)  
         num3_input.setAlignment(Qt.AlignCenter)
 
         # Button to look up atlas region
@@ -233,14 +231,14 @@ class MNILookupApp(QWidget):
         for num1_input, num2_input, num3_input, _, _, _ in self.rows:
 
             try:
-                # Convert the inputs to integers
-                num1 = int(num1_input.text())
-                num2 = int(num2_input.text())
-                num3 = int(num3_input.text())
+                # Convert the inputs to numbers
+                num1 = float(num1_input.text())
+                num2 = float(num2_input.text())
+                num3 = float(num3_input.text())
                 MNI_coords.append([num1, num2, num3])
             except ValueError:
                 # Handle invalid input
-                QMessageBox.critical(self, "Error", "Please enter valid integers in all fields.")
+                QMessageBox.critical(self, "Error", "Please enter valid numbers in all fields.")
                 return
             
     def checkbox_changed(self):
@@ -301,15 +299,14 @@ class MNILookupApp(QWidget):
             
             nonlin_folder_path = Path(nonlin_folder_path)  # Convert to Path object
 
-            self.required_files = ["T1.nii", "T1_ss.nii.gz", "T1toMNI_warp.nii.gz","croppedT1.nii.gz","T1toMNInonlin.nii.gz"]
+            # Check the required files against the folder's manifest of content hashes
+            problems = validate_manifest(nonlin_folder_path, PRERUN_REQUIRED_FILES)
 
-            # Check if the folder contains the required files
-            req_files_exist = [os.path.exists(os.path.join(nonlin_folder_path,file)) for file in self.required_files]
-
-            if not all(req_files_exist):  # If the folder contains files/subfolders
+            if problems:
                 response = QMessageBox.warning(
                     self, "Missing required files",
-                    "Folder does not contain all required files. Please try again or run nonlinear alignment now.",
+                    "Folder does not contain a usable MNI registration:\n\n" + "\n".join(problems) + \
+                    "\n\nPlease try again or run nonlinear alignment now.",
                     QMessageBox.Retry | QMessageBox.Cancel
                 )
 
@@ -327,142 +324,26 @@ class MNILookupApp(QWidget):
         try:
             check_external_tools()
 
-            print("Running VoxAlign MNI Lookup!")
-            print("\nOutput folder:", self.output_folder)
-            print("\nT1 DICOM:", T1_dicom)
-            for coord_row in MNI_coords:
-                print(f"\nInput MNI coordinates: [{coord_row[0]}, {coord_row[1]}, {coord_row[2]}]")
-
-            os.chdir(self.output_folder)
-
-            T1_dicom_header = pydicom.dcmread(T1_dicom,stop_before_pixels=True)
-
-            if self.nonlin_path:
-                for file in self.required_files:
-                    shutil.copy(os.path.join(self.nonlin_path,file),self.output_folder)
-                
-                #convert new T1 DICOM to NIFTI
-                command = f"dcm2niix -f newT1 -o '{self.output_folder}' -s y -z n {T1_dicom}"
-                result = subprocess.run(command, shell=True, capture_output=True, text=True)
-
-                #skull strip session 1 T1
-                print("\n...\n\nSkull stripping T1 ...")
-                command = f"bet2 newT1.nii.gz newT1_ss.nii"
-                result = subprocess.run(command, shell=True, capture_output=True, text=True)
-
-                # linearly register the new T1 to the one already registered to MNI space
-                print("\n...\n\nLinearly registering new and existing T1s ...")
-                command = "flirt -in T1_ss.nii.gz -ref newT1_ss.nii.gz -dof 6 -out T1tonewT1lin -omat T1tonewT1lin.mat"
-                result = subprocess.run(command, shell=True, capture_output=True, text=True)
-
-            else:            
-                #convert T1 DICOM to NIFTI
-                command = f"dcm2niix -f T1 -o '{self.output_folder}' -s y -z n {T1_dicom}"
-                result = subprocess.run(command, shell=True, capture_output=True, text=True)
-
-                # crop neck from T1
-                command = "robustfov -r croppedT1.nii -i T1.nii"
-                result = subprocess.run(command, shell=True, capture_output=True, text=True)
-
-                #skull strip T1
-                print("\n...\n\nSkull stripping T1 ...")
-                command = f"bet2 croppedT1.nii.gz T1_ss.nii"
-                result = subprocess.run(command, shell=True, capture_output=True, text=True)
-
-                # linearly register the T1 to MNI space
-                print("\n...\n\nInitial linear registration to MNI space ...")
-                command = "flirt -in T1_ss.nii.gz -ref $FSLDIR/data/standard/MNI152_T1_2mm_brain.nii.gz -dof 12 -out T1toMNIlin -omat T1toMNIlin.mat"
-                result = subprocess.run(command, shell=True, capture_output=True, text=True)
-
-                # starting with the linear registration, now nonlinearly register to MNI space
-                print("\n...\n\nFinal nonlinear registration to MNI space ...")
-                if self.checkbox.isChecked():
-                    # subsampling level controls how fast (but also how accurate) it is. fnirt default from T1_2_MNI152_2mm.cnf is --subsamp=4,4,2,2,1,1
-                    command = "fnirt --in=croppedT1.nii.gz --aff=T1toMNIlin.mat --config=T1_2_MNI152_2mm.cnf --subsamp=8,8,8,4,2,1 --iout=T1toMNInonlin --cout=T1toMNI_coef --fout=T1toMNI_warp"
-                    print("Running faster nonlinear registration to MNI space, using more aggressive subsampling")                
-                else:
-                    command = "fnirt --in=croppedT1.nii.gz --aff=T1toMNIlin.mat --config=T1_2_MNI152_2mm.cnf --iout=T1toMNInonlin --cout=T1toMNI_coef --fout=T1toMNI_warp"
-                    print("Running long nonlinear registration to MNI space (using FSL subsampling defaults)")
-                result = subprocess.run(command, shell=True, capture_output=True, text=True)
-
-            filename='MNI_lookup_voxel_pos.txt'
-            try:
-                with open(filename, 'a') as file:
-                    file.write(f"Study: {T1_dicom_header.StudyDescription}")
-                    file.write(f"\nDate: {T1_dicom_header.StudyDate}")
-                    file.write(f"\nParticipant: {T1_dicom_header.PatientID}")
-                    file.write(f'\nT1 DICOM file: {Path(T1_dicom).name}')
-                    if self.nonlin_path is not None:
-                        regtext = "Used pre-run nonlinear registration to MNI space"
-                    else:
-                        if self.checkbox.isChecked():
-                            regtext = "Fast nonlinear registration: subsampling 8,8,8,4,2,1"
-                        else:
-                            regtext = "Slow (default) nonlinear registration: subsampling 4,4,2,2,1,1"
-                    file.write(f'\n{regtext}')
-                    file.write(f"\n---------------------------")
-            except Exception as e:
-                print(f"Error writing to file: {e}")
-
-            # given these warps, translate the input MNI coordinates to subject space
-            for voxnum,coord_row in enumerate(MNI_coords):
-
-                command = f"echo {coord_row[0]} {coord_row[1]} {coord_row[2]} | std2imgcoord -img T1_ss.nii.gz -std $FSLDIR/data/standard/MNI152_T1_2mm.nii.gz -warp T1toMNI_warp.nii.gz  -"
-                result = subprocess.run(command, shell=True, capture_output=True, text=True)
-                new_coords = np.round(np.asarray(result.stdout.split(), dtype=float),1)
+            submit_or_run("mni-lookup", output_folder=str(self.output_folder), T1_dicom=T1_dicom, MNI_coords=MNI_coords,
+                          nonlin_path=str(self.nonlin_path) if self.nonlin_path else None,
+                          fast_registration=self.checkbox is not None and self.checkbox.isChecked())
 
+            # QC images are always written; open fsleyes as well for a closer look if it is installed
+            if shutil.which("fsleyes"):
                 if self.nonlin_path:
-                    command = f"echo {new_coords[0]} {new_coords[1]} {new_coords[2]} | img2imgcoord -src T1_ss.nii.gz -dest newT1_ss.nii.gz -mm -xfm T1tonewT1lin.mat  -"
-                    result = subprocess.run(command, shell=True, capture_output=True, text=True)
-                    new_coords = np.round(np.asarray(result.stdout.split('\n')[1].split(), dtype=float),1)
-
-                fslcolors = ['red','orange','yellow','green','blue','purple']
-                
-                # write out annotations file that FSL loads in to show crosshair(s) at selected coordinates
-                # for current T1 (native space)
-                native_annotations_txt = compose_fsl_annot_text(fslcolors,voxnum,new_coords)
-                try:
-                    with open('native_annotations.txt', 'a') as file:
-                        file.write(native_annotations_txt)
-                except Exception as e:
-                    print(f"Couldn't save voxel position annotation for fsleyes: {e}")
-
-                # also show the requested coordinates in MNI space
-                MNI_annotations_txt = compose_fsl_annot_text(fslcolors,voxnum,coord_row)
-                try:
-                    with open('MNI_annotations.txt', 'a') as file:
-                        file.write(MNI_annotations_txt)
-                except Exception as e:
-                    print(f"Couldn't save MNI position annotation for fsleyes: {e}")
-
-                transvec = convert_signs_to_letters(np.round(new_coords,1))
-                print("\n-------------")
-                print(f"MNI Coordinates: {coord_row}")
-                print(f'Position: {transvec}')
+                    command = f"fsleyes -ixh --displaySpace world -a native_annotations.txt newT1.nii"
+                else:
+                    command = f"fsleyes -ixh --displaySpace world -a native_annotations.txt croppedT1.nii.gz"
+                process = subprocess.Popen(command, shell=True, cwd=self.output_folder)
 
                 try:
-                    with open(filename, 'a') as file:
-                        file.write(f"\n\n---------------------------")
-                        file.write(f"\nMNI Coordinates: {coord_row}")
-                        file.write(f'\nVoxel Position: {transvec}\n')
-                        file.write(f"---------------------------")
-
-                    print(f"Position written to {filename}")
-                    print("-------------\n")
+                    materialise(self.output_folder, "T1toMNInonlin")
                 except Exception as e:
-                    print(f"Error writing to file: {e}")
-
-
-            print("\nVoxAlign MNI lookup process completed successfully.\n")
-            
-            if self.nonlin_path:
-                command = f"fsleyes -ixh --displaySpace world -a native_annotations.txt newT1.nii"
+                    print(f"Couldn't make T1toMNInonlin for fsleyes: {e}")
+                command = f"fsleyes -ixh --displaySpace world -std1mm -a MNI_annotations.txt T1toMNInonlin.nii.gz"
+                process = subprocess.Popen(command, shell=True, cwd=self.output_folder)
             else:
-                command = f"fsleyes -ixh --displaySpace world -a native_annotations.txt croppedT1.nii.gz"
-            process = subprocess.Popen(command, shell=True)
-            
-            command = f"fsleyes -ixh --displaySpace world -std1mm -a MNI_annotations.txt T1toMNInonlin.nii.gz"
-            process = subprocess.Popen(command, shell=True)
+                print(f"fsleyes not found, see the MNI_lookup_*_qc.png images in {self.output_folder}")
 
             # Create and display the success message box
             msg_box = QMessageBox()
@@ -0,0 +1,137 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import os
+import time
+import socket
+import sqlite3
+import platform
+import subprocess
+import numpy as np
+from contextvars import ContextVar
+from functools import lru_cache
+from pathlib import Path
+from voxalign.resources import VOXALIGN_HOME
+
+PERF_DB_NAME = "perf_history.sqlite"
+
+COLUMNS = {
+    "recorded_at": "REAL NOT NULL",
+    "tool": "TEXT",
+    "stage": "TEXT NOT NULL",
+    "duration_s": "REAL NOT NULL",
+    "wait_s": "REAL",
+    "returncode": "INTEGER",
+    "host": "TEXT",
+    "platform": "TEXT",
+    "cpus": "INTEGER",
+    "tool_version": "TEXT",
+}
+
+# the pipeline (align, mni-lookup, dice, ...) whose stages are running, kept per thread (and per asyncio task),
+# so that concurrent jobs each tag their own stages
+current_tool = ContextVar("voxalign_current_tool", default=None)
+
+# stages whose version comes from the tool itself (--version); every other stage gets the FSL installation's version
+VERSIONED_TOOLS = {"dcm2niix": "dcm2niix --version", "spec2nii": "spec2nii --version"}
+
+def perf_db_path():
+    """The timing history of this machine's voxalign runs, in VOXALIGN_PERF_DB or the voxalign home directory."""
+    return Path(os.environ.get('VOXALIGN_PERF_DB', VOXALIGN_HOME / PERF_DB_NAME))
+
+def connect(db_path):
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    columns = ', '.join(f"{name} {kind}" for name, kind in COLUMNS.items())
+    conn.execute(f"CREATE TABLE IF NOT EXISTS timings (id INTEGER PRIMARY KEY, {columns})")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_host_stage ON timings (host, stage, recorded_at)")
+    return conn
+
+@lru_cache(maxsize=None)
+def tool_version(stage):
+    """Version of the software behind a stage, looked up once per process."""
+    if stage in VERSIONED_TOOLS:
+        try:
+            result = subprocess.run(VERSIONED_TOOLS[stage], shell=True, capture_output=True, text=True, timeout=10)
+            lines = (result.stdout + result.stderr).strip().splitlines()
+            return lines[0].strip() if lines else None
+        except Exception:
+            return None
+    try:
+        return "FSL " + (Path(os.environ['FSLDIR']) / 'etc' / 'fslversion').read_text().split(':')[0].strip()
+    except Exception:
+        return None
+
+def set_current_tool(tool):
+    current_tool.set(tool)
+
+def record_stage(stage, duration_s, wait_s=0.0, returncode=0, tool=None):
+    """Append a stage timing to the history. Set VOXALIGN_PERF=0 to turn recording off.
+
+    Problems with the store are reported but never stop a run.
+    """
+    if os.environ.get('VOXALIGN_PERF', '1') == '0':
+        return
+    record = {"recorded_at": time.time(), "tool": tool or current_tool.get(), "stage": stage, "duration_s": duration_s,
+              "wait_s": wait_s, "returncode": returncode, "host": socket.gethostname(), "platform": platform.platform(),
+              "cpus": os.cpu_count(), "tool_version": tool_version(stage)}
+    try:
+        with connect(perf_db_path()) as conn:
+            conn.execute(f"INSERT INTO timings ({', '.join(record)}) VALUES ({', '.join('?' * len(record))})", list(record.values()))
+    except sqlite3.Error as e:
+        print(f"Couldn't record timing in {perf_db_path()}: {e}")
+
+def stage_report(db_path, host=None, stage=None, recent=5, threshold=1.5, min_history=5):
+    """Latency percentiles per host and stage, and whether the latest runs regressed.
+
+    A stage is flagged when the median of its `recent` latest successful runs is more than
+    `threshold` times the median of the runs before them (with at least `min_history` of those).
+    Returns one dict per (host, stage).
+    """
+    where, params = ["returncode = 0"], []
+    if host:
+        where.append("host = ?")
+        params.append(host)
+    if stage:
+        where.append("stage = ?")
+        params.append(stage)
+    with connect(db_path) as conn:
+        rows = conn.execute(f"SELECT host, stage, duration_s, tool_version FROM timings WHERE {' AND '.join(where)} ORDER BY recorded_at", params).fetchall()
+
+    groups = {}
+    for row_host, row_stage, duration, version in rows:
+        groups.setdefault((row_host, row_stage), []).append((duration, version))
+
+    report = []
+    for (row_host, row_stage), runs in sorted(groups.items()):
+        durations = np.array([d for d, _ in runs])
+        p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+        entry = {"host": row_host, "stage": row_stage, "runs": len(runs), "p50_s": float(p50), "p90_s": float(p90),
+                 "p99_s": float(p99), "ratio": None, "regressed": False,
+                 "version": runs[-1][1], "previous_version": None}
+        if len(runs) >= recent + min_history:
+            baseline = np.median(durations[:-recent])
+            entry["ratio"] = float(np.median(durations[-recent:]) / baseline) if baseline > 0 else None
+            entry["regressed"] = entry["ratio"] is not None and entry["ratio"] > threshold
+            entry["previous_version"] = runs[-recent - 1][1]
+        report.append(entry)
+    return report
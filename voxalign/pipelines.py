@@ -0,0 +1,900 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import csv
+import numpy as np
+import nibabel as nib
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+np.set_printoptions(suppress=True)
+from pathlib import Path
+from voxalign.executors import get_executor
+from voxalign.jobs import MNILookupJob, NativePosition, Prescription
+from voxalign.materialise import materialise
+from voxalign.perf import record_stage, set_current_tool
+from voxalign.scheduler import STAGE_COSTS, run_tool, scheduler
+from voxalign.preflight import preflight
+from voxalign.placement import atlas_region_image, optimise_placement
+from voxalign.registration import FSLBackend, get_backend, initialised_rigid
+from voxalign.quality import voxel_dice, SAME_FRAME_NCC, SUSPECT_NCC, SUSPECT_ROI_NCC, central_similarity, format_similarity, is_suspect, registration_similarity
+from voxalign.qc import render_orthogonal, save_qc_image
+from voxalign.tissue import TISSUE_CLASSES, format_tissue_fractions, segment_T1, tissue_fractions
+from voxalign.results import record_result
+from voxalign.transform_graph import TransformGraph
+from voxalign.manifest import RunManifest, link_files, read_manifest, validate_manifest, write_manifest
+from voxalign.utils import PIPELINE_TOOLS, calc_prescription_from_nifti, compose_fsl_annot_text, convert_signs_to_letters, convert_spec_dicom, flirt_matrix_to_world, format_prescription, spec_grid_shape, voxel_centre, voxel_displacement, world_to_flirt_matrix, write_grid_correspondence
+
+# files that must be present in an output folder from a previous mni-lookup run to reuse its MNI registration
+PRERUN_REQUIRED_FILES = ["T1.nii", "T1_ss.nii.gz", "T1toMNI_warp.nii.gz", "croppedT1.nii.gz"]
+
+
+def frame_of_reference(header):
+    return str(header.get("FrameOfReferenceUID", "") or "")
+
+def unmoved_in_frame(in_file, ref_file, log=print):
+    """Whether two T1s acquired in the same frame of reference are still aligned without a registration.
+
+    Sharing a FrameOfReferenceUID means the participant never left the table, but they may still
+    have moved, so the middle of the heads is compared before the registration is skipped.
+    """
+    similarity = central_similarity(in_file, ref_file, np.eye(4))
+    log(f"T1s share a frame of reference; similarity without registration: {format_similarity(similarity)}")
+    if is_suspect(similarity, SAME_FRAME_NCC):
+        log(f"The head has moved (NCC below {SAME_FRAME_NCC}), registering the T1s")
+        return False
+    return True
+
+
+def provisional_transform(sess1_T1, sess2_T1, resolution=4):
+    """Quick world transform from session 1 to session 2 by a rigid fit of the heads at low resolution.
+
+    The fit starts from the scanner coordinates in the headers and skips flirt's angular search.
+    """
+    folder = os.path.dirname(os.path.abspath(sess1_T1))
+    low_res = []
+    np.savetxt(f'{folder}/identity.mat', np.eye(4))
+    for T1 in (sess1_T1, sess2_T1):
+        out = T1.removesuffix('.nii') + f'_{resolution}mm.nii.gz'
+        command = f"flirt -in {T1} -ref {T1} -applyisoxfm {resolution} -init identity.mat -out {out}"
+        result = run_tool(command, check=True, cwd=folder)
+        low_res.append(nib.load(out))
+
+    np.savetxt(f'{folder}/provisional_init.mat', world_to_flirt_matrix(np.eye(4), low_res[0], low_res[1]))
+    command = f"flirt -in {low_res[0].get_filename()} -ref {low_res[1].get_filename()} -dof 6 -init provisional_init.mat -nosearch -omat provisional.mat"
+    result = run_tool(command, check=True, cwd=folder)
+    return flirt_matrix_to_world(np.loadtxt(f'{folder}/provisional.mat'), low_res[0], low_res[1])
+
+
+def run_alignment(output_folder, session1_T1_dicom, session2_T1_dicom, spectroscopy_files, tissue=True, progressive=True, registration="fsl",
+                  rigid_init="header", log=print):
+    """Align session 1 spectroscopy voxel(s) to session 2 and write out the new prescription(s).
+
+    `registration` names the backend for the session 1 to session 2 registration (see registration.BACKENDS),
+    and `rigid_init` how it starts (see registration.initialised_rigid); the provisional fit is used if there is one.
+
+    With `progressive`, a provisional prescription from a coarse low resolution fit is reported
+    first, and each refined prescription says how far it moved from the provisional one.
+
+    If both T1s share a frame of reference and a quick similarity check finds no head movement,
+    the registration is skipped and the prescription carried over in scanner coordinates.
+
+    With `tissue`, both skull stripped T1s are segmented in the background while the registration
+    runs, and the GM/WM/CSF fractions of the previous and new voxels are reported.
+
+    Everything that is normally printed to the terminal is passed to `log`, so that the
+    voxalign server can stream progress back to its clients. Returns a Prescription per ROI.
+
+    All files are read and written in `output_folder` by absolute path, and the working directory is
+    left alone, so several alignments can run at once in one process (see jobs.AlignmentJob).
+    """
+    start_time = time.perf_counter()
+    set_current_tool("align")
+    output_folder = os.path.abspath(output_folder)
+    session1_T1_dicom, session2_T1_dicom = os.path.abspath(session1_T1_dicom), os.path.abspath(session2_T1_dicom)
+    spectroscopy_files = [os.path.abspath(dcm) for dcm in spectroscopy_files]
+    log("Running VoxAlign!")
+    log(f"\nOutput folder: {output_folder}")
+    log(f"\nSession 1 T1 DICOM: {session1_T1_dicom}")
+    log(f"\nSession 2 T1 DICOM: {session2_T1_dicom}")
+    log(f"\nSession 1 Spectroscopy DICOMs: {spectroscopy_files}")
+
+    # check every input and tool up front; the T1 DICOM headers give the study, date, participant, etc.
+    tools = [tool for tool in PIPELINE_TOOLS["align"] if tissue or tool != "fast"]
+    headers = preflight([session1_T1_dicom, session2_T1_dicom], spectroscopy_files, tools, same_resolution=True, log=log)
+    sess1T1_dicom_header = headers[session1_T1_dicom]
+    sess2T1_dicom_header = headers[session2_T1_dicom]
+
+    # registrations already run for this participant are cached as a graph of world transforms between T1 series
+    graph = TransformGraph.for_participant(output_folder, sess2T1_dicom_header.PatientID)
+    sess1_id = str(sess1T1_dicom_header.SeriesInstanceUID)
+    sess2_id = str(sess2T1_dicom_header.SeriesInstanceUID)
+    transform = graph.find_transform(sess1_id, sess2_id)
+    cached = transform is not None
+
+    # stages completed by an earlier (possibly interrupted) run in this folder are skipped if their inputs are unchanged
+    manifest = RunManifest(output_folder)
+    manifest.save() # marks the folder as a VoxAlign run, even if the first stage fails
+    sess1_T1 = f'{output_folder}/sess1_T1.nii'
+    sess2_T1 = f'{output_folder}/sess2_T1.nii'
+    sess1_T1_ss = f'{output_folder}/sess1_T1_ss.nii.gz'
+    sess2_T1_ss = f'{output_folder}/sess2_T1_ss.nii.gz'
+
+    # the spectroscopy conversions don't depend on the T1s, so start them now on a worker pool.
+    # each one runs in its own temporary folder and the results are picked up as they finish below
+    pool = ThreadPoolExecutor(max_workers=max(1, min(len(spectroscopy_files), os.cpu_count() or 1)) + 2)
+    conversions = {}
+    for dcm in spectroscopy_files:
+        stage = f"spec2nii {Path(dcm).resolve()}"
+        previous = manifest.outputs(stage)
+        if manifest.is_current(stage, [dcm], previous):
+            log(f"Reusing {Path(previous[0]).name} converted from {Path(dcm).name}")
+            future = Future()
+            future.set_result(previous[0])
+        else:
+            # each task runs in a copy of this job's context, so its tool runs are recorded against this job
+            future = pool.submit(copy_context().run, convert_spec_dicom, dcm, f'{output_folder}/sess1_svs')
+        conversions[future] = dcm
+
+    try:
+        #convert session 1 T1 DICOM to NIFTI
+        if not manifest.is_current("sess1_dcm2niix", [session1_T1_dicom], [sess1_T1]):
+            command = f"dcm2niix -f sess1_T1 -o '{output_folder}' -s y -z n -w 1 {session1_T1_dicom}"
+            result = run_tool(command, check=True)
+            manifest.record("sess1_dcm2niix", [session1_T1_dicom], [sess1_T1])
+
+        # Convert session 2 T1 DICOM to NIFTI
+        if not manifest.is_current("sess2_dcm2niix", [session2_T1_dicom], [sess2_T1]):
+            command = f"dcm2niix -f sess2_T1 -o '{output_folder}' -s y -z n -w 1 {session2_T1_dicom}"
+            result = run_tool(command, check=True)
+            manifest.record("sess2_dcm2niix", [session2_T1_dicom], [sess2_T1])
+
+        # without repositioning (same frame of reference, e.g. a re-prescription later in the session), the scanner
+        # coordinates of the two T1s already match, so the registration and the skull stripping it needs are skipped
+        same_frame = (transform is None and frame_of_reference(sess1T1_dicom_header) != ""
+                      and frame_of_reference(sess1T1_dicom_header) == frame_of_reference(sess2T1_dicom_header)
+                      and unmoved_in_frame(sess1_T1, sess2_T1, log))
+        if same_frame:
+            transform = np.eye(4)
+        brains = tissue or not same_frame
+
+        # a coarse fit of the low resolution heads gives a provisional prescription within seconds,
+        # so the voxel can be set up while the full resolution registration runs
+        provisional_affines = {}
+        provisional = None
+        provisional_mat = f'{output_folder}/provisional_world.mat'
+        if progressive and transform is None:
+            log("\n...\nCalculating provisional prescription(s) ...")
+            if manifest.is_current("provisional", [sess1_T1, sess2_T1], [provisional_mat], params={"resolution": 4}):
+                provisional = np.loadtxt(provisional_mat)
+            else:
+                provisional = provisional_transform(sess1_T1, sess2_T1, resolution=4)
+                np.savetxt(provisional_mat, provisional)
+                manifest.record("provisional", [sess1_T1, sess2_T1], [provisional_mat], params={"resolution": 4})
+            for future, dcm in conversions.items():
+                spec_nii = nib.load(future.result())
+                provisional_affines[dcm] = provisional @ spec_nii.affine
+                provisional_nii = nib.Nifti1Image(np.zeros(spec_grid_shape(spec_nii)), provisional_affines[dcm], spec_nii.header)
+                provisional_nii.set_sform(provisional_affines[dcm],code='unknown')
+                provisional_nii.set_qform(provisional_affines[dcm],code='scanner')
+                roi = Path(future.result()).name.split('.')[0]
+                log(f"\nPROVISIONAL {roi} (refined prescription to follow)")
+                lines = format_prescription(provisional_nii)
+                for line in lines:
+                    log(line)
+                with open(f'{output_folder}/{roi}_provisional_prescription.txt', 'w') as file:
+                    file.write(f"PROVISIONAL {roi} PRESCRIPTION\n" + "\n".join(lines) + "\n")
+
+        #skull strip session 1 T1
+        if brains and not manifest.is_current("sess1_bet2", [sess1_T1], [sess1_T1_ss]):
+            log("\n...\nSkull stripping session 1 T1 ...")
+            command = f"bet2 sess1_T1.nii sess1_T1_ss.nii"
+            result = run_tool(command, check=True, cwd=output_folder)
+            manifest.record("sess1_bet2", [sess1_T1], [sess1_T1_ss])
+        if tissue:
+            sess1_segmentation = pool.submit(copy_context().run, segment_T1, sess1_T1_ss, reuse=manifest.is_current("sess1_fast", [sess1_T1_ss]))
+
+        #skull strip session 2 T1
+        if brains and not manifest.is_current("sess2_bet2", [sess2_T1], [sess2_T1_ss]):
+            log("Skull stripping session 2 T1 ...")
+            command = f"bet2 sess2_T1.nii sess2_T1_ss.nii"
+            result = run_tool(command, check=True, cwd=output_folder)
+            manifest.record("sess2_bet2", [sess2_T1], [sess2_T1_ss])
+        if tissue:
+            sess2_segmentation = pool.submit(copy_context().run, segment_T1, sess2_T1_ss, reuse=manifest.is_current("sess2_fast", [sess2_T1_ss]))
+
+        world_mat = f'{output_folder}/sess1tosess2_world.mat'
+        if same_frame:
+            log("Same frame of reference and no repositioning: using the scanner coordinates without a registration")
+            np.savetxt(world_mat, transform)
+        elif transform is None:
+            sess1_nii = nib.load(sess1_T1)
+            sess2_nii = nib.load(sess2_T1)
+
+            if sess1_nii.header.get_zooms() != sess2_nii.header.get_zooms():
+                raise(Exception("Your session 1 and session 2 T1s must have the same voxel resolution"))
+
+            # register session 1 T1 to session 2 T1; every backend returns the transform between world coordinates
+            backend = get_backend(registration)
+            # a matrix from another starting point (or another provisional fit) is not reused
+            initial = provisional if rigid_init == "header" else None
+            rigid_inputs = [sess1_T1_ss, sess2_T1_ss] + ([provisional_mat] if initial is not None else [])
+            rigid_params = {"rigid_init": rigid_init, "initial": "provisional" if initial is not None else None}
+            if not manifest.is_current(f"rigid {backend.name}", rigid_inputs, [world_mat], params=rigid_params):
+                log(f"Aligning session 1 T1 to session 2 T1 ({backend.name}) ...")
+                transform = initialised_rigid(backend, sess1_T1_ss, sess2_T1_ss, omat=f'{output_folder}/sess1tosess2.mat',
+                                              init=rigid_init, initial=initial, log=log)
+                np.savetxt(world_mat, transform)
+                manifest.record(f"rigid {backend.name}", rigid_inputs, [world_mat], params=rigid_params)
+            else:
+                transform = np.loadtxt(world_mat)
+        else:
+            log("Using session 1 to session 2 transform composed from previous registrations ...")
+            np.savetxt(world_mat, transform)
+
+        if not cached:
+            for session_id, header, dicom in ((sess1_id, sess1T1_dicom_header, session1_T1_dicom), (sess2_id, sess2T1_dicom_header, session2_T1_dicom)):
+                graph.add_session(session_id, date=header.StudyDate, description=getattr(header, "SeriesDescription", ""), dicom=dicom,
+                                  frame_of_reference=frame_of_reference(header))
+            graph.add_edge(sess1_id, sess2_id, transform)
+            try:
+                graph.save()
+            except OSError as e:
+                log(f"Couldn't save transform graph: {e}")
+
+        # cheap check of the registration: similarity of the session 2 brain and the aligned session 1 brain
+        # (of the heads, if the brains weren't needed)
+        similarity_files = (sess1_T1_ss, sess2_T1_ss) if brains else (sess1_T1, sess2_T1)
+        global_similarity = registration_similarity(*similarity_files, transform, stride=3)
+        log(f"Registration similarity (whole brain): {format_similarity(global_similarity)}")
+        if is_suspect(global_similarity):
+            log(f"WARNING: the registration looks wrong (NCC below {SUSPECT_NCC}), check it before using any prescription")
+
+        prescriptions = []
+        # transform each session 1 spectroscopy NIFTI as soon as its conversion is done
+        for future in as_completed(conversions):
+            dcm = conversions[future]
+            new_filename = future.result()
+            manifest.record(f"spec2nii {Path(dcm).resolve()}", [dcm], [new_filename])
+            suffix = ''.join(Path(new_filename).suffixes)
+            roi=Path(new_filename.removesuffix(suffix)).stem
+
+            spec_nii = nib.load(new_filename)
+            new_affine = transform @ spec_nii.affine
+
+            aligned_spec = nib.load(new_filename) #start with session 1 spec nifti
+            aligned_spec.set_sform(new_affine,code='unknown')
+            aligned_spec.set_qform(new_affine,code='scanner')
+            nib.save(aligned_spec,f'{output_folder}/{roi}_aligned.nii.gz')
+
+            # CSI grids are transformed as a whole by the affine, so the same code handles one voxel or hundreds
+            grid_shape = spec_grid_shape(spec_nii)
+            log("\n-------------")
+            log(f"ROI: {roi}")
+            log("-------------")
+            log(f"PREVIOUS")
+            for line in format_prescription(spec_nii):
+                log(line)
+
+            slice_orientation_pitch,inplane_rot,[dimX,dimY,dimZ] = calc_prescription_from_nifti(aligned_spec)
+            new_centre = voxel_centre(new_affine, grid_shape)
+            transvec = convert_signs_to_letters(np.round(new_centre,1))
+            new_lines = format_prescription(aligned_spec)
+
+            # Define the file name based on the ROI
+            filename = f"{roi}_prescription.txt"
+            prescription_file = f"{output_folder}/{filename}"
+            log(f"\nTODAY")
+            for line in new_lines:
+                log(line)
+            if dcm in provisional_affines:
+                distance, angle = voxel_displacement(provisional_affines[dcm], new_affine, grid_shape)
+                log(f"Moved {distance:.1f} mm and {angle:.1f} deg from the provisional prescription")
+            roi_similarity = registration_similarity(*similarity_files, transform, new_affine, grid_shape)
+            suspect = is_suspect(global_similarity) or is_suspect(roi_similarity, SUSPECT_ROI_NCC)
+            quality_lines = [f"Registration similarity (whole brain): {format_similarity(global_similarity)}",
+                             f"Registration similarity (within 10 mm of the voxel): {format_similarity(roi_similarity)}"]
+            if suspect:
+                quality_lines.append("WARNING: SUSPECT REGISTRATION, check the QC image before using this prescription")
+            for line in quality_lines[1:]:
+                log(line)
+            if grid_shape != (1, 1, 1):
+                write_grid_correspondence(f"{output_folder}/{roi}_grid_correspondence.csv", spec_nii.affine, new_affine, grid_shape)
+                log(f"Previous and new position of each of the {int(np.prod(grid_shape))} grid voxels written to {roi}_grid_correspondence.csv")
+
+            try:
+                with open(prescription_file, 'w') as file:
+                    file.write(f"Study: {sess2T1_dicom_header.StudyDescription}")
+                    file.write(f"\nDate: {sess2T1_dicom_header.StudyDate}")
+                    file.write(f"\nParticipant: {sess2T1_dicom_header.PatientID}")
+                    file.write(f'\nSession 1 T1 DICOM file: {Path(session1_T1_dicom).name}')
+                    file.write(f'\nSession 2 T1 DICOM file: {Path(session2_T1_dicom).name}')
+                    file.write(f'\nSession 1 Spectroscopy DICOM file: {Path(dcm).name}')
+                    file.write(f"\n\n---------------------------\n\n")
+                    file.write(f"NEW {roi} PRESCRIPTION\n")
+                    file.write("\n".join(new_lines))
+                    file.write("\n\n" + "\n".join(quality_lines))
+                log(f"Prescription written to {filename}")
+                log("-------------\n")
+            except Exception as e:
+                log(f"Error writing to file: {e}")
+
+            # quick QC snapshot of the previous voxel on the session 1 T1 and the new voxel on the session 2 T1
+            qc_image = None
+            try:
+                qc_image = save_qc_image(f'{output_folder}/{roi}_qc.png', [
+                    render_orthogonal(sess1_T1, voxel_centre(spec_nii.affine, grid_shape), voxels=[(spec_nii.affine, grid_shape, 'red')]),
+                    render_orthogonal(sess2_T1, voxel_centre(new_affine, grid_shape), voxels=[(new_affine, grid_shape, 'yellow')]),
+                ])
+                log(f"QC image written to {roi}_qc.png")
+            except Exception as e:
+                log(f"Couldn't render QC image: {e}")
+
+            prescription = Prescription(roi=roi, position=transvec, orientation=slice_orientation_pitch, rotation=float(inplane_rot),
+                                        dimensions=[dimX, dimY, dimZ], prescription_file=prescription_file, grid=list(grid_shape),
+                                        qc_image=qc_image, registration_similarity={"global": global_similarity, "roi": roi_similarity},
+                                        suspect_registration=suspect)
+
+            if tissue:
+                # partial volume fractions inside the voxel (or whole grid), each in its own session's T1 space
+                prescription.previous_tissue = tissue_fractions(spec_nii.affine, sess1_segmentation.result(), grid_shape)
+                prescription.new_tissue = tissue_fractions(new_affine, sess2_segmentation.result(), grid_shape)
+                manifest.record("sess1_fast", [sess1_T1_ss], sess1_segmentation.result())
+                manifest.record("sess2_fast", [sess2_T1_ss], sess2_segmentation.result())
+                log(f"Tissue fractions PREVIOUS: {format_tissue_fractions(prescription.previous_tissue)}")
+                log(f"Tissue fractions TODAY: {format_tissue_fractions(prescription.new_tissue)}")
+                try:
+                    with open(prescription_file, 'a') as file:
+                        file.write(f"\n\nTissue fractions (previous voxel): {format_tissue_fractions(prescription.previous_tissue)}")
+                        file.write(f"\nTissue fractions (new voxel): {format_tissue_fractions(prescription.new_tissue)}")
+                except Exception as e:
+                    log(f"Error writing to file: {e}")
+
+            record_result(output_folder, "align", study=str(sess2T1_dicom_header.StudyDescription), participant=str(sess2T1_dicom_header.PatientID),
+                          session=str(sess2T1_dicom_header.StudyDate), roi=roi, position=transvec,
+                          pos_x=float(new_centre[0]), pos_y=float(new_centre[1]), pos_z=float(new_centre[2]),
+                          orientation=slice_orientation_pitch, rotation=float(inplane_rot), dim_x=dimX, dim_y=dimY, dim_z=dimZ,
+                          transform=transform, grid=list(grid_shape), duration_s=time.perf_counter() - start_time, spectroscopy_dicom=str(dcm),
+                          previous_position=[float(v) for v in voxel_centre(spec_nii.affine, grid_shape)],
+                          previous_tissue=prescription.previous_tissue, new_tissue=prescription.new_tissue, qc_image=qc_image,
+                          registration_similarity=prescription.registration_similarity, suspect_registration=suspect)
+            prescriptions.append(prescription)
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+    record_stage("total", time.perf_counter() - start_time)
+    log("\nVoxAlign process completed successfully.\n")
+    return prescriptions
+
+
+def register_to_MNI(output_folder, T1_dicom, nonlin_path=None, fast_registration=False, executor=None, warm_start_path=None,
+                    frame_uid=None, skull_strip=False, log=print):
+    """Register the T1 in `T1_dicom` nonlinearly to MNI space, in `output_folder`.
+
+    If `nonlin_path` points to an output folder from a previous run, its registration is reused and
+    the new T1 (newT1_ss) is linearly registered to the old one instead, unless both were acquired in
+    the frame of reference `frame_uid` without the head moving in between (then the new T1 is only
+    skull stripped, to newT1_ss, if `skull_strip` is set). If `warm_start_path` does,
+    the new T1 gets its own registration, but fnirt starts from the previous warp (composed with the
+    rigid transform between the sessions) and only runs the finest levels. The nonlinear registration
+    goes to the named executor (see executors.get_executor), e.g. to run on a cluster node. Returns a
+    description of the registration for the output files.
+    """
+    output_folder, T1_dicom = os.path.abspath(output_folder), os.path.abspath(T1_dicom)
+    if nonlin_path and warm_start_path:
+        raise Exception("Use either a pre-run registration (nonlin_path) or a warm start (warm_start_path), not both")
+    if warm_start_path:
+        problems = validate_manifest(warm_start_path, PRERUN_REQUIRED_FILES)
+        if problems:
+            raise Exception(f"Cannot warm start from the MNI registration in {warm_start_path}: {'; '.join(problems)}")
+
+    if nonlin_path:
+        # reuse the previous registration by reference rather than copying hundreds of MB
+        problems = validate_manifest(nonlin_path, PRERUN_REQUIRED_FILES)
+        if problems:
+            raise Exception(f"Cannot reuse MNI registration in {nonlin_path}: {'; '.join(problems)}")
+        link_files(nonlin_path, output_folder, PRERUN_REQUIRED_FILES)
+
+        #convert new T1 DICOM to NIFTI
+        command = f"dcm2niix -f newT1 -o '{output_folder}' -s y -z n {T1_dicom}"
+        result = run_tool(command, check=True, cwd=output_folder)
+
+        try:
+            previous_frame_uid = read_manifest(nonlin_path).get("frame_of_reference")
+        except OSError:
+            previous_frame_uid = None
+        same_frame = (bool(frame_uid) and previous_frame_uid == frame_uid
+                      and unmoved_in_frame(f"{output_folder}/T1.nii", f"{output_folder}/newT1.nii", log))
+        if not same_frame or skull_strip:
+            #skull strip new T1
+            log("\n...\n\nSkull stripping T1 ...")
+            command = f"bet2 newT1.nii newT1_ss.nii"
+            result = run_tool(command, check=True, cwd=output_folder)
+
+        if same_frame:
+            # the scanner coordinates of the two T1s match, so the old to new matrix is flirt's version of the identity
+            log("Same frame of reference and no repositioning: skipping the registration of new and existing T1s")
+            np.savetxt(f"{output_folder}/T1tonewT1lin.mat", world_to_flirt_matrix(np.eye(4), nib.load(f"{output_folder}/T1_ss.nii.gz"),
+                                                                                 nib.load(f"{output_folder}/newT1.nii")))
+        else:
+            # linearly register the new T1 to the one already registered to MNI space
+            log("\n...\n\nLinearly registering new and existing T1s ...")
+            initialised_rigid(FSLBackend(), f"{output_folder}/T1_ss.nii.gz", f"{output_folder}/newT1_ss.nii.gz",
+                              omat=f"{output_folder}/T1tonewT1lin.mat", out=f"{output_folder}/T1tonewT1lin", log=log)
+
+    else:
+        #convert T1 DICOM to NIFTI
+        command = f"dcm2niix -f T1 -o '{output_folder}' -s y -z n {T1_dicom}"
+        result = run_tool(command, check=True, cwd=output_folder)
+
+        # crop neck from T1
+        command = "robustfov -r croppedT1.nii -i T1.nii"
+        result = run_tool(command, check=True, cwd=output_folder)
+
+        #skull strip T1
+        log("\n...\n\nSkull stripping T1 ...")
+        command = f"bet2 croppedT1.nii.gz T1_ss.nii"
+        result = run_tool(command, check=True, cwd=output_folder)
+
+        if warm_start_path:
+            # the previous session's warp, brought into this session by a rigid registration of the two brains
+            os.makedirs(f"{output_folder}/previous", exist_ok=True)
+            link_files(warm_start_path, f"{output_folder}/previous", ["T1_ss.nii.gz", "T1toMNI_warp.nii.gz"])
+            log("\n...\n\nLinearly registering new and previous T1s ...")
+            initialised_rigid(FSLBackend(), f"{output_folder}/T1_ss.nii.gz", f"{output_folder}/previous/T1_ss.nii.gz",
+                              omat=f"{output_folder}/T1toprevT1.mat", log=log)
+            log("Nonlinear registration to MNI space, starting from the previous warp ...")
+            FSLBackend().refine_nonlinear("croppedT1.nii.gz", "T1toprevT1.mat", "previous/T1toMNI_warp.nii.gz",
+                                          "$FSLDIR/data/standard/MNI152_T1_2mm.nii.gz", "T1toMNI",
+                                          cwd=output_folder, executor=get_executor(executor))
+        else:
+            # linearly register the T1 to MNI space, then starting from that, nonlinearly register it
+            log("\n...\n\nLinear, then nonlinear registration to MNI space ...")
+            if fast_registration:
+            # subsampling level controls how fast (but also how accurate) it is. fnirt default from T1_2_MNI152_2mm.cnf is --subsamp=4,4,2,2,1,1
+                subsamp = "8,8,8,4,2,1"
+                log("Running faster nonlinear registration to MNI space, using more aggressive subsampling")
+            else:
+                subsamp = None
+                log("Running long nonlinear registration to MNI space (using FSL subsampling defaults)")
+            FSLBackend().nonlinear("croppedT1.nii.gz", "T1_ss.nii.gz", "$FSLDIR/data/standard/MNI152_T1_2mm.nii.gz",
+                                   "$FSLDIR/data/standard/MNI152_T1_2mm_brain.nii.gz", "T1toMNI", subsamp=subsamp,
+                                   cwd=output_folder, executor=get_executor(executor))
+
+        # record content hashes so later runs can check and reuse this registration without copying it
+        try:
+            write_manifest(output_folder, PRERUN_REQUIRED_FILES, T1_dicom=str(T1_dicom), frame_of_reference=frame_uid)
+        except OSError as e:
+            log(f"Couldn't write registration manifest: {e}")
+
+    if nonlin_path is not None:
+        regtext = "Used pre-run nonlinear registration to MNI space"
+    elif warm_start_path:
+        regtext = f"Nonlinear registration warm started from {warm_start_path}: subsampling 1,1"
+    else:
+        if fast_registration:
+            regtext = "Fast nonlinear registration: subsampling 8,8,8,4,2,1"
+        else:
+            regtext = "Slow (default) nonlinear registration: subsampling 4,4,2,2,1,1"
+
+    return regtext
+
+
+def mni_to_native(output_folder, MNI_coords, nonlin_path=None):
+    """Native T1 coordinates (mm, rounded to 0.1) of MNI coordinates, using the registration in `output_folder`.
+
+    All coordinates go through a single std2imgcoord call (and img2imgcoord call when a pre-run
+    registration is reused), so the template and warp are only loaded once per participant.
+    """
+    coords_text = ' '.join(f"'{c[0]} {c[1]} {c[2]}'" for c in MNI_coords)
+    command = f"printf '%s\\n' {coords_text} | std2imgcoord -img T1_ss.nii.gz -std $FSLDIR/data/standard/MNI152_T1_2mm.nii.gz -warp T1toMNI_warp.nii.gz  -"
+    result = run_tool(command, check=True, cwd=output_folder)
+    native = np.asarray(result.stdout.split(), dtype=float).reshape(-1, 3)[:len(MNI_coords)]
+
+    if nonlin_path:
+        coords_text = ' '.join(f"'{c[0]} {c[1]} {c[2]}'" for c in native)
+        # newT1_ss (if there is one) has the same voxel grid as newT1, which always exists
+        command = f"printf '%s\\n' {coords_text} | img2imgcoord -src T1_ss.nii.gz -dest newT1.nii -mm -xfm T1tonewT1lin.mat  -"
+        result = run_tool(command, check=True, cwd=output_folder)
+        # first line of the output is a header
+        native = np.asarray(' '.join(result.stdout.strip().split('\n')[1:]).split(), dtype=float).reshape(-1, 3)[:len(MNI_coords)]
+
+    return np.round(native, 1)
+
+
+def run_mni_lookup(output_folder, T1_dicom, MNI_coords, nonlin_path=None, fast_registration=False, executor=None, warm_start_path=None, log=print):
+    """Find the native space position of each MNI coordinate for the participant in `T1_dicom`.
+
+    If `nonlin_path` points to an output folder from a previous run, its nonlinear MNI registration
+    is reused and only a linear registration to the new T1 is run. If `warm_start_path` does, the new
+    registration starts from that run's warp (see register_to_MNI). Returns a NativePosition per coordinate.
+    """
+    start_time = time.perf_counter()
+    set_current_tool("mni-lookup")
+    output_folder, T1_dicom = os.path.abspath(output_folder), os.path.abspath(T1_dicom)
+    nonlin_path = os.path.abspath(nonlin_path) if nonlin_path else None
+    log("Running VoxAlign MNI Lookup!")
+    log(f"\nOutput folder: {output_folder}")
+    log(f"\nT1 DICOM: {T1_dicom}")
+    for coord_row in MNI_coords:
+        log(f"\nInput MNI coordinates: [{coord_row[0]}, {coord_row[1]}, {coord_row[2]}]")
+
+    T1_dicom_header = preflight([T1_dicom], tools=PIPELINE_TOOLS["mni-lookup"], log=log)[T1_dicom]
+
+    regtext = register_to_MNI(output_folder, T1_dicom, nonlin_path, fast_registration, executor, warm_start_path,
+                              frame_of_reference(T1_dicom_header), log=log)
+
+    filename='MNI_lookup_voxel_pos.txt'
+    try:
+        with open(f'{output_folder}/{filename}', 'a') as file:
+            file.write(f"Study: {T1_dicom_header.StudyDescription}")
+            file.write(f"\nDate: {T1_dicom_header.StudyDate}")
+            file.write(f"\nParticipant: {T1_dicom_header.PatientID}")
+            file.write(f'\nT1 DICOM file: {Path(T1_dicom).name}')
+            file.write(f'\n{regtext}')
+            file.write(f"\n---------------------------")
+    except Exception as e:
+        log(f"Error writing to file: {e}")
+
+    # given these warps, translate the input MNI coordinates to subject space
+    all_native_coords = mni_to_native(output_folder, MNI_coords, nonlin_path)
+    positions = []
+    fslcolors = ['red','orange','yellow','green','blue','purple']
+    for voxnum,coord_row in enumerate(MNI_coords):
+        new_coords = all_native_coords[voxnum]
+        colour = voxnum % len(fslcolors)
+
+        # write out annotations file that FSL loads in to show crosshair(s) at selected coordinates
+        # for current T1 (native space)
+        native_annotations_txt = compose_fsl_annot_text(fslcolors,colour,new_coords)
+        try:
+            with open(f'{output_folder}/native_annotations.txt', 'a') as file:
+                file.write(native_annotations_txt)
+        except Exception as e:
+            log(f"Couldn't save voxel position annotation for fsleyes: {e}")
+
+        # also show the requested coordinates in MNI space
+        MNI_annotations_txt = compose_fsl_annot_text(fslcolors,colour,coord_row)
+        try:
+            with open(f'{output_folder}/MNI_annotations.txt', 'a') as file:
+                file.write(MNI_annotations_txt)
+        except Exception as e:
+            log(f"Couldn't save MNI position annotation for fsleyes: {e}")
+
+        transvec = convert_signs_to_letters(np.round(new_coords,1))
+        log("\n-------------")
+        log(f"MNI Coordinates: {coord_row}")
+        log(f'Position: {transvec}')
+
+        try:
+            with open(f'{output_folder}/{filename}', 'a') as file:
+                file.write(f"\n\n---------------------------")
+                file.write(f"\nMNI Coordinates: {coord_row}")
+                file.write(f'\nVoxel Position: {transvec}\n')
+                file.write(f"---------------------------")
+
+            log(f"Position written to {filename}")
+            log("-------------\n")
+        except Exception as e:
+            log(f"Error writing to file: {e}")
+
+        record_result(output_folder, "mni-lookup", study=str(T1_dicom_header.StudyDescription), participant=str(T1_dicom_header.PatientID),
+                      session=str(T1_dicom_header.StudyDate), position=transvec,
+                      pos_x=float(new_coords[0]), pos_y=float(new_coords[1]), pos_z=float(new_coords[2]),
+                      mni_x=float(coord_row[0]), mni_y=float(coord_row[1]), mni_z=float(coord_row[2]),
+                      duration_s=time.perf_counter() - start_time, registration=regtext, T1_dicom=str(T1_dicom))
+        positions.append(NativePosition(mni=[float(c) for c in coord_row], native=[float(c) for c in new_coords], position=transvec))
+
+    # QC snapshots with crosshairs at the native positions and the requested MNI coordinates come last,
+    # since the MNI space T1 is only made for them
+    try:
+        MNI_T1 = materialise(output_folder, "T1toMNInonlin", log)
+        native_T1 = f'{output_folder}/newT1.nii' if nonlin_path else f'{output_folder}/croppedT1.nii.gz'
+        for voxnum,found in enumerate(positions):
+            colour = fslcolors[voxnum % len(fslcolors)]
+            save_qc_image(f'{output_folder}/MNI_lookup_{voxnum+1}_qc.png', [
+                render_orthogonal(native_T1, found.native, crosshairs=[(found.native, colour)]),
+                render_orthogonal(MNI_T1, found.mni, crosshairs=[(found.mni, colour)]),
+            ])
+        log("QC images written to MNI_lookup_*_qc.png")
+    except Exception as e:
+        log(f"Couldn't render QC images: {e}")
+
+    record_stage("total", time.perf_counter() - start_time)
+    log("\nVoxAlign MNI lookup process completed successfully.\n")
+    return positions
+
+
+def _mni_lookup_participant(participant, job, log):
+    def participant_log(text):
+        for line in str(text).split('\n'):
+            log(f"[{participant}] {line}")
+    os.makedirs(job.output_folder, exist_ok=True)
+    return job.run(log=participant_log)
+
+def read_mni_lookup_table(table):
+    """Read a CSV of participant,T1_dicom,x,y,z[,nonlin_path] rows (one per coordinate) grouped by participant.
+
+    Relative paths are taken relative to the table. Returns {participant: (T1_dicom, nonlin_path, coords)},
+    raising a ValueError if the table has no rows.
+    """
+    base = Path(table).resolve().parent
+    participants = {}
+    with open(table, newline='') as file:
+        for row in csv.DictReader(file):
+            participant = row['participant'].strip()
+            T1_dicom = str(base / row['T1_dicom'].strip())
+            nonlin_path = str(base / row['nonlin_path'].strip()) if (row.get('nonlin_path') or '').strip() else None
+            if participant not in participants:
+                participants[participant] = (T1_dicom, nonlin_path, [])
+            elif participants[participant][0] != T1_dicom:
+                raise Exception(f"Participant {participant} has more than one T1_dicom in {table}")
+            participants[participant][2].append([float(row['x']), float(row['y']), float(row['z'])])
+    if not participants:
+        raise ValueError(f"No participants in {table}")
+    return participants
+
+def run_mni_lookup_batch(table, output_root, fast_registration=False, workers=None, results_file=None, executor=None, log=print):
+    """MNI lookups for every participant in a CSV table, several participants at a time.
+
+    Each participant is registered once and all their coordinates are looked up together, in
+    <output_root>/<participant>. The native positions are written to `results_file` (by default
+    <output_root>/mni_lookup_results.csv), with any errors, and returned as a list of rows.
+    """
+    participants = read_mni_lookup_table(table)
+    output_root = os.path.abspath(output_root)
+    # fnirt is the largest stage, so size the number of parallel participants by its memory
+    if workers is None:
+        workers = min(scheduler.max_cpus, int(scheduler.max_memory_gb // STAGE_COSTS["fnirt"][1]) or 1)
+    workers = max(1, min(workers, len(participants)))
+    log(f"Running MNI lookups for {len(participants)} participants, {workers} at a time")
+
+    # the participants run in threads of this process, so all their tools share one scheduler budget
+    rows = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_mni_lookup_participant, participant,
+                               MNILookupJob(os.path.join(output_root, participant), T1_dicom, tuple(map(tuple, coords)),
+                                            nonlin_path=nonlin_path, fast_registration=fast_registration, executor=executor), log): participant
+                   for participant, (T1_dicom, nonlin_path, coords) in participants.items()}
+        for future in as_completed(futures):
+            participant = futures[future]
+            coords = participants[participant][2]
+            try:
+                native = [found.native for found in future.result()]
+                error = ''
+                log(f"{participant}: done")
+            except Exception as e:
+                native = [[float('nan')] * 3] * len(coords)
+                error = str(e)
+                log(f"{participant}: failed ({e})")
+            for coord, new_coords in zip(coords, native):
+                rows.append({"participant": participant, "mni_x": coord[0], "mni_y": coord[1], "mni_z": coord[2],
+                             "native_x": new_coords[0], "native_y": new_coords[1], "native_z": new_coords[2],
+                             "position": '' if error else convert_signs_to_letters(np.round(new_coords, 1)),
+                             "output_folder": os.path.join(output_root, participant), "error": error})
+
+    results_file = results_file or os.path.join(output_root, 'mni_lookup_results.csv')
+    with open(results_file, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    log(f"Native positions written to {results_file}")
+    return rows
+
+
+def run_placement(output_folder, T1_dicom, region, dims=(20, 20, 20), atlas="Harvard-Oxford Cortical Structural Atlas", hemisphere=None,
+                  nonlin_path=None, fast_registration=False, max_angle=20, min_brain=0.98, gm_weight=1.0, executor=None,
+                  warm_start_path=None, log=print):
+    """Place a voxel of `dims` mm to cover an atlas region in the participant's T1, maximising grey matter.
+
+    The region is warped from MNI space to the T1 with the inverse of the nonlinear registration
+    (reusing the one in `nonlin_path` if given), and the voxel position and orientation are searched
+    against it, the FAST grey matter map and the brain mask. Returns the placed voxel's Prescription.
+    """
+    start_time = time.perf_counter()
+    set_current_tool("place")
+    output_folder, T1_dicom = os.path.abspath(output_folder), os.path.abspath(T1_dicom)
+    nonlin_path = os.path.abspath(nonlin_path) if nonlin_path else None
+    log("Running VoxAlign voxel placement!")
+    log(f"\nOutput folder: {output_folder}")
+    log(f"\nT1 DICOM: {T1_dicom}")
+    log(f"\nRegion: {region} ({hemisphere or 'both hemispheres'}), {atlas}")
+
+    T1_dicom_header = preflight([T1_dicom], tools=PIPELINE_TOOLS["place"], log=log)[T1_dicom]
+    # placement segments the brain, so it is needed even when the registration to the existing T1 is skipped
+    regtext = register_to_MNI(output_folder, T1_dicom, nonlin_path, fast_registration, executor, warm_start_path,
+                              frame_of_reference(T1_dicom_header), skull_strip=True, log=log)
+    native_ss = f'{output_folder}/newT1_ss.nii.gz' if nonlin_path else f'{output_folder}/T1_ss.nii.gz'
+
+    # bring the atlas region into the participant's T1 space
+    log("\n...\n\nWarping atlas region to the T1 ...")
+    nib.save(atlas_region_image(atlas, region, hemisphere), f'{output_folder}/region_MNI.nii.gz')
+    if not os.path.exists(f'{output_folder}/MNItoT1_warp.nii.gz'):
+        command = "invwarp -w T1toMNI_warp.nii.gz -o MNItoT1_warp.nii.gz -r croppedT1.nii.gz"
+        result = run_tool(command, check=True, cwd=output_folder)
+    command = f"applywarp -i region_MNI.nii.gz -r {native_ss} -w MNItoT1_warp.nii.gz -o region_native.nii.gz --interp=trilinear"
+    if nonlin_path:
+        command += " --postmat=T1tonewT1lin.mat"
+    result = run_tool(command, check=True, cwd=output_folder)
+
+    log("Segmenting the T1 ...")
+    pve_files = segment_T1(native_ss)
+
+    log("Searching voxel positions and orientations ...")
+    affine, coverage = optimise_placement(nib.load(f'{output_folder}/region_native.nii.gz'), nib.load(pve_files[TISSUE_CLASSES.index("GM")]), nib.load(native_ss),
+                                          dims, max_angle=max_angle, gm_weight=gm_weight, min_brain=min_brain, log=log)
+    placed = nib.Nifti1Image(np.zeros((1,1,1), dtype=np.float32), affine)
+    placed.set_sform(affine,code='unknown')
+    placed.set_qform(affine,code='scanner')
+    nib.save(placed, f'{output_folder}/placed_voxel.nii.gz')
+
+    slice_orientation_pitch,inplane_rot,[dimX,dimY,dimZ] = calc_prescription_from_nifti(placed)
+    transvec = convert_signs_to_letters(np.round(affine[0:3,3],1))
+    coverage_text = f"region probability {coverage['region']:.2f}, GM {coverage['GM']:.2f}, inside brain {coverage['brain']:.2f}"
+    log("\n-------------")
+    log(f"PLACED VOXEL: {region}")
+    log(f'Position: {transvec}')
+    log(f"Orientation: {slice_orientation_pitch}")
+    log(f"Rotation: {inplane_rot:.2f} deg")
+    log(f"Dimensions: {dimX} mm x {dimY} mm x {dimZ} mm")
+    log(f"Mean {coverage_text}")
+
+    filename = 'placement_prescription.txt'
+    try:
+        with open(f'{output_folder}/{filename}', 'w') as file:
+            file.write(f"Study: {T1_dicom_header.StudyDescription}")
+            file.write(f"\nDate: {T1_dicom_header.StudyDate}")
+            file.write(f"\nParticipant: {T1_dicom_header.PatientID}")
+            file.write(f'\nT1 DICOM file: {Path(T1_dicom).name}')
+            file.write(f'\n{regtext}')
+            file.write(f'\nRegion: {region} ({hemisphere or "both hemispheres"}), {atlas}')
+            file.write(f"\n\n---------------------------\n\n")
+            file.write(f'Position: {transvec}\n')
+            file.write(f"Orientation: {slice_orientation_pitch}\n")
+            file.write(f"Rotation: {inplane_rot:.2f} deg\n")
+            file.write(f"Dimensions: {dimX} mm x {dimY} mm x {dimZ} mm\n")
+            file.write(f"Mean {coverage_text}")
+        log(f"Prescription written to {filename}")
+        log("-------------\n")
+    except Exception as e:
+        log(f"Error writing to file: {e}")
+
+    try:
+        save_qc_image(f'{output_folder}/placement_qc.png', [render_orthogonal(native_ss, affine[:3,3], voxels=[(affine, (1,1,1), 'yellow')])])
+    except Exception as e:
+        log(f"Couldn't render QC image: {e}")
+
+    record_result(output_folder, "place", study=str(T1_dicom_header.StudyDescription), participant=str(T1_dicom_header.PatientID),
+                  session=str(T1_dicom_header.StudyDate), roi=region, position=transvec,
+                  pos_x=float(affine[0,3]), pos_y=float(affine[1,3]), pos_z=float(affine[2,3]),
+                  orientation=slice_orientation_pitch, rotation=float(inplane_rot), dim_x=dimX, dim_y=dimY, dim_z=dimZ,
+                  duration_s=time.perf_counter() - start_time, registration=regtext, T1_dicom=str(T1_dicom),
+                  atlas=atlas, hemisphere=hemisphere, coverage=coverage)
+
+    record_stage("total", time.perf_counter() - start_time)
+    log("\nVoxAlign voxel placement completed successfully.\n")
+    return Prescription(roi=region, position=transvec, orientation=slice_orientation_pitch, rotation=float(inplane_rot),
+                        dimensions=[dimX, dimY, dimZ], prescription_file=f'{output_folder}/{filename}',
+                        qc_image=f'{output_folder}/placement_qc.png', coverage=coverage)
+
+
+def run_dice(outdir, sess1T1, sess2T1, sess1svs, sess2svs, log=print):
+    """
+    Calculates the Dice coefficient between svs voxels from different sessions.
+    """
+    set_current_tool("dice")
+    start_time = time.perf_counter()
+    outdir = os.path.abspath(outdir)
+    sess1T1, sess2T1, sess1svs, sess2svs = (os.path.abspath(f) for f in (sess1T1, sess2T1, sess1svs, sess2svs))
+    converters = {"dcm2niix": (sess1T1, sess2T1), "spec2nii": (sess1svs, sess2svs)}
+    tools = [tool for tool in PIPELINE_TOOLS["dice"] if tool not in converters or any(f.endswith('.dcm') for f in converters[tool])]
+    preflight([sess1T1, sess2T1], [sess1svs, sess2svs], tools, log=log)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    # Convert any input svs DICOMs to NIFTI, both at once since each conversion has its own temporary folder
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        if Path(sess1svs).suffixes[-1] == ".dcm":
+            sess1svs_nifti = pool.submit(copy_context().run, convert_spec_dicom, sess1svs, outdir)
+        else:
+            sess1svs_nifti = sess1svs
+
+        if Path(sess2svs).suffixes[-1] == ".dcm":
+            sess2svs_nifti = pool.submit(copy_context().run, convert_spec_dicom, sess2svs, outdir)
+        else:
+            sess2svs_nifti = sess2svs
+
+        if isinstance(sess1svs_nifti, Future):
+            sess1svs_nifti = sess1svs_nifti.result()
+        if isinstance(sess2svs_nifti, Future):
+            sess2svs_nifti = sess2svs_nifti.result()
+
+    # Load svs and T1 niftis
+    sess1svs_nii=nib.load(sess1svs_nifti)
+    sess2svs_nii=nib.load(sess2svs_nifti)
+
+    # single voxel placeholders that the dice mask images are made from if they are asked for
+    svsplaceholder=np.zeros((2,2,2))
+    svsplaceholder[0, 0, 0] = 1.0
+    tmp = nib.Nifti2Image(svsplaceholder, affine=sess1svs_nii.affine)
+    nib.save(tmp,f'{outdir}/sess1_svs_tmp.nii.gz')
+    tmp = nib.Nifti2Image(svsplaceholder, affine=sess2svs_nii.affine)
+    nib.save(tmp,f'{outdir}/sess2_svs_tmp.nii.gz')
+    suffix = ''.join(Path(sess1svs_nifti).suffixes)
+    sess1roi=f"sess1_{Path(sess1svs_nifti.removesuffix(suffix)).stem}"
+
+    #prepare session 1 T1
+    if not os.path.exists(f'{outdir}/sess1_T1.nii'):
+        if Path(sess1T1).suffixes[-1] == ".nii":
+            result = run_tool(['cp', sess1T1, 'sess1_T1.nii'], check=True, cwd=outdir)
+        elif ''.join(Path(sess1T1).suffixes[-2:]) == ".nii.gz":
+            result = run_tool(['cp', sess1T1, 'sess1_T1.nii.gz'], check=True, cwd=outdir)
+            result = run_tool(['gunzip', 'sess1_T1.nii.gz'], check=True, cwd=outdir)
+        elif Path(sess1T1).suffixes[-1] == ".dcm":
+            result = run_tool(['dcm2niix','-f','sess1_T1','-o', outdir,'-s','y','-z','n',sess1T1], check=True)
+            log(result)
+
+    #skull strip session 1 T1
+    if not os.path.exists(f'{outdir}/sess1_T1_ss.nii.gz'):
+        log("\n...\nSkull stripping session 1 T1 ...")
+        command = f"bet2 sess1_T1.nii sess1_T1_ss.nii.gz"
+        result = run_tool(command, check=True, cwd=outdir)
+    else:
+        log("\n...\nFound existing skull stripped sess 1 T1 sess1_T1_ss.nii.gz")
+
+    #prepare session 2 T1
+    if not os.path.exists(f'{outdir}/sess2_T1.nii'):
+        if Path(sess2T1).suffixes[-1] == ".nii":
+            result = run_tool(['cp', sess2T1, 'sess2_T1.nii'], check=True, cwd=outdir)
+        elif ''.join(Path(sess2T1).suffixes[-2:]) == ".nii.gz":
+            result = run_tool(['cp', sess2T1, 'sess2_T1.nii.gz'], check=True, cwd=outdir)
+            result = run_tool(['gunzip', 'sess2_T1.nii.gz'], check=True, cwd=outdir)
+        elif Path(sess2T1).suffixes[-1] == ".dcm":
+            result = run_tool(['dcm2niix','-f','sess2_T1','-o', outdir,'-s','y','-z','n',sess2T1], check=True)
+
+    #skull strip session 2 T1
+    command = f"cp {sess2T1} ."
+    result = run_tool(command, check=True, cwd=outdir)
+    if not os.path.exists(f'{outdir}/sess2_T1_ss.nii.gz'):
+        log("\nSkull stripping session 2 T1 ...")
+        command = f"bet2 sess2_T1.nii sess2_T1_ss.nii.gz"
+        result = run_tool(command, check=True, cwd=outdir)
+    else:
+        log("\nFound existing skull stripped sess 2 T1 sess2_T1_ss.nii.gz")
+
+    if not os.path.exists(f'{outdir}/sess1tosess2.mat'):
+        # use flirt to register session 1 T1 to session 2 T1
+        log("Aligning session 1 T1 to session 2 T1 ...")
+        transform = initialised_rigid(FSLBackend(), f'{outdir}/sess1_T1_ss.nii.gz', f'{outdir}/sess2_T1_ss.nii.gz', omat=f'{outdir}/sess1tosess2.mat', log=log)
+    else:
+        log("\nFound existing flirt affine transformation matrix sess1tosess2.mat")
+        transform = flirt_matrix_to_world(np.loadtxt(f'{outdir}/sess1tosess2.mat'), nib.load(f'{outdir}/sess1_T1_ss.nii.gz'), nib.load(f'{outdir}/sess2_T1_ss.nii.gz'))
+    np.savetxt(f'{outdir}/sess1tosess2_world.mat', transform)
+
+    # overlap of the two voxels in session 2 space, computed directly from their affines;
+    # the 0.25 mm mask images are only made if someone wants to look at them (materialise dice_masks)
+    dice = voxel_dice(transform @ sess1svs_nii.affine, sess2svs_nii.affine, spec_grid_shape(sess1svs_nii), spec_grid_shape(sess2svs_nii))
+    log(f"Dice coefficient: {dice:.2f}")
+    record_result(outdir, "dice", roi=sess1roi.removeprefix("sess1_"), dice=float(dice), duration_s=time.perf_counter() - start_time,
+                  sess1_spectroscopy=str(sess1svs), sess2_spectroscopy=str(sess2svs), sess1_T1=str(sess1T1), sess2_T1=str(sess2T1))
+    record_stage("total", time.perf_counter() - start_time)
+    return float(dice)
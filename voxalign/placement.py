@@ -0,0 +1,128 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import numpy as np
+import nibabel as nib
+from voxalign.resources import load_atlas
+from voxalign.utils import rotation_matrix
+
+# axes of a transverse voxel with no in-plane rotation, as read by calc_prescription_from_nifti
+BASE_ORIENTATION = np.diag([-1.0, 1.0, 1.0])
+
+def find_atlas_label(atlas_name, region):
+    """Index of the atlas label matching `region` (exactly, or as the only case-insensitive substring match)."""
+    labels = load_atlas(atlas_name)[2]
+    matches = [i for i, label in enumerate(labels) if label.lower() == region.lower()]
+    if not matches:
+        matches = [i for i, label in enumerate(labels) if region.lower() in label.lower()]
+    if len(matches) != 1:
+        found = ', '.join(labels[i] for i in matches) if matches else 'none'
+        raise Exception(f"Region '{region}' must match exactly one label of the {atlas_name} (matches: {found})")
+    return matches[0]
+
+def atlas_region_image(atlas_name, region, hemisphere=None):
+    """Probability (0-1) of an atlas region in MNI space, optionally restricted to one hemisphere."""
+    nii, data, labels = load_atlas(atlas_name)
+    prob = data[..., find_atlas_label(atlas_name, region)].astype(np.float32) / 100
+    if hemisphere:
+        # the Harvard-Oxford atlases are bilateral, so split them at the midline (MNI x = 0)
+        i = np.arange(prob.shape[0])
+        x = nii.affine[0, 0] * i + nii.affine[0, 3]
+        prob[(x > 0) if hemisphere == 'left' else (x < 0)] = 0
+    return nib.Nifti1Image(prob, nii.affine)
+
+def candidate_angles(max_angle, step, around=(0, 0, 0)):
+    steps = np.arange(-max_angle, max_angle + step / 2, step) if step > 0 else np.zeros(1)
+    return [np.asarray(around) + np.array(a) for a in np.stack(np.meshgrid(steps, steps, steps, indexing='ij'), -1).reshape(-1, 3)]
+
+def box_affine(centre, angles, dims):
+    """Affine of a single voxel spectroscopy NIfTI with the given centre, rotation and dimensions (mm)."""
+    affine = np.eye(4)
+    affine[:3, :3] = rotation_matrix(angles) @ BASE_ORIENTATION @ np.diag(dims)
+    affine[:3, 3] = centre
+    return affine
+
+def score_boxes(maps, map_affine, centres, angles, dims, samples=5, gm_weight=1.0, min_brain=0.98):
+    """Score boxes of size `dims` at every combination of `centres` (N, 3) and one rotation `angles`.
+
+    `maps` holds the region probability, grey matter and brain mask on the same grid, stacked
+    along the last axis. Each box is sampled at samples**3 points (nearest neighbour). The score
+    is the mean region probability plus `gm_weight` times the mean grey matter fraction, and boxes
+    with less than `min_brain` of their volume in the brain mask are rejected (-inf).
+    Returns the scores (N,) and the mean of each map in each box (N, 3).
+    """
+    offsets = (np.arange(samples) + 0.5) / samples - 0.5
+    local = np.stack(np.meshgrid(offsets, offsets, offsets, indexing='ij'), -1).reshape(-1, 3) * dims
+    world_offsets = local @ rotation_matrix(angles).T
+    # map world coordinates straight to the nearest voxel of the maps
+    to_vox = np.linalg.inv(map_affine)
+    vox = np.rint((centres[:, np.newaxis, :] + world_offsets[np.newaxis]) @ to_vox[:3, :3].T + to_vox[:3, 3]).astype(int)
+    inside = np.all((vox >= 0) & (vox < np.array(maps.shape[:3])), axis=-1)
+    vox = np.clip(vox, 0, np.array(maps.shape[:3]) - 1)
+    values = maps[vox[..., 0], vox[..., 1], vox[..., 2]] * inside[..., np.newaxis]
+    means = values.mean(axis=1)
+    scores = means[:, 0] + gm_weight * means[:, 1]
+    scores[means[:, 2] < min_brain] = -np.inf
+    return scores, means
+
+def optimise_placement(region_nii, gm_nii, brain_nii, dims, step=2.0, max_angle=20, angle_step=10,
+                       gm_weight=1.0, min_brain=0.98, min_region_prob=0.25, log=print):
+    """Search positions and orientations of a voxel to best cover an atlas region in subject space.
+
+    All three images must be on the same grid. Candidate centres are the region voxels with at
+    least `min_region_prob` on a `step` mm grid, and every rotation up to `max_angle` degrees about
+    each axis is tried. The best box is then refined with a finer search around it.
+    Returns the voxel affine and the mean region probability, GM fraction and brain fraction.
+    """
+    maps = np.stack([np.asanyarray(nii.dataobj, dtype=np.float32) for nii in (region_nii, gm_nii, brain_nii)], axis=-1)
+    maps[..., 2] = maps[..., 2] > 0
+    affine = region_nii.affine
+    dims = np.asarray(dims, dtype=float)
+
+    region_vox = np.argwhere(maps[..., 0] >= min_region_prob)
+    if len(region_vox) == 0:
+        raise Exception("The atlas region is empty in subject space")
+    centres = nib.affines.apply_affine(affine, region_vox)
+    # thin the centres down to one per `step` mm cell
+    _, keep = np.unique(np.floor(centres / step).astype(int), axis=0, return_index=True)
+    centres = centres[keep]
+
+    best = (-np.inf, None, None, None)
+    for angles in candidate_angles(max_angle, angle_step):
+        scores, means = score_boxes(maps, affine, centres, angles, dims, gm_weight=gm_weight, min_brain=min_brain)
+        i = int(np.argmax(scores))
+        if scores[i] > best[0]:
+            best = (scores[i], centres[i], angles, means[i])
+    log(f"Scored {len(centres) * len(candidate_angles(max_angle, angle_step))} candidate voxels")
+    if best[1] is None:
+        raise Exception(f"No voxel of {dims[0]:g} x {dims[1]:g} x {dims[2]:g} mm fits in the region with {min_brain:.0%} of it inside the brain")
+
+    # refine around the best candidate with 1 mm and 2.5 degree steps
+    offsets = np.stack(np.meshgrid(*[np.arange(-step, step + 0.5, 1.0)] * 3, indexing='ij'), -1).reshape(-1, 3)
+    centres = best[1] + offsets
+    for angles in candidate_angles(angle_step / 2, angle_step / 4, around=best[2]):
+        scores, means = score_boxes(maps, affine, centres, angles, dims, gm_weight=gm_weight, min_brain=min_brain)
+        i = int(np.argmax(scores))
+        if scores[i] > best[0]:
+            best = (scores[i], centres[i], angles, means[i])
+
+    score, centre, angles, means = best
+    return box_affine(centre, angles, dims), {"region": float(means[0]), "GM": float(means[1]), "brain": float(means[2])}
@@ -0,0 +1,143 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+
+import time
+import numpy as np
+import nibabel as nib
+import pydicom
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from voxalign.utils import missing_external_tools
+
+# Checks of every input a pipeline is given, run before its first external tool so that bad inputs
+# fail in a second rather than after minutes of conversion and registration. All the headers are
+# read at once on a thread pool (they are often on a network share) while the tools are looked up.
+
+# DICOM storage classes of MR images, which a spectroscopy input should never be
+MR_IMAGE_SOP_CLASSES = {"1.2.840.10008.5.1.4.1.1.4", "1.2.840.10008.5.1.4.1.1.4.1"}
+
+def is_nifti(path):
+    return str(path).endswith(('.nii', '.nii.gz'))
+
+def read_header(path):
+    """The DICOM header (without pixel data) or NIfTI image of an input."""
+    if is_nifti(path):
+        return nib.load(path)
+    return pydicom.dcmread(path, stop_before_pixels=True)
+
+def dicom_geometry(ds):
+    """(ImageOrientationPatient, PixelSpacing, SliceThickness) of classic or enhanced (multi-frame) DICOM, None where missing."""
+    orientation, spacing, thickness = ds.get("ImageOrientationPatient"), ds.get("PixelSpacing"), ds.get("SliceThickness")
+    shared = ds.get("SharedFunctionalGroupsSequence")
+    if shared:
+        if orientation is None and shared[0].get("PlaneOrientationSequence"):
+            orientation = shared[0].PlaneOrientationSequence[0].get("ImageOrientationPatient")
+        if shared[0].get("PixelMeasuresSequence"):
+            measures = shared[0].PixelMeasuresSequence[0]
+            spacing = spacing or measures.get("PixelSpacing")
+            thickness = thickness or measures.get("SliceThickness")
+    as_floats = lambda values: None if values is None else [float(v) for v in np.atleast_1d(values)]
+    return as_floats(orientation), as_floats(spacing), as_floats(thickness)
+
+def geometry_problems(name, ds):
+    problems = []
+    orientation, spacing, thickness = dicom_geometry(ds)
+    if orientation is not None:
+        row, col = np.array(orientation[:3]), np.array(orientation[3:6])
+        if len(orientation) != 6 or abs(np.linalg.norm(row) - 1) > 1e-3 or abs(np.linalg.norm(col) - 1) > 1e-3 or abs(row @ col) > 1e-3:
+            problems.append(f"{name}: ImageOrientationPatient {orientation} is not two perpendicular unit vectors")
+    if spacing is not None and (len(spacing) != 2 or min(spacing) <= 0):
+        problems.append(f"{name}: PixelSpacing {spacing} is not two positive numbers")
+    if thickness is not None and thickness[0] <= 0:
+        problems.append(f"{name}: SliceThickness {thickness[0]} is not positive")
+    return problems
+
+def nifti_problems(name, img):
+    if not np.all(np.isfinite(img.affine)) or abs(np.linalg.det(img.affine[:3, :3])) < 1e-6:
+        return [f"{name}: the NIfTI affine is not a valid voxel to world transform"]
+    return []
+
+def preflight(T1_files=(), spectroscopy_files=(), tools=(), same_resolution=False, log=print):
+    """Validate a pipeline's inputs and tools before it starts, raising an Exception listing every problem.
+
+    Checks that the inputs exist and can be read, that the DICOMs belong to one participant, that
+    T1s are MR images rather than localisers or spectroscopy and spectroscopy inputs are not
+    images, that the geometry in the headers makes sense, that the T1s have the same resolution
+    (with `same_resolution`), and that `tools` are installed. Returns {path: header} of the inputs, so
+    the pipeline doesn't have to read them again.
+    """
+    start_time = time.perf_counter()
+    inputs = [(path, "T1") for path in T1_files] + [(path, "spectroscopy") for path in spectroscopy_files]
+    problems = []
+    with ThreadPoolExecutor(max_workers=max(1, min(len(inputs), 16))) as pool:
+        tool_problems = pool.submit(missing_external_tools, list(tools))
+        futures = {path: pool.submit(read_header, path) for path, _ in inputs}
+        headers = {}
+        for path, future in futures.items():
+            try:
+                headers[path] = future.result()
+            except Exception as e:
+                problems.append(f"{Path(path).name}: can't be read ({type(e).__name__}: {e})")
+        problems += tool_problems.result()
+
+    participants = {}
+    for path, kind in inputs:
+        if path not in headers:
+            continue
+        name, header = Path(path).name, headers[path]
+        if isinstance(header, nib.filebasedimages.FileBasedImage):
+            problems += nifti_problems(name, header)
+            continue
+        participants.setdefault(str(header.get("PatientID", "")), []).append(name)
+        image_type = [str(t).upper() for t in header.get("ImageType", [])]
+        if kind == "T1":
+            if header.get("Modality") not in (None, "MR"):
+                problems.append(f"{name}: Modality is {header.Modality}, not MR")
+            if "LOCALIZER" in image_type:
+                problems.append(f"{name}: ImageType {'/'.join(image_type)} is a localiser, not a T1")
+            if "SPECTROSCOPY" in image_type:
+                problems.append(f"{name}: ImageType {'/'.join(image_type)} is spectroscopy, not a T1")
+            elif header.get("SOPClassUID") and str(header.SOPClassUID) not in MR_IMAGE_SOP_CLASSES:
+                problems.append(f"{name}: SOPClassUID {header.SOPClassUID} is not an MR image, so it can't be a T1")
+            problems += geometry_problems(name, header)
+        elif str(header.get("SOPClassUID", "")) in MR_IMAGE_SOP_CLASSES:
+            problems.append(f"{name}: is an MR image, not spectroscopy")
+
+    if len(participants) > 1:
+        problems.append("inputs are from different participants: " + "; ".join(f"PatientID '{p}': {', '.join(names)}" for p, names in participants.items()))
+
+    if same_resolution and len(T1_files) == 2 and all(path in headers for path in T1_files):
+        resolutions = []
+        for path in T1_files:
+            header = headers[path]
+            if isinstance(header, nib.filebasedimages.FileBasedImage):
+                resolutions.append([round(z, 3) for z in header.header.get_zooms()[:3]])
+            else:
+                _, spacing, thickness = dicom_geometry(header)
+                resolutions.append(None if spacing is None or thickness is None else [round(v, 3) for v in spacing + thickness])
+        if None not in resolutions and resolutions[0] != resolutions[1]:
+            problems.append(f"the T1s must have the same voxel resolution ({Path(T1_files[0]).name}: {resolutions[0]} mm, {Path(T1_files[1]).name}: {resolutions[1]} mm)")
+
+    if problems:
+        raise Exception("Preflight checks failed:\n  " + "\n  ".join(problems))
+    log(f"Preflight checks passed ({len(inputs)} inputs, {len(tools)} tools) in {time.perf_counter() - start_time:.2f} s")
+    return headers
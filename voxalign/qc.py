@@ -0,0 +1,132 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import struct
+import zlib
+import numpy as np
+import nibabel as nib
+from voxalign.utils import sample_volume
+
+# RGB values for the colour names used in the fsleyes annotation files
+COLOURS = {
+    'red': (255, 0, 0),
+    'orange': (255, 165, 0),
+    'yellow': (255, 255, 0),
+    'green': (0, 200, 0),
+    'blue': (40, 90, 255),
+    'purple': (160, 32, 240),
+    'cyan': (0, 255, 255),
+}
+
+# each panel is a plane through the centre, given as (fixed axis, column axis and direction, row axis and direction)
+# in world (RAS) coordinates: sagittal with anterior on the left, then coronal and axial in neurological convention
+PANELS = [
+    (0, (1, -1), (2, -1)),
+    (1, (0, 1), (2, -1)),
+    (2, (0, 1), (1, -1)),
+]
+
+def write_png(filename, rgb):
+    """Write an (H, W, 3) uint8 array as an 8 bit RGB PNG."""
+    rgb = np.ascontiguousarray(rgb, dtype=np.uint8)
+    height, width = rgb.shape[:2]
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    # every scanline starts with filter type 0 (none)
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), rgb.reshape(height, -1)], axis=1)
+    with open(filename, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        file.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        file.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)))
+        file.write(chunk(b'IEND', b''))
+
+def plane_points(centre, panel, fov=160, spacing=1.0):
+    """World coordinates (H, W, 3) of the pixels of one panel through `centre`."""
+    fixed, (col_axis, col_dir), (row_axis, row_dir) = panel
+    n = int(round(fov / spacing))
+    offsets = (np.arange(n) + 0.5) * spacing - fov / 2
+    points = np.empty((n, n, 3))
+    points[..., fixed] = centre[fixed]
+    points[..., col_axis] = centre[col_axis] + col_dir * offsets[np.newaxis, :]
+    points[..., row_axis] = centre[row_axis] + row_dir * offsets[:, np.newaxis]
+    return points
+
+def sample_plane(nii, points):
+    """Sample an image at world coordinates, reading only the bounding box of the points from disk."""
+    vox = nib.affines.apply_affine(np.linalg.inv(nii.affine), points.reshape(-1, 3))
+    lo = np.clip(np.floor(vox.min(axis=0)).astype(int), 0, np.array(nii.shape[:3]) - 1)
+    hi = np.clip(np.floor(vox.max(axis=0)).astype(int) + 2, 1, np.array(nii.shape[:3]))
+    if np.any(hi <= lo): # plane lies entirely outside the image
+        return np.zeros(points.shape[:2])
+    box = np.asanyarray(nii.dataobj[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]], dtype=float)
+    if box.ndim > 3:
+        box = box[..., 0]
+    return sample_volume(box, vox - lo).reshape(points.shape[:2])
+
+def voxel_outline(points, spec_affine, spec_shape=(1, 1, 1)):
+    """Boolean (H, W) mask of the pixels on the edge of where a panel cuts a spectroscopy voxel (or grid)."""
+    vox = nib.affines.apply_affine(np.linalg.inv(spec_affine), points.reshape(-1, 3))
+    inside = np.all((vox >= -0.5) & (vox < np.asarray(spec_shape[:3]) - 0.5), axis=1).reshape(points.shape[:2])
+    padded = np.pad(inside, 1)
+    interior = padded[:-2, 1:-1] & padded[2:, 1:-1] & padded[1:-1, :-2] & padded[1:-1, 2:]
+    return inside & ~interior
+
+def render_orthogonal(T1_file, centre, voxels=(), crosshairs=(), fov=160, spacing=1.0):
+    """Render sagittal, coronal and axial slices of a T1 through `centre` (world mm) side by side.
+
+    `voxels` is a list of (affine, shape, colour) outlines to draw and `crosshairs` a list of
+    (coordinate, colour). Only the three planes are sampled from the image. Returns an RGB array.
+    """
+    nii = nib.load(T1_file)
+    centre = np.asarray(centre, dtype=float)
+    panels = []
+    for panel in PANELS:
+        points = plane_points(centre, panel, fov, spacing)
+        values = sample_plane(nii, points)
+        top = np.percentile(values[values > 0], 99.5) if np.any(values > 0) else 1.0
+        grey = (np.clip(values / top, 0, 1) * 255).astype(np.uint8)
+        rgb = np.repeat(grey[..., np.newaxis], 3, axis=2)
+
+        for affine, shape, colour in voxels:
+            rgb[voxel_outline(points, affine, shape)] = COLOURS.get(colour, colour)
+
+        fixed, (col_axis, col_dir), (row_axis, row_dir) = panel
+        n = rgb.shape[0]
+        for coord, colour in crosshairs:
+            col = int(np.floor((col_dir * (coord[col_axis] - centre[col_axis]) + fov / 2) / spacing))
+            row = int(np.floor((row_dir * (coord[row_axis] - centre[row_axis]) + fov / 2) / spacing))
+            # leave a gap around the point itself so the anatomy underneath stays visible
+            gap = int(round(4 / spacing))
+            if 0 <= row < n:
+                line = np.r_[0:max(col - gap, 0), min(col + gap + 1, n):n]
+                rgb[row, line] = COLOURS.get(colour, colour)
+            if 0 <= col < n:
+                line = np.r_[0:max(row - gap, 0), min(row + gap + 1, n):n]
+                rgb[line, col] = COLOURS.get(colour, colour)
+        panels.append(rgb)
+    return np.concatenate(panels, axis=1)
+
+def save_qc_image(filename, rows):
+    """Stack rendered rows (e.g. previous session above new session) and write them to a PNG."""
+    write_png(filename, np.concatenate(rows, axis=0))
+    return filename
@@ -0,0 +1,125 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import numpy as np
+import nibabel as nib
+from voxalign.tissue import voxel_sample_points
+from voxalign.utils import sample_volume, voxel_centre
+
+# similarity below these (normalised cross correlation of the skull stripped T1s) flags a registration
+# as suspect; well aligned scans of the same participant are typically above 0.9
+SUSPECT_NCC = 0.8
+SUSPECT_ROI_NCC = 0.7
+# two T1s in one frame of reference are only trusted to be aligned without a registration above this
+SAME_FRAME_NCC = 0.9
+
+def normalised_cross_correlation(a, b):
+    a = a - a.mean()
+    b = b - b.mean()
+    return float(np.sum(a * b) / (np.sqrt(np.sum(a * a) * np.sum(b * b)) + 1e-12))
+
+def mutual_information(a, b, bins=32):
+    """Mutual information (nats) of two intensity samples, from their joint histogram."""
+    joint, _, _ = np.histogram2d(a, b, bins=bins)
+    joint /= joint.sum()
+    pa = joint.sum(axis=1, keepdims=True)
+    pb = joint.sum(axis=0, keepdims=True)
+    nonzero = joint > 0
+    return float(np.sum(joint[nonzero] * np.log(joint[nonzero] / (pa @ pb)[nonzero])))
+
+def read_box(nii, lo, hi, stride=1):
+    """Read only voxels lo:hi (clipped to the image) with `stride` from an image, returning the array and its first index."""
+    lo = np.clip(lo, 0, np.array(nii.shape[:3]) - 1)
+    hi = np.clip(hi, 1, np.array(nii.shape[:3]))
+    if np.any(hi <= lo):
+        return np.zeros((0, 0, 0)), lo
+    data = np.asanyarray(nii.dataobj[lo[0]:hi[0]:stride, lo[1]:hi[1]:stride, lo[2]:hi[2]:stride], dtype=float)
+    return data, lo
+
+def registration_similarity(in_file, ref_file, transform, spec_affine=None, spec_shape=(1, 1, 1), margin=10.0, stride=2):
+    """NCC and mutual information between the reference brain and the registered input brain.
+
+    `transform` takes input world coordinates to reference world coordinates. Reference brain voxels
+    (every `stride`th) are compared with the input image at the matching points. With `spec_affine`,
+    only the box `margin` mm around the voxel (or grid) is read from either image, otherwise the
+    whole brain is used. Returns a dict with the NCC, MI and number of points compared.
+    """
+    ref = nib.load(ref_file)
+    if spec_affine is None:
+        lo, hi = np.zeros(3, dtype=int), np.array(ref.shape[:3])
+    else:
+        # box around the voxel in its own voxel units, extended by the margin
+        pad = margin / np.linalg.norm(spec_affine[:3, :3], axis=0)
+        box_lo = -0.5 - pad
+        box_hi = np.asarray(spec_shape[:3]) - 0.5 + pad
+        corners = np.array([[hi_ if bit else lo_ for bit, lo_, hi_ in zip(bits, box_lo, box_hi)] for bits in np.ndindex(2, 2, 2)])
+        ref_corners = nib.affines.apply_affine(np.linalg.inv(ref.affine) @ spec_affine, corners)
+        lo, hi = np.floor(ref_corners.min(axis=0)).astype(int), np.ceil(ref_corners.max(axis=0)).astype(int) + 1
+    ref_data, lo = read_box(ref, lo, hi, stride)
+
+    vox = np.argwhere(ref_data > 0)
+    values = ref_data[ref_data > 0]
+    world = nib.affines.apply_affine(ref.affine, vox * stride + lo)
+    if spec_affine is not None and len(world):
+        spec_vox = nib.affines.apply_affine(np.linalg.inv(spec_affine), world)
+        inside = np.all((spec_vox >= box_lo) & (spec_vox <= box_hi), axis=1)
+        world, values = world[inside], values[inside]
+    if len(values) < 100:
+        return {"ncc": float('nan'), "mi": float('nan'), "points": int(len(values))}
+
+    moving = nib.load(in_file)
+    in_vox = nib.affines.apply_affine(np.linalg.inv(moving.affine) @ np.linalg.inv(transform), world)
+    in_data, in_lo = read_box(moving, np.floor(in_vox.min(axis=0)).astype(int), np.floor(in_vox.max(axis=0)).astype(int) + 2)
+    sampled = sample_volume(in_data, in_vox - in_lo) if in_data.size else np.zeros(len(values))
+    return {"ncc": normalised_cross_correlation(values, sampled), "mi": mutual_information(values, sampled), "points": int(len(values))}
+
+def central_similarity(in_file, ref_file, transform, size=80.0, stride=2):
+    """registration_similarity within a `size` mm cube in the middle of the reference image.
+
+    Only that part of either image is read, so two T1s can be compared in well under a second.
+    """
+    ref = nib.load(ref_file)
+    crop = np.diag([size, size, size, 1.0])
+    crop[:3, 3] = voxel_centre(ref.affine, ref.shape[:3])
+    return registration_similarity(in_file, ref_file, transform, crop, margin=0.0, stride=stride)
+
+def is_suspect(similarity, threshold=SUSPECT_NCC):
+    # too few brain voxels to judge (nan) is suspect too
+    return not similarity["ncc"] >= threshold
+
+def format_similarity(similarity):
+    return f"NCC {similarity['ncc']:.3f}, MI {similarity['mi']:.3f} ({similarity['points']} points)"
+
+def voxel_dice(affine_a, affine_b, shape_a=(1, 1, 1), shape_b=(1, 1, 1), spacing=0.25):
+    """Dice coefficient of two spectroscopy voxels (or grids) given by their affines in the same world space.
+
+    Each voxel is filled with points every `spacing` mm and the points inside the other voxel are
+    counted, so no mask images are needed. The two estimates of the overlap volume are averaged.
+    """
+    def inside(points, affine, shape):
+        vox = nib.affines.apply_affine(np.linalg.inv(affine), points)
+        return np.all((vox >= -0.5) & (vox < np.asarray(shape[:3]) - 0.5), axis=1)
+
+    volume_a = abs(np.linalg.det(affine_a[:3, :3])) * np.prod(shape_a[:3])
+    volume_b = abs(np.linalg.det(affine_b[:3, :3])) * np.prod(shape_b[:3])
+    overlap_a = inside(voxel_sample_points(affine_a, shape_a, spacing), affine_b, shape_b).mean() * volume_a
+    overlap_b = inside(voxel_sample_points(affine_b, shape_b, spacing), affine_a, shape_a).mean() * volume_b
+    return float((overlap_a + overlap_b) / (volume_a + volume_b))
@@ -0,0 +1,225 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import shutil
+import numpy as np
+import nibabel as nib
+from voxalign.scheduler import run_tool
+from voxalign.quality import format_similarity, is_suspect, registration_similarity
+from voxalign.utils import flirt_matrix_to_world, rotation_matrix, sample_volume, world_to_flirt_matrix
+
+# Every backend works in world (scanner mm) coordinates, so the rest of voxalign never has to know
+# about a tool's own conventions (e.g. flirt's scaled voxel coordinates).
+
+class RegistrationBackend:
+    """Interface for registration engines.
+
+    `rigid` returns the 4x4 world transform taking points in the `in_file` T1 to the matching points
+    in the `ref_file` T1 (`omat` and `out` are where a backend may keep its own matrix and the
+    resampled image). Given an `initial` world transform, it only refines that locally instead of
+    searching from scratch. `nonlinear` registers a head (and its skull stripped brain) to a template
+    and returns the path of the warp field; it may hand the work to an executor (see executors.py),
+    in which case its file names are relative to `cwd`. Backends that can't do something raise NotImplementedError.
+    """
+    name = None
+
+    def available(self):
+        return True
+
+    def rigid(self, in_file, ref_file, omat=None, out=None, initial=None):
+        raise NotImplementedError(f"{self.name} backend has no rigid registration")
+
+    def nonlinear(self, in_head, in_brain, template, template_brain, prefix, subsamp=None, cwd=None, executor=None):
+        raise NotImplementedError(f"{self.name} backend has no nonlinear registration")
+
+    def refine_nonlinear(self, in_head, in_to_previous, previous_warp, template, prefix, cwd=None, executor=None):
+        raise NotImplementedError(f"{self.name} backend can't warm start a nonlinear registration")
+
+
+class FSLBackend(RegistrationBackend):
+    """flirt (rigid, affine) and fnirt (nonlinear), run as external tools."""
+    name = "fsl"
+
+    def available(self):
+        return shutil.which("flirt") is not None and shutil.which("fnirt") is not None
+
+    def rigid(self, in_file, ref_file, omat=None, out=None, initial=None):
+        omat = omat or f"{str(in_file).removesuffix('.gz').removesuffix('.nii')}_rigid.mat"
+        command = f"flirt -in {in_file} -ref {ref_file} -omat {omat} -dof 6"
+        if initial is not None:
+            # start from the given alignment and skip flirt's coarse angular search
+            init_mat = f"{omat.removesuffix('.mat')}_init.mat"
+            np.savetxt(init_mat, world_to_flirt_matrix(initial, nib.load(in_file), nib.load(ref_file)))
+            command += f" -init {init_mat} -nosearch"
+        if out:
+            command += f" -out {out}"
+        result = run_tool(command, check=True)
+        return flirt_matrix_to_world(np.loadtxt(omat), nib.load(in_file), nib.load(ref_file))
+
+    def nonlinear(self, in_head, in_brain, template, template_brain, prefix, subsamp=None, cwd=None, executor=None):
+        # linear registration of the brain first, then fnirt of the whole head starting from it.
+        # the warped head image (--iout) is left out, it can be made later with applywarp
+        linear = f"flirt -in {in_brain} -ref {template_brain} -dof 12 -out {prefix}lin -omat {prefix}lin.mat"
+        command = f"fnirt --in={in_head} --ref={template} --aff={prefix}lin.mat --config=T1_2_MNI152_2mm.cnf --cout={prefix}_coef --fout={prefix}_warp"
+        if subsamp:
+            command += f" --subsamp={subsamp}"
+        if executor is None or executor.name == "local":
+            result = run_tool(linear, check=True, cwd=cwd)
+            result = run_tool(command, check=True, cwd=cwd)
+        else:
+            # both steps go to the executor as one job, since the flirt is quick and fnirt needs its output
+            result = executor.run(f"{linear} && {command}", inputs=[in_head, in_brain],
+                                  outputs=[f"{prefix}lin.mat", f"{prefix}lin.nii.gz", f"{prefix}_coef.nii.gz", f"{prefix}_warp.nii.gz"],
+                                  cwd=cwd, stage="fnirt")
+        return f"{prefix}_warp.nii.gz"
+
+    def refine_nonlinear(self, in_head, in_to_previous, previous_warp, template, prefix, cwd=None, executor=None):
+        """fnirt of a head that was registered before, starting from that warp and running only the fine levels.
+
+        `in_to_previous` is the flirt matrix from `in_head` to the head `previous_warp` belongs to.
+        """
+        initial = f"convertwarp --ref={template} --premat={in_to_previous} --warp1={previous_warp} --out={prefix}_init_warp"
+        # the last two levels of T1_2_MNI152_2mm.cnf (every array option needs the same number of levels)
+        fine_levels = "--subsamp=1,1 --miter=5,10 --infwhm=2,1 --reffwhm=0,0 --lambda=40,30 --estint=1,0 --applyrefmask=1,1"
+        command = (f"fnirt --in={in_head} --ref={template} --inwarp={prefix}_init_warp --config=T1_2_MNI152_2mm.cnf {fine_levels}"
+                   f" --cout={prefix}_coef --fout={prefix}_warp")
+        if executor is None or executor.name == "local":
+            result = run_tool(initial, check=True, cwd=cwd)
+            result = run_tool(command, check=True, cwd=cwd)
+        else:
+            result = executor.run(f"{initial} && {command}", inputs=[in_head, in_to_previous, previous_warp],
+                                  outputs=[f"{prefix}_init_warp.nii.gz", f"{prefix}_coef.nii.gz", f"{prefix}_warp.nii.gz"],
+                                  cwd=cwd, stage="fnirt")
+        return f"{prefix}_warp.nii.gz"
+
+
+class NumpyBackend(RegistrationBackend):
+    """In-process rigid registration: normalised cross correlation maximised by coordinate descent.
+
+    Foreground voxels of the reference are sampled on a coarse then a finer grid and compared with
+    the trilinearly interpolated moving image, starting from the alignment of the centres of mass.
+    No external tools are needed, but there is no nonlinear registration.
+    """
+    name = "numpy"
+
+    def __init__(self, strides=(4, 2), min_step=0.1):
+        self.strides = strides
+        self.min_step = min_step
+
+    def rigid(self, in_file, ref_file, omat=None, out=None, initial=None):
+        in_nii, ref_nii = nib.load(in_file), nib.load(ref_file)
+        moving = np.asanyarray(in_nii.dataobj, dtype=np.float32)
+        fixed = np.asanyarray(ref_nii.dataobj, dtype=np.float32)
+        to_moving_vox = np.linalg.inv(in_nii.affine)
+
+        def centre_of_mass(data, affine):
+            vox = np.argwhere(data > 0)
+            return nib.affines.apply_affine(affine, np.average(vox, axis=0, weights=data[data > 0]))
+
+        ref_com = centre_of_mass(fixed, ref_nii.affine)
+        # parameters are rotations (deg) about the reference centre of mass and translations (mm),
+        # applied after the initial transform (if any, otherwise after aligning the centres of mass)
+        params = np.zeros(6)
+        if initial is None:
+            initial = np.eye(4)
+            params[3:] = ref_com - centre_of_mass(moving, in_nii.affine)
+
+        def params_to_transform(p):
+            transform = np.eye(4)
+            transform[:3, :3] = rotation_matrix(p[:3])
+            transform[:3, 3] = ref_com - transform[:3, :3] @ ref_com + p[3:]
+            return transform @ initial
+
+        for stride in self.strides:
+            grid = fixed[::stride, ::stride, ::stride]
+            vox = np.argwhere(grid > grid[grid > 0].mean() * 0.5) * stride
+            points = nib.affines.apply_affine(ref_nii.affine, vox)
+            values = fixed[vox[:, 0], vox[:, 1], vox[:, 2]]
+            values = (values - values.mean()) / values.std()
+
+            def similarity(p):
+                # ref -> in world, then into the moving image's voxels
+                mapped = nib.affines.apply_affine(to_moving_vox @ np.linalg.inv(params_to_transform(p)), points)
+                sampled = sample_volume(moving, mapped)
+                return np.mean(values * (sampled - sampled.mean())) / (sampled.std() + 1e-9)
+
+            best = similarity(params)
+            step = 2.0 * stride
+            while step >= self.min_step:
+                improved = False
+                for i in range(6):
+                    for direction in (1, -1):
+                        trial = params.copy()
+                        trial[i] += direction * step
+                        score = similarity(trial)
+                        if score > best:
+                            best, params, improved = score, trial, True
+                            break
+                if not improved:
+                    step /= 2
+
+        return params_to_transform(params)
+
+
+def centre_of_mass_transform(in_file, ref_file, stride=4):
+    """World translation taking the intensity centre of mass of one T1 onto the other's (from every `stride`th voxel)."""
+    centres = []
+    for file in (in_file, ref_file):
+        nii = nib.load(file)
+        data = np.asanyarray(nii.dataobj[::stride, ::stride, ::stride], dtype=np.float32)
+        data[data < data[data > 0].mean() * 0.5] = 0 # background noise would drag the centre towards the middle of the image
+        vox = np.argwhere(data > 0)
+        centres.append(nib.affines.apply_affine(nii.affine, np.average(vox, axis=0, weights=data[data > 0]) * stride))
+    transform = np.eye(4)
+    transform[:3, 3] = centres[1] - centres[0]
+    return transform
+
+# how the restricted search of initialised_rigid starts
+RIGID_INITS = ["header", "com", "search"]
+
+def initialised_rigid(backend, in_file, ref_file, omat=None, out=None, init="header", initial=None, log=print):
+    """Rigid registration that starts from the scanner coordinates instead of searching from scratch.
+
+    The headers of two T1s of one participant usually put the heads within a few mm and degrees of
+    each other, so `init="header"` starts from the identity world transform (or from `initial`, e.g.
+    a provisional registration) and `init="com"` also aligns the centres of mass. If the result fails
+    the similarity check, the full search runs after all; `init="search"` always runs it.
+    """
+    if init != "search":
+        if initial is None:
+            initial = centre_of_mass_transform(in_file, ref_file) if init == "com" else np.eye(4)
+        transform = backend.rigid(in_file, ref_file, omat=omat, out=out, initial=initial)
+        similarity = registration_similarity(in_file, ref_file, transform, stride=3)
+        if not is_suspect(similarity):
+            return transform
+        log(f"Registration from the {init} initialisation looks wrong ({format_similarity(similarity)}), running the full search")
+    return backend.rigid(in_file, ref_file, omat=omat, out=out)
+
+
+BACKENDS = {
+    "fsl": FSLBackend,
+    "numpy": NumpyBackend,
+}
+
+def get_backend(name="fsl"):
+    if name not in BACKENDS:
+        raise Exception(f"Unknown registration backend '{name}' (choose from {', '.join(BACKENDS)})")
+    return BACKENDS[name]()
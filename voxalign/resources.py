@@ -0,0 +1,69 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import os
+import numpy as np
+import nibabel as nib
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+from pathlib import Path
+
+# per-user voxalign files: the server socket and key, the timing history, the local batch queue
+VOXALIGN_HOME = Path(os.environ.get('VOXALIGN_HOME', Path.home() / '.voxalign'))
+
+# atlases that are kept in memory by the voxalign server. The MNI templates are not, since only the
+# FSL tools read them, and they load them from $FSLDIR themselves
+ATLASES = {
+    "Harvard-Oxford Cortical Structural Atlas": ("HarvardOxford/HarvardOxford-cort-prob-2mm.nii.gz", "HarvardOxford-Cortical.xml"),
+    "Harvard-Oxford Subcortical Structural Atlas": ("HarvardOxford/HarvardOxford-sub-prob-2mm.nii.gz", "HarvardOxford-Subcortical.xml"),
+}
+
+def fsl_data_dir():
+    return Path(os.environ.get('FSLDIR', '')) / 'data'
+
+@lru_cache(maxsize=None)
+def load_atlas(atlas_name):
+    """Load a probabilistic FSL atlas and its labels once, keeping them in memory."""
+    image_file, label_file = ATLASES[atlas_name]
+    nii = nib.load(fsl_data_dir() / 'atlases' / image_file)
+    labels = [label.text for label in ET.parse(fsl_data_dir() / 'atlases' / label_file).getroot().iter('label')]
+    return nii, np.asanyarray(nii.dataobj), labels
+
+def atlas_query(atlas_name, coord):
+    """In-memory equivalent of `atlasquery -a <atlas_name> -c x,y,z` for an MNI coordinate in mm."""
+    nii, data, labels = load_atlas(atlas_name)
+    vox = np.rint(np.linalg.inv(nii.affine) @ np.append(np.asarray(coord, dtype=float), 1))[:3].astype(int)
+    if np.any(vox < 0) or np.any(vox >= data.shape[:3]):
+        return "No label found!"
+    probs = data[vox[0], vox[1], vox[2], :]
+    hits = [(int(probs[i]), labels[i]) for i in np.argsort(probs)[::-1] if probs[i] > 0]
+    if not hits:
+        return "No label found!"
+    return ', '.join(f"{prob}% {label}" for prob, label in hits)
+
+def preload_resources(log=print):
+    """Read the atlases from disk so later requests are served from memory."""
+    for atlas_name in ATLASES:
+        try:
+            load_atlas(atlas_name)
+            log(f"Loaded {atlas_name}")
+        except Exception as e:
+            log(f"Could not load {atlas_name}: {e}")
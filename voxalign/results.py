@@ -0,0 +1,123 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import os
+import json
+import time
+import sqlite3
+from pathlib import Path
+
+RESULTS_DB_NAME = "voxalign_results.sqlite"
+
+COLUMNS = {
+    "tool": "TEXT NOT NULL",
+    "recorded_at": "REAL NOT NULL",
+    "study": "TEXT",
+    "participant": "TEXT",
+    "session": "TEXT",
+    "roi": "TEXT",
+    "position": "TEXT",
+    "pos_x": "REAL",
+    "pos_y": "REAL",
+    "pos_z": "REAL",
+    "orientation": "TEXT",
+    "rotation": "REAL",
+    "dim_x": "REAL",
+    "dim_y": "REAL",
+    "dim_z": "REAL",
+    "transform": "TEXT",
+    "mni_x": "REAL",
+    "mni_y": "REAL",
+    "mni_z": "REAL",
+    "dice": "REAL",
+    "duration_s": "REAL",
+    "output_folder": "TEXT",
+    "extra": "TEXT",
+}
+INDEXES = {
+    "idx_participant": "participant, session",
+    "idx_study": "study, participant",
+    "idx_roi": "roi",
+    "idx_tool": "tool, recorded_at",
+}
+
+def results_db_path(output_folder):
+    """The results store shared by every output folder of a study.
+
+    Set VOXALIGN_RESULTS_DB to choose the file, otherwise it sits next to the output folder,
+    i.e. in the folder that holds all of a study's voxalign output folders.
+    """
+    if os.environ.get('VOXALIGN_RESULTS_DB'):
+        return Path(os.environ['VOXALIGN_RESULTS_DB'])
+    return Path(output_folder).resolve().parent / RESULTS_DB_NAME
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    columns = ', '.join(f"{name} {kind}" for name, kind in COLUMNS.items())
+    conn.execute(f"CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY, {columns})")
+    for name, columns in INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON results ({columns})")
+    return conn
+
+def record_result(output_folder, tool, **fields):
+    """Append one structured record to the study's results store.
+
+    Fields that don't have their own column are kept as JSON in `extra`. Problems with the store
+    are reported but never stop a run, since the text outputs are still written.
+    """
+    record = {"tool": tool, "recorded_at": time.time(), "output_folder": str(output_folder)}
+    extra = {}
+    for key, value in fields.items():
+        if key == "transform" and value is not None:
+            record[key] = json.dumps([[float(v) for v in row] for row in value])
+        elif key in COLUMNS:
+            record[key] = value
+        else:
+            extra[key] = value
+    if extra:
+        record["extra"] = json.dumps(extra, default=str)
+
+    try:
+        with connect(results_db_path(output_folder)) as conn:
+            conn.execute(f"INSERT INTO results ({', '.join(record)}) VALUES ({', '.join('?' * len(record))})", list(record.values()))
+    except sqlite3.Error as e:
+        print(f"Couldn't record results in {results_db_path(output_folder)}: {e}")
+
+def query_results(db_path, **filters):
+    """Return the records matching all of `filters` (column=value) as a list of dicts, oldest first."""
+    where = ' AND '.join(f"{column} = ?" for column in filters if column in COLUMNS)
+    sql = "SELECT * FROM results" + (f" WHERE {where}" if where else "") + " ORDER BY recorded_at"
+    with connect(db_path) as conn:
+        conn.row_factory = sqlite3.Row
+        return [dict(row) for row in conn.execute(sql, [filters[c] for c in filters if c in COLUMNS])]
+
+def export_parquet(db_path, parquet_path, **filters):
+    """Write the matching records to a Parquet file for dashboards (needs pyarrow)."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Exporting to Parquet needs pyarrow: pip install pyarrow")
+    records = query_results(db_path, **filters)
+    table = pa.Table.from_pylist(records) if records else pa.table({"id": pa.array([], pa.int64())})
+    pq.write_table(table, parquet_path)
+    return len(records)
@@ -0,0 +1,171 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from voxalign.perf import record_stage
+
+# approximate (cores, memory in GB) used by each external tool on a 1 mm T1
+STAGE_COSTS = {
+    "dcm2niix": (1, 0.5),
+    "spec2nii": (1, 0.3),
+    "robustfov": (1, 0.5),
+    "bet2": (1, 0.5),
+    "flirt": (1, 0.5),
+    "fnirt": (1, 3.0), # peaks at the full resolution (subsamp 1) levels
+    "fast": (1, 1.5),
+    "applywarp": (1, 1.0),
+    "invwarp": (1, 1.5),
+    "convertwarp": (1, 1.0),
+    "convert_xfm": (1, 0.1),
+    "std2imgcoord": (1, 0.5),
+    "img2imgcoord": (1, 0.2),
+}
+DEFAULT_COST = (1, 0.5)
+
+# environment variables that cap the threads used by OpenMP, BLAS and ITK based tools
+THREAD_ENV_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS",
+                   "NUMEXPR_NUM_THREADS", "ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS", "FSL_NUM_THREADS"]
+
+def total_memory_gb():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024**3
+    except (ValueError, OSError, AttributeError):
+        return 8.0
+
+class ResourceScheduler:
+    """Admits external tool runs only while their estimated cores and memory fit within a budget.
+
+    The budget defaults to all cores and 80% of physical memory, and can be set with the
+    VOXALIGN_MAX_CPUS and VOXALIGN_MAX_MEMORY_GB environment variables. A stage that is larger than
+    the whole budget still runs, but only once nothing else is running.
+    """
+
+    def __init__(self, max_cpus=None, max_memory_gb=None):
+        self.max_cpus = max_cpus or int(os.environ.get('VOXALIGN_MAX_CPUS', os.cpu_count() or 1))
+        self.max_memory_gb = max_memory_gb or float(os.environ.get('VOXALIGN_MAX_MEMORY_GB', 0.8 * total_memory_gb()))
+        self.used_cpus = 0
+        self.used_memory_gb = 0.0
+        self.condition = threading.Condition()
+        self.release_callbacks = []
+
+    def fits(self, cpus, memory_gb):
+        if self.used_cpus == 0 and self.used_memory_gb == 0:
+            return True
+        return self.used_cpus + cpus <= self.max_cpus and self.used_memory_gb + memory_gb <= self.max_memory_gb
+
+    def stage_cost(self, stage, cost=None):
+        cpus, memory_gb = cost or STAGE_COSTS.get(stage, DEFAULT_COST)
+        return min(cpus, self.max_cpus), memory_gb
+
+    def try_acquire(self, stage, cost=None):
+        """Take `stage`'s share of the budget if it fits now. Returns the (cpus, memory) taken, or None."""
+        cpus, memory_gb = self.stage_cost(stage, cost)
+        with self.condition:
+            if not self.fits(cpus, memory_gb):
+                return None
+            self.used_cpus += cpus
+            self.used_memory_gb += memory_gb
+        return cpus, memory_gb
+
+    def release(self, cpus, memory_gb):
+        with self.condition:
+            self.used_cpus -= cpus
+            self.used_memory_gb -= memory_gb
+            self.condition.notify_all()
+            callbacks, self.release_callbacks = self.release_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def notify_on_release(self, callback):
+        """Call `callback()` once, from the releasing thread, the next time part of the budget is released."""
+        with self.condition:
+            self.release_callbacks.append(callback)
+
+    @contextmanager
+    def reserve(self, stage, cost=None):
+        """Block until `stage` fits in the budget and hold its share of the budget while it runs."""
+        cpus, memory_gb = self.stage_cost(stage, cost)
+        with self.condition:
+            self.condition.wait_for(lambda: self.fits(cpus, memory_gb))
+            self.used_cpus += cpus
+            self.used_memory_gb += memory_gb
+        try:
+            yield cpus
+        finally:
+            self.release(cpus, memory_gb)
+
+    def run(self, command, stage=None, cost=None, **kwargs):
+        """subprocess.run for an external tool, once the scheduler has admitted it.
+
+        The tool's thread count is capped at the number of cores reserved for it.
+        """
+        stage = stage or command_stage(command)
+        requested = time.perf_counter()
+        with self.reserve(stage, cost) as cpus:
+            env = tool_env(cpus, kwargs.pop('env', None))
+            started = time.perf_counter()
+            returncode = -1
+            try:
+                result = subprocess.run(command, env=env, **kwargs)
+                returncode = result.returncode
+                return result
+            except subprocess.CalledProcessError as e:
+                returncode = e.returncode
+                raise
+            finally:
+                # every tool run goes into the timing history, with how long it waited for the scheduler
+                record_stage(stage, time.perf_counter() - started, started - requested, returncode)
+
+def tool_env(cpus, env=None):
+    """Environment for a tool run, with its thread count capped at `cpus`."""
+    env = dict(env or os.environ)
+    for var in THREAD_ENV_VARS:
+        env[var] = str(cpus)
+    return env
+
+def command_stage(command):
+    """The name of the tool a command runs, e.g. 'flirt' for 'flirt -in ...' or 'echo 1 2 3 | std2imgcoord ...'."""
+    if isinstance(command, str):
+        command = command.split('|')[-1].split()
+    return os.path.basename(command[0]) if command else ""
+
+# shared by every pipeline running in this process (e.g. all jobs in a voxalign server)
+scheduler = ResourceScheduler()
+
+# set by a job that runs its tools some other way (e.g. aio runs them on an asyncio event loop);
+# called as tool_runner(command, stage, cost, check, cwd) and returns a CompletedProcess like run_tool
+tool_runner = ContextVar("voxalign_tool_runner", default=None)
+
+def run_tool(command, stage=None, cost=None, check=False, cwd=None):
+    """Run an external tool through the shared scheduler, capturing its output as text.
+
+    Relative paths in the command are taken relative to `cwd`; voxalign never changes the working
+    directory of the process, so that several jobs can run in it at once.
+    """
+    runner = tool_runner.get()
+    if runner is not None:
+        return runner(command, stage, cost, check, cwd)
+    return scheduler.run(command, stage=stage, cost=cost, shell=isinstance(command, str), capture_output=True, text=True, check=check, cwd=cwd)
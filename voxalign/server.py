@@ -0,0 +1,166 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import os
+import sys
+import secrets
+import threading
+import traceback
+from multiprocessing.connection import Listener, Client
+from voxalign.resources import VOXALIGN_HOME
+
+# the server socket and its authentication key live in the user's home directory
+SOCKET_PATH = VOXALIGN_HOME / 'voxalign.sock'
+AUTHKEY_PATH = VOXALIGN_HOME / 'authkey'
+LOCALHOST_ADDRESS = ('127.0.0.1', 47653) # used on platforms without unix sockets
+
+def server_address():
+    if hasattr(os, 'fork'):
+        return str(SOCKET_PATH)
+    return LOCALHOST_ADDRESS
+
+def get_authkey():
+    """Read the shared key clients use to authenticate with the server, creating it if needed."""
+    VOXALIGN_HOME.mkdir(parents=True, exist_ok=True)
+    if not AUTHKEY_PATH.exists():
+        fd = os.open(AUTHKEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as file:
+            file.write(secrets.token_hex(32))
+    return AUTHKEY_PATH.read_text().strip().encode()
+
+def get_jobs():
+    """Map job names accepted by the server to the functions that run them."""
+    from voxalign import pipelines, resources
+    return {
+        "align": pipelines.run_alignment,
+        "mni-lookup": pipelines.run_mni_lookup,
+        "dice": pipelines.run_dice,
+        "place": pipelines.run_placement,
+        "atlas-query": resources.atlas_query,
+    }
+
+# quick lookups that are answered directly, without progress messages
+QUERY_JOBS = {"atlas-query"}
+
+# pipelines run side by side, except that two jobs writing to the same output folder wait for each other
+folder_locks = {}
+folder_locks_lock = threading.Lock()
+
+def folder_lock(kwargs):
+    folder = kwargs.get("output_folder") or kwargs.get("outdir")
+    if folder is None:
+        return threading.Lock()
+    with folder_locks_lock:
+        return folder_locks.setdefault(os.path.realpath(folder), threading.Lock())
+
+def handle_connection(conn, jobs):
+    with conn:
+        try:
+            job, kwargs = conn.recv()
+        except EOFError:
+            return
+        if job == "ping":
+            conn.send(("result", "pong"))
+            return
+
+        def log(*args):
+            conn.send(("log", ' '.join(str(a) for a in args)))
+
+        try:
+            if job not in jobs:
+                raise ValueError(f"Unknown voxalign job: {job}")
+            if job in QUERY_JOBS:
+                result = jobs[job](**kwargs)
+            else:
+                with folder_lock(kwargs):
+                    result = jobs[job](log=log, **kwargs)
+            conn.send(("result", result))
+        except Exception as e:
+            print(traceback.format_exc())
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+def serve():
+    """Run the voxalign server: keep libraries and atlases loaded and run jobs on request."""
+    from voxalign.resources import preload_resources
+    jobs = get_jobs()
+    preload_resources()
+
+    address = server_address()
+    if isinstance(address, str) and os.path.exists(address):
+        if ping():
+            print(f"A voxalign server is already running at {address}")
+            sys.exit(1)
+        os.remove(address) # left behind by a server that did not shut down cleanly
+
+    with Listener(address, authkey=get_authkey()) as listener:
+        if isinstance(address, str):
+            os.chmod(address, 0o600)
+        print(f"voxalign server listening on {address}")
+        while True:
+            try:
+                conn = listener.accept()
+            except KeyboardInterrupt:
+                print("\nShutting down voxalign server")
+                break
+            except Exception as e:
+                print(f"Rejected connection: {e}")
+                continue
+            threading.Thread(target=handle_connection, args=(conn, jobs), daemon=True).start()
+
+def submit(job, log=print, **kwargs):
+    """Run a job on the voxalign server, passing its progress messages to `log`.
+
+    Raises ConnectionError if no server is running.
+    """
+    address = server_address()
+    if isinstance(address, str) and not os.path.exists(address):
+        raise ConnectionError("voxalign server is not running")
+    try:
+        conn = Client(address, authkey=get_authkey())
+    except OSError as e:
+        raise ConnectionError(f"Could not connect to voxalign server: {e}")
+    with conn:
+        conn.send((job, kwargs))
+        while True:
+            kind, payload = conn.recv()
+            if kind == "log":
+                log(payload)
+            elif kind == "error":
+                raise RuntimeError(payload)
+            else:
+                return payload
+
+def ping():
+    try:
+        return submit("ping") == "pong"
+    except Exception:
+        return False
+
+def submit_or_run(job, log=print, **kwargs):
+    """Run a job on the voxalign server if one is running, otherwise run it in this process."""
+    try:
+        return submit(job, log=log, **kwargs)
+    except ConnectionError:
+        pass
+    func = get_jobs()[job]
+    if job in QUERY_JOBS:
+        return func(**kwargs)
+    return func(log=log, **kwargs)
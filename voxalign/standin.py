@@ -0,0 +1,243 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import os
+import sys
+import time
+import numpy as np
+import nibabel as nib
+from pathlib import Path
+from voxalign.utils import flirt_matrix_to_world, sample_volume, world_to_flirt_matrix
+
+# Stand-ins for the external tools, for measuring the pipelines' own overhead (see benchmark.py)
+# on machines without FSL, dcm2niix and spec2nii. Each one takes the arguments voxalign passes the
+# real tool and writes outputs of the right names, shapes and geometry, but with trivial contents:
+# registrations keep the scanner coordinates (or the -init matrix) and warps are zero. It then
+# sleeps for its latency from VOXALIGN_STANDIN_LATENCY, e.g. "fnirt=2,flirt=0.3,default=0.1" (s).
+#   python -m voxalign.standin <tool> <arguments ...>
+# install_standins() puts one executable per tool in a folder, to put in front of PATH.
+
+# FSL options that take no value
+FLAGS = {"-nosearch", "-applyxfm", "-noresampblur", "-usesqform", "-mm", "-inverse", "-v"}
+
+def latency(tool):
+    latencies = dict(item.split('=') for item in os.environ.get('VOXALIGN_STANDIN_LATENCY', '').split(',') if '=' in item)
+    return float(latencies.get(tool, latencies.get('default', 0)))
+
+def parse_options(args):
+    """FSL style `-name value`, `--name=value` and flag arguments as a dict, and the remaining positional arguments."""
+    options, positional = {}, []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg.startswith('--') and '=' in arg:
+            name, value = arg[2:].split('=', 1)
+            options[name] = value
+        elif arg.startswith('-') and len(arg) > 1 and arg not in FLAGS and i + 1 < len(args):
+            options[arg.lstrip('-')] = args[i + 1]
+            i += 1
+        elif arg.startswith('-') and len(arg) > 1:
+            options[arg.lstrip('-')] = True
+        else:
+            positional.append(arg)
+        i += 1
+    return options, positional
+
+def image_path(name):
+    """An FSL image name, which may leave out the extension."""
+    for path in (name, f"{name}.nii.gz", f"{name}.nii"):
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"Image {name} not found")
+
+def output_path(name):
+    # FSL tools write .nii.gz (FSLOUTPUTTYPE=NIFTI_GZ) whatever extension they are given
+    return f"{str(name).removesuffix('.gz').removesuffix('.nii')}.nii.gz"
+
+def save(data, affine, name):
+    nib.save(nib.Nifti1Image(np.asarray(data, dtype=np.float32), affine), output_path(name))
+
+def resample(in_nii, world_transform, affine, shape):
+    """`in_nii` moved by a world transform and sampled on a grid, trilinearly."""
+    grid = np.indices(shape).reshape(3, -1).T
+    vox = nib.affines.apply_affine(np.linalg.inv(in_nii.affine) @ np.linalg.inv(world_transform) @ affine, grid)
+    return sample_volume(np.asanyarray(in_nii.dataobj, dtype=np.float32), vox).reshape(shape)
+
+def zero_warp(ref, out):
+    ref_nii = nib.load(image_path(ref))
+    save(np.zeros(ref_nii.shape[:3] + (3,)), ref_nii.affine, out)
+
+def dicom_affine(ds):
+    """RAS voxel to world affine of a DICOM from its LPS position, orientation and spacing, with (column, row, frame) voxel axes."""
+    orientation = np.array(ds.ImageOrientationPatient, dtype=float)
+    row_spacing, column_spacing = (float(v) for v in ds.PixelSpacing)
+    normal = np.cross(orientation[:3], orientation[3:])
+    lps = np.eye(4)
+    lps[:3, 0] = orientation[:3] * column_spacing
+    lps[:3, 1] = orientation[3:] * row_spacing
+    lps[:3, 2] = normal * float(ds.SliceThickness)
+    lps[:3, 3] = np.array(ds.ImagePositionPatient, dtype=float)
+    return np.diag([-1, -1, 1, 1]) @ lps
+
+def dcm2niix(args):
+    options, positional = parse_options(args)
+    import pydicom
+    ds = pydicom.dcmread(positional[-1])
+    pixels = ds.pixel_array.reshape(int(ds.get("NumberOfFrames", 1)), ds.Rows, ds.Columns)
+    nib.save(nib.Nifti1Image(pixels.transpose(2, 1, 0).astype(np.float32), dicom_affine(ds)), f"{options['o']}/{options['f']}.nii")
+
+def spec2nii(args):
+    options, positional = parse_options(args)
+    import pydicom
+    ds = pydicom.dcmread(positional[-1], stop_before_pixels=True)
+    # single voxel NIfTI-MRS: 1x1x1 spatial dimensions and the FID along the 4th
+    affine = dicom_affine(ds)
+    fid = np.zeros((1, 1, 1, int(ds.get("DataPointColumns", 1024))), dtype=np.complex64)
+    nib.save(nib.Nifti2Image(fid, affine), f"{options['o']}/{Path(positional[-1]).stem}.nii.gz")
+
+def bet2(args):
+    _, (in_file, out_file) = parse_options(args)
+    in_nii = nib.load(image_path(in_file))
+    data = np.asanyarray(in_nii.dataobj, dtype=np.float32)
+    save(np.where(data > 0.1 * data.max(), data, 0), in_nii.affine, out_file)
+
+def robustfov(args):
+    options, _ = parse_options(args)
+    in_nii = nib.load(image_path(options['i']))
+    save(np.asanyarray(in_nii.dataobj), in_nii.affine, options['r'])
+
+def flirt(args):
+    options, _ = parse_options(args)
+    in_nii, ref_nii = nib.load(image_path(options['in'])), nib.load(image_path(options['ref']))
+    # a registration keeps the scanner coordinates (or where -init puts the image)
+    matrix = np.loadtxt(options['init']) if 'init' in options else world_to_flirt_matrix(np.eye(4), in_nii, ref_nii)
+    if 'omat' in options:
+        np.savetxt(options['omat'], matrix)
+    if 'out' in options:
+        affine, shape = ref_nii.affine, ref_nii.shape[:3]
+        if 'applyisoxfm' in options:
+            zooms = np.array(ref_nii.header.get_zooms()[:3])
+            scale = float(options['applyisoxfm']) / zooms
+            affine = ref_nii.affine @ np.diag(list(scale) + [1])
+            shape = tuple(int(n) for n in np.ceil(np.array(shape) / scale))
+        save(resample(in_nii, flirt_matrix_to_world(matrix, in_nii, ref_nii), affine, shape), affine, options['out'])
+
+def fnirt(args):
+    options, _ = parse_options(args)
+    zero_warp(options['ref'], options['fout'])
+    if 'cout' in options:
+        zero_warp(options['ref'], options['cout'])
+
+def applywarp(args):
+    options, _ = parse_options(args)
+    in_nii, ref_nii = nib.load(image_path(options['i'])), nib.load(image_path(options['r']))
+    save(resample(in_nii, np.eye(4), ref_nii.affine, ref_nii.shape[:3]), ref_nii.affine, options['o'])
+
+def invwarp(args):
+    options, _ = parse_options(args)
+    zero_warp(options['r'], options['o'])
+
+def convertwarp(args):
+    options, _ = parse_options(args)
+    zero_warp(options['ref'], options['out'])
+
+def convert_xfm(args):
+    options, positional = parse_options(args)
+    if 'concat' in options:
+        matrix = np.loadtxt(options['concat']) @ np.loadtxt(positional[-1])
+    else:
+        matrix = np.linalg.inv(np.loadtxt(positional[-1]))
+    np.savetxt(options['omat'], matrix)
+
+def fast(args):
+    options, positional = parse_options(args)
+    in_nii = nib.load(image_path(positional[-1]))
+    data = np.asanyarray(in_nii.dataobj, dtype=np.float32)
+    brain = data > 0
+    # CSF, GM and WM partial volumes from where each voxel's intensity falls in the brain's range
+    position = np.clip(data / (np.percentile(data[brain], 99) if brain.any() else 1), 0, 1) * 2
+    pves = [np.clip(1 - np.abs(position - centre), 0, 1) * brain for centre in range(3)]
+    for i, pve in enumerate(pves):
+        save(pve, in_nii.affine, f"{options['o']}_pve_{i}")
+    save(np.argmax(pves, axis=0) + brain, in_nii.affine, f"{options['o']}_seg")
+
+def coordinates(args, header=None):
+    # the coordinates come on stdin (given as "-"); with zero warps and scanner alignment they are unchanged
+    if header:
+        print(header)
+    for line in sys.stdin:
+        if line.strip():
+            print("  ".join(f"{float(v):.4f}" for v in line.split()[:3]))
+
+STANDIN_TOOLS = {
+    "dcm2niix": dcm2niix,
+    "spec2nii": spec2nii,
+    "bet2": bet2,
+    "robustfov": robustfov,
+    "flirt": flirt,
+    "fnirt": fnirt,
+    "fast": fast,
+    "applywarp": applywarp,
+    "invwarp": invwarp,
+    "convertwarp": convertwarp,
+    "convert_xfm": convert_xfm,
+    "std2imgcoord": coordinates,
+    "img2imgcoord": lambda args: coordinates(args, "Coordinates in Destination volume (in mm)"),
+}
+
+def install_standins(folder, tools=STANDIN_TOOLS):
+    """Write an executable for each stand-in tool into `folder` (to go in front of PATH), returning the folder."""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    # voxalign may be run from a checkout rather than installed, so the tools are pointed at this copy
+    package_root = Path(__file__).resolve().parent.parent
+    for tool in tools:
+        script = folder / tool
+        script.write_text(f'#!/bin/sh\nPYTHONPATH="{package_root}${{PYTHONPATH:+:$PYTHONPATH}}" exec "{sys.executable}" -m voxalign.standin {tool} "$@"\n')
+        script.chmod(0o755)
+    return folder
+
+def install_fsldir(folder, template):
+    """A minimal FSLDIR with `template` (a NIfTI image) as the 2 mm MNI152 head and brain, returning the folder."""
+    folder = Path(folder)
+    standard = folder / 'data' / 'standard'
+    standard.mkdir(parents=True, exist_ok=True)
+    nib.save(template, standard / 'MNI152_T1_2mm.nii.gz')
+    nib.save(template, standard / 'MNI152_T1_2mm_brain.nii.gz')
+    (folder / 'etc').mkdir(exist_ok=True)
+    (folder / 'etc' / 'fslversion').write_text("stand-in:0\n")
+    return folder
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in STANDIN_TOOLS:
+        print(f"usage: python -m voxalign.standin <{'|'.join(STANDIN_TOOLS)}> <arguments ...>", file=sys.stderr)
+        return 2
+    tool, args = argv[0], argv[1:]
+    if args in (["--version"], ["-v"]):
+        print(f"{tool} stand-in")
+        return 0
+    STANDIN_TOOLS[tool](args)
+    time.sleep(latency(tool))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
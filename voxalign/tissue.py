@@ -0,0 +1,74 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import os
+import numpy as np
+import nibabel as nib
+from voxalign.scheduler import run_tool
+from voxalign.utils import sample_volume
+
+# FAST partial volume maps for a T1 are numbered in order of intensity
+TISSUE_CLASSES = ["CSF", "GM", "WM"]
+
+def segment_T1(T1_ss, reuse=True):
+    """Run FSL FAST on a skull stripped T1, reusing an existing segmentation if there is one and `reuse` is set.
+
+    Returns the partial volume estimate images in the order of TISSUE_CLASSES.
+    """
+    base = str(T1_ss).removesuffix('.gz').removesuffix('.nii')
+    pve_files = [f"{base}_pve_{i}.nii.gz" for i in range(len(TISSUE_CLASSES))]
+    if not reuse or not all(os.path.exists(f) for f in pve_files):
+        command = f"fast -t 1 -n 3 -o {base} {T1_ss}"
+        result = run_tool(command, check=True)
+    return pve_files
+
+def voxel_sample_points(spec_affine, spec_shape=(1, 1, 1), spacing=0.5):
+    """World coordinates of a regular grid of points filling a spectroscopy voxel (or grid) at `spacing` mm."""
+    dims = np.linalg.norm(spec_affine[:3, :3], axis=0) * np.asarray(spec_shape[:3])
+    n = np.maximum(np.ceil(dims / spacing).astype(int), 1)
+    # points sit in the middle of n equal sub-cells along each axis of the voxel, in voxel index units
+    axes = [(np.arange(n_i) + 0.5) / n_i * size - 0.5 for n_i, size in zip(n, spec_shape[:3])]
+    grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+    return nib.affines.apply_affine(spec_affine, grid)
+
+def tissue_fractions(spec_affine, pve_files, spec_shape=(1, 1, 1), spacing=0.5):
+    """Fraction of the voxel (or whole CSI grid) volume made up of each tissue class.
+
+    Only the bounding box of the voxel is read from each partial volume map, and it is sampled
+    at `spacing` mm. Whatever is left over (1 - sum of the fractions) lies outside the brain.
+    """
+    points = voxel_sample_points(spec_affine, spec_shape, spacing=spacing)
+    fractions = {}
+    for tissue, pve_file in zip(TISSUE_CLASSES, pve_files):
+        pve = nib.load(pve_file)
+        vox = nib.affines.apply_affine(np.linalg.inv(pve.affine), points)
+        lo = np.clip(np.floor(vox.min(axis=0)).astype(int), 0, np.array(pve.shape[:3]) - 1)
+        hi = np.clip(np.floor(vox.max(axis=0)).astype(int) + 2, 1, np.array(pve.shape[:3]))
+        if np.any(hi <= lo): # voxel lies entirely outside the T1
+            fractions[tissue] = 0.0
+            continue
+        box = np.asanyarray(pve.dataobj[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]], dtype=float)
+        fractions[tissue] = float(np.mean(sample_volume(box, vox - lo)))
+    return fractions
+
+def format_tissue_fractions(fractions):
+    other = max(0.0, 1 - sum(fractions.values()))
+    return ', '.join(f"{tissue} {fractions[tissue]:.3f}" for tissue in ["GM", "WM", "CSF"]) + f", non-brain {other:.3f}"
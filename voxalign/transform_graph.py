@@ -0,0 +1,137 @@
+# Copyright 2025, Brown University, Providence, RI.
+#
+# All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose other than its incorporation into a
+# commercial product or service is hereby granted without fee, provided
+# that the above copyright notice appear in all copies and that both
+# that copyright notice and this permission notice appear in supporting
+# documentation, and that the name of Brown University not be used in
+# advertising or publicity pertaining to distribution of the software
+# without specific, written prior permission.
+#
+# BROWN UNIVERSITY DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR ANY
+# PARTICULAR PURPOSE. IN NO EVENT SHALL BROWN UNIVERSITY BE LIABLE FOR ANY
+# SPECIAL, INDIRECT OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import os
+import json
+import threading
+import numpy as np
+import nibabel as nib
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+# graphs are shared by every job for a participant, so saves from jobs running in this process are serialised,
+# and saves from other processes (e.g. jobs for other output folders of the study) wait on a lock file
+save_lock = threading.Lock()
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on `path` (created if missing) across processes, where the platform has flock."""
+    with open(path, 'a') as fp:
+        if fcntl is not None:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+class TransformGraph:
+    """World-to-world transforms between a participant's T1 acquisitions.
+
+    Each node is a T1 series (its scanner coordinate frame) and each edge is a registration that
+    has already been run between two of them. The transform between any two connected series
+    is found by composing the cached edges, so a new visit only needs to be registered once.
+    """
+
+    def __init__(self, path, participant=None):
+        self.path = Path(path)
+        self.participant = participant
+        self.sessions = {}
+        self.edges = []
+        if self.path.exists():
+            with open(self.path) as fp:
+                data = json.load(fp)
+            self.participant = data.get("participant", participant)
+            self.sessions = data.get("sessions", {})
+            self.edges = data.get("edges", [])
+
+    @classmethod
+    def for_participant(cls, output_folder, participant):
+        """The graph for `participant`, kept with the study's other shared voxalign files.
+
+        Set VOXALIGN_GRAPH_DIR to choose the folder, otherwise it is transform_graphs/ next to the output folder.
+        """
+        graph_dir = os.environ.get('VOXALIGN_GRAPH_DIR') or Path(output_folder).resolve().parent / 'transform_graphs'
+        safe_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(participant))
+        return cls(Path(graph_dir) / f"{safe_name}.json", participant)
+
+    def add_session(self, session_id, **info):
+        self.sessions.setdefault(session_id, {}).update({k: str(v) for k, v in info.items()})
+
+    def add_edge(self, from_session, to_session, transform):
+        """Store the world transform taking coordinates in `from_session` to `to_session`."""
+        self.edges = [e for e in self.edges if {e["from"], e["to"]} != {from_session, to_session}]
+        self.edges.append({"from": from_session, "to": to_session, "transform": np.asarray(transform, dtype=float).tolist()})
+
+    def find_transform(self, from_session, to_session):
+        """Compose cached edges into the world transform from one session to another (None if not connected)."""
+        if from_session == to_session:
+            return np.eye(4)
+        neighbours = {}
+        for edge in self.edges:
+            transform = np.asarray(edge["transform"])
+            neighbours.setdefault(edge["from"], []).append((edge["to"], transform))
+            neighbours.setdefault(edge["to"], []).append((edge["from"], np.linalg.inv(transform)))
+
+        # breadth first search, so the fewest registrations are chained together
+        visited = {from_session: np.eye(4)}
+        queue = deque([from_session])
+        while queue:
+            session = queue.popleft()
+            for neighbour, transform in neighbours.get(session, []):
+                if neighbour in visited:
+                    continue
+                visited[neighbour] = transform @ visited[session]
+                if neighbour == to_session:
+                    return visited[neighbour]
+                queue.append(neighbour)
+        return None
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with save_lock, file_lock(self.path.with_suffix('.json.lock')):
+            # pick up anything another run added since this graph was loaded
+            if self.path.exists():
+                saved = TransformGraph(self.path)
+                ours = {frozenset((e["from"], e["to"])) for e in self.edges}
+                self.edges += [e for e in saved.edges if frozenset((e["from"], e["to"])) not in ours]
+                self.sessions = {**saved.sessions, **self.sessions}
+            tmp_path = self.path.with_suffix(f'.json.{os.getpid()}.tmp')
+            with open(tmp_path, 'w') as fp:
+                json.dump({"participant": self.participant, "sessions": self.sessions, "edges": self.edges}, fp, indent=2)
+            os.replace(tmp_path, self.path)
+
+def propagate_voxel(graph, from_session, to_session, spec_nifti, out_nifti):
+    """Carry a spectroscopy voxel from one session into another using only cached registrations."""
+    transform = graph.find_transform(from_session, to_session)
+    if transform is None:
+        raise Exception(f"No chain of registrations connects {from_session} to {to_session}")
+    spec_nii = nib.load(spec_nifti)
+    new_affine = transform @ spec_nii.affine
+    spec_nii.set_sform(new_affine,code='unknown')
+    spec_nii.set_qform(new_affine,code='scanner')
+    nib.save(spec_nii, out_nifti)
+    return spec_nii
@@ -22,10 +22,13 @@
 import os
 import sys
 import shutil
+import glob
+import tempfile
 import numpy as np
 import math
 import nibabel as nib
 from pathlib import Path
+from voxalign.scheduler import run_tool
 
 def get_unique_filename(filename,extension):
     path = Path(filename+extension)
@@ -35,42 +38,166 @@ def get_unique_filename(filename,extension):
         counter += 1
     return str(path)
 
-def check_external_tools():
-    """Check if FSL, dcm2niix, and spec2nii are installed and available."""
-    # Check if FSL is installed
-    if os.getenv('FSLDIR') is None:
-        print("Error: FSLDIR environment variable is not set. Please install FSL and set FSLDIR.")
-        sys.exit(1)
+def claim_unique_filename(filename,extension):
+    """Like get_unique_filename, but atomically creates the file so concurrent callers never get the same name."""
+    counter = 1
+    while True:
+        path = Path(filename+extension) if counter == 1 else Path(f"{filename}_{counter}{extension}")
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return str(path)
+        except FileExistsError:
+            counter += 1
 
-    if shutil.which("flirt") is None or shutil.which("bet2") is None:
-        print("Error: FSL commands (flirt or bet2) not found in PATH.")
-        sys.exit(1)
+def convert_spec_dicom(dicomfile,outdir):
+    """Convert a spectroscopy DICOM to NIFTI in outdir, without overwriting existing files.
 
-    # Check if dcm2niix is available
-    if shutil.which("dcm2niix") is None:
-        print("Error: dcm2niix is not installed or not found in PATH.")
-        sys.exit(1)
+    Each conversion runs in its own temporary folder, so several can run at once in the same outdir.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    workspace = tempfile.mkdtemp(prefix='tmp_', dir=outdir)
+    try:
+        command = f"spec2nii 'dicom' -o '{workspace}' {dicomfile}"
+        result = run_tool(command, check=True)
+
+        #start by placing spec niftis in a temp folder so we can make sure not to overwrite
+        tmp_nifti = glob.glob(f'{workspace}/*')[0]
+        suffix = ''.join(Path(tmp_nifti).suffixes)
+        roi=Path(tmp_nifti.removesuffix(suffix)).stem
+        #if a file already exists, append _2, _3, etc.
+        new_filename = claim_unique_filename(f'{outdir}/{roi}',suffix)
+        os.replace(tmp_nifti, new_filename)
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    return new_filename
+
+def compose_fsl_annot_text(colorlist,voxidx,coord):
+    # write out annotations file that FSL loads in to show crosshair(s) at selected coordinates
+    annotations_txt = f"X Point colour={colorlist[voxidx]} lineWidth=4 honourZLimits=True zmin={coord[0]-2} zmax={coord[0]+2} x={coord[1]} y={coord[2]} \
+                        \nY Point colour={colorlist[voxidx]} lineWidth=4 honourZLimits=True zmin={coord[1]-2} zmax={coord[1]+2} x={coord[0]} y={coord[2]} \
+                        \nZ Point colour={colorlist[voxidx]} lineWidth=4 honourZLimits=True zmin={coord[2]-2} zmax={coord[2]+2} x={coord[0]} y={coord[1]}\n"
+
+    return annotations_txt
+
+# external tools run by each pipeline
+PIPELINE_TOOLS = {
+    "align": ["dcm2niix", "spec2nii", "bet2", "flirt", "fast"],
+    "mni-lookup": ["dcm2niix", "robustfov", "bet2", "flirt", "fnirt", "convertwarp", "applywarp", "std2imgcoord", "img2imgcoord"],
+    "place": ["dcm2niix", "robustfov", "bet2", "flirt", "fnirt", "convertwarp", "invwarp", "applywarp", "fast"],
+    "dice": ["dcm2niix", "spec2nii", "bet2", "flirt"],
+}
+FSL_TOOLS = {"bet2", "flirt", "fnirt", "fast", "robustfov", "convertwarp", "invwarp", "applywarp", "std2imgcoord", "img2imgcoord", "convert_xfm"}
+
+def missing_external_tools(tools=("flirt", "bet2", "dcm2niix", "spec2nii")):
+    """Problems that would stop `tools` from running (FSLDIR not set, tools not in PATH), empty if there are none."""
+    problems = []
+    if FSL_TOOLS.intersection(tools) and os.getenv('FSLDIR') is None:
+        problems.append("FSLDIR environment variable is not set. Please install FSL and set FSLDIR.")
+    missing = [tool for tool in tools if shutil.which(tool) is None]
+    if missing:
+        problems.append(f"{', '.join(missing)} not installed or not found in PATH.")
+    return problems
 
-    # Check if spec2nii is available
-    if shutil.which("spec2nii") is None:
-        print("Error: spec2nii is not installed or not found in PATH.")
+def check_external_tools(tools=("flirt", "bet2", "dcm2niix", "spec2nii")):
+    """Check if FSL, dcm2niix, and spec2nii (or the given `tools`) are installed and available."""
+    problems = missing_external_tools(tools)
+    for problem in problems:
+        print(f"Error: {problem}")
+    if problems:
         sys.exit(1)
 
-    print("All external dependencies (FSL, dcm2niix, spec2nii) are installed.")
+    print(f"All external dependencies ({', '.join(tools)}) are installed.")
+
+def sample_volume(data, vox_coords):
+    """Trilinearly interpolate a 3D array at an (N, 3) array of voxel coordinates (0 outside the array)."""
+    vox_coords = np.asarray(vox_coords, dtype=float)
+    corner = np.floor(vox_coords).astype(int)
+    frac = vox_coords - corner
+    shape = np.array(data.shape[:3])
+    values = np.zeros(len(vox_coords))
+    for offset in np.ndindex(2, 2, 2):
+        idx = corner + offset
+        weight = np.prod(np.where(offset, frac, 1 - frac), axis=1)
+        inside = np.all((idx >= 0) & (idx < shape), axis=1)
+        idx = np.clip(idx, 0, shape - 1)
+        values += weight * inside * data[idx[:, 0], idx[:, 1], idx[:, 2]]
+    return values
 
 def vox_to_scaled_FSL_vox(nib_nii):
-    flirt_scaling_mat = np.diag(list(nib_nii.header.get_zooms()) + [1.0])
+    flirt_scaling_mat = np.diag(list(nib_nii.header.get_zooms()[:3]) + [1.0])
 
     if np.linalg.det(nib_nii.affine) > 0:
-        i_dim=np.shape(nib_nii.get_fdata())[0]
+        # the flip is in voxels, before scaling, so that x = (i_dim - 1 - i) * voxel size
+        i_dim=nib_nii.shape[0]
         flirtflip_mat =  [[-1, 0, 0, i_dim - 1],[ 0, 1, 0, 0], [ 0, 0, 1, 0], [ 0, 0, 0, 1]]
     else:
         flirtflip_mat = np.eye(4)
     
-    vox_to_FSLvox_aff = flirtflip_mat @ flirt_scaling_mat
+    vox_to_FSLvox_aff = flirt_scaling_mat @ flirtflip_mat
     
     return vox_to_FSLvox_aff
 
+def rotation_matrix(angles):
+    """Rotation about the x, y and z axes (in that order) by `angles` in degrees."""
+    ax, ay, az = np.radians(angles)
+    rx = np.array([[1, 0, 0], [0, np.cos(ax), -np.sin(ax)], [0, np.sin(ax), np.cos(ax)]])
+    ry = np.array([[np.cos(ay), 0, np.sin(ay)], [0, 1, 0], [-np.sin(ay), 0, np.cos(ay)]])
+    rz = np.array([[np.cos(az), -np.sin(az), 0], [np.sin(az), np.cos(az), 0], [0, 0, 1]])
+    return rz @ ry @ rx
+
+def flirt_matrix_to_world(flirt_mat, src_nii, ref_nii):
+    """Convert a flirt matrix (scaled FSL voxel coordinates) to a transform between world coordinates."""
+    return ref_nii.affine @ np.linalg.inv(vox_to_scaled_FSL_vox(ref_nii)) @ flirt_mat @ vox_to_scaled_FSL_vox(src_nii) @ np.linalg.inv(src_nii.affine)
+
+def world_to_flirt_matrix(world_transform, src_nii, ref_nii):
+    """Convert a transform between world coordinates to a flirt matrix, e.g. to pass to flirt -init."""
+    return vox_to_scaled_FSL_vox(ref_nii) @ np.linalg.inv(ref_nii.affine) @ world_transform @ src_nii.affine @ np.linalg.inv(vox_to_scaled_FSL_vox(src_nii))
+
+def spec_grid_shape(nii):
+    """Number of spectroscopy voxels along x, y and z, (1, 1, 1) for single voxel data."""
+    return tuple(int(n) for n in (tuple(nii.shape[:3]) + (1, 1, 1))[:3])
+
+def voxel_centre(affine, shape=(1, 1, 1)):
+    """World coordinates of the centre of a spectroscopy voxel, or of the slab of a grid."""
+    return nib.affines.apply_affine(affine, (np.asarray(shape[:3]) - 1) / 2)
+
+def grid_voxel_centres(affine, shape):
+    """World coordinates (N, 3) of the centre of every voxel of a spectroscopy grid, with (i, j, k) in C order."""
+    return nib.affines.apply_affine(affine, np.indices(shape[:3]).reshape(3, -1).T)
+
+def write_grid_correspondence(filename, previous_affine, new_affine, shape):
+    """Write the previous and new world position of every voxel of a spectroscopy grid to a CSV file."""
+    index = np.indices(shape[:3]).reshape(3, -1).T
+    previous = grid_voxel_centres(previous_affine, shape)
+    new = grid_voxel_centres(new_affine, shape)
+    table = np.column_stack([index, previous, new, np.linalg.norm(new - previous, axis=1)])
+    np.savetxt(filename, table, delimiter=',', fmt=['%d'] * 3 + ['%.2f'] * 7,
+               header='i,j,k,previous_x,previous_y,previous_z,new_x,new_y,new_z,displacement_mm', comments='')
+
+def format_prescription(nii):
+    """The lines of a voxel (or slab) prescription as they are shown to the scanner operator."""
+    slice_orientation_pitch,inplane_rot,[dimX,dimY,dimZ] = calc_prescription_from_nifti(nii)
+    shape = spec_grid_shape(nii)
+    transvec = convert_signs_to_letters(np.round(voxel_centre(nii.affine, shape),1))
+    lines = [f'Position: {transvec}',
+             f"Orientation: {slice_orientation_pitch}",
+             f"Rotation: {inplane_rot:.2f} deg"]
+    if shape == (1, 1, 1):
+        lines.append(f"Dimensions: {dimX} mm x {dimY} mm x {dimZ} mm")
+    else:
+        # for CSI the position is the centre of the slab, which is what the scanner asks for
+        lines.append(f"Grid: {shape[0]} x {shape[1]} x {shape[2]} voxels of {dimX} mm x {dimY} mm x {dimZ} mm")
+        lines.append(f"Slab: {dimX*shape[0]} mm x {dimY*shape[1]} mm x {dimZ*shape[2]} mm")
+    return lines
+
+def voxel_displacement(affine_a, affine_b, shape=(1, 1, 1)):
+    """Distance (mm) between two voxel (or slab) centres and the angle (deg) between their orientations."""
+    distance = np.linalg.norm(voxel_centre(affine_b, shape) - voxel_centre(affine_a, shape))
+    rot_a = affine_a[:3,:3] / np.linalg.norm(affine_a[:3,:3], axis=0)
+    rot_b = affine_b[:3,:3] / np.linalg.norm(affine_b[:3,:3], axis=0)
+    angle = np.degrees(np.arccos(np.clip((np.trace(rot_b @ rot_a.T) - 1) / 2, -1, 1)))
+    return float(distance), float(angle)
 
 def calc_inplane_rot(orientation_matrix, vox_orient):
     # adapted from Dr. Georg Oeltzschner's https://github.com/richardedden/Gannet3.0/blob/master/GannetMask_SiemensRDA.m